@@ -0,0 +1,111 @@
+"""
+Controllo di ammissione per le richieste di analisi (CPU-bound).
+
+Una raffica di visite non deve accumulare analisi fino al timeout di tutte:
+oltre una profondità massima la richiesta è rifiutata subito, prima di
+leggere il corpo, con 503 e Retry-After (stimato dalla durata media delle
+analisi). Le code dei job asincroni oltre il limite ricevono 429.
+Dimensione del caricamento e durata della registrazione sono verificate
+prima della decodifica (Content-Length, byte ricevuti e intestazione WAV).
+
+Login e letture dei dashboard non passano di qui e non competono con le
+analisi: il numero di richieste di analisi contemporanee è limitato.
+
+Configurazione da variabili d'ambiente:
+- ANALYSIS_MAX_QUEUE: richieste di analisi in attesa oltre i worker (default 2 × worker)
+- MAX_UPLOAD_MB: dimensione massima di una registrazione (default 50)
+- MAX_BATCH_MB: dimensione massima di una richiesta /visit_batch (default 500)
+- MAX_AUDIO_SECONDS: durata massima di una registrazione (default 600)
+- MAX_JOB_QUEUE: job asincroni in coda oltre i quali /visit_jobs risponde 429 (default 500)
+"""
+import math
+import os
+
+
+class Rejection(Exception):
+    """Richiesta non ammessa: status HTTP, messaggio ed eventuale Retry-After in secondi"""
+
+    def __init__(self, status_code, detail, retry_after=None, reason=""):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+        self.reason = reason
+
+    def headers(self):
+        if self.retry_after is None:
+            return {}
+        return {"Retry-After": str(self.retry_after)}
+
+
+def _retry_after(seconds):
+    return int(min(max(math.ceil(seconds), 1), 300))
+
+
+class AdmissionControl:
+    """Limiti di coda, dimensione e durata per le richieste di analisi"""
+
+    def __init__(self, pool, max_queue=None, max_upload_bytes=50 * 1024 * 1024,
+                 max_batch_bytes=500 * 1024 * 1024, max_audio_seconds=600.0, max_job_queue=500):
+        self.pool = pool
+        self.max_queue = max_queue if max_queue is not None else 2 * pool.max_workers
+        self.max_upload_bytes = max_upload_bytes
+        self.max_batch_bytes = max_batch_bytes
+        self.max_audio_seconds = max_audio_seconds
+        self.max_job_queue = max_job_queue
+        self.in_flight = 0
+
+    @property
+    def capacity(self):
+        """Richieste di analisi contemporanee ammesse (in esecuzione + in coda)"""
+        return self.pool.max_workers + self.max_queue
+
+    def check_size(self, content_length, batch=False):
+        """413 se il corpo dichiarato supera il limite (registrazione singola o batch)"""
+        limit = self.max_batch_bytes if batch else self.max_upload_bytes
+        if content_length is not None and content_length > limit:
+            raise Rejection(
+                413, f"Caricamento oltre il limite di {limit // (1024 * 1024)} MB", reason="dimensione"
+            )
+
+    def check_duration(self, seconds):
+        """413 se la registrazione (dall'intestazione WAV) supera la durata massima"""
+        if self.max_audio_seconds > 0 and seconds > self.max_audio_seconds:
+            raise Rejection(
+                413, f"Registrazione oltre il limite di {self.max_audio_seconds:g} s", reason="durata"
+            )
+
+    def admit(self):
+        """Ammette una richiesta di analisi o solleva 503 con Retry-After; va seguito da release()"""
+        # Anche job asincroni e file dei batch attendono nel pool: la sua coda conta comunque
+        if self.in_flight >= self.capacity or self.pool.waiting >= max(self.max_queue, 1):
+            raise Rejection(
+                503, "Troppe analisi in corso, riprovare più tardi",
+                retry_after=_retry_after(self.pool.estimated_wait()), reason="coda_analisi"
+            )
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+
+    def check_job_queue(self, depth):
+        """429 con Retry-After se la coda dei job asincroni è piena"""
+        if depth >= self.max_job_queue:
+            wait = depth / self.pool.max_workers * (self.pool.mean_run_seconds or 5.0)
+            raise Rejection(
+                429, "Coda dei job piena, riprovare più tardi",
+                retry_after=_retry_after(wait), reason="coda_job"
+            )
+
+
+def admission_from_env(pool):
+    """Crea il controllo di ammissione leggendo le variabili d'ambiente documentate sopra"""
+    max_queue = os.environ.get("ANALYSIS_MAX_QUEUE")
+    return AdmissionControl(
+        pool,
+        max_queue=int(max_queue) if max_queue else None,
+        max_upload_bytes=int(float(os.environ.get("MAX_UPLOAD_MB", "50")) * 1024 * 1024),
+        max_batch_bytes=int(float(os.environ.get("MAX_BATCH_MB", "500")) * 1024 * 1024),
+        max_audio_seconds=float(os.environ.get("MAX_AUDIO_SECONDS", "600")),
+        max_job_queue=int(os.environ.get("MAX_JOB_QUEUE", "500")),
+    )
@@ -0,0 +1,178 @@
+"""
+Pool di processi per l'analisi Praat, usabile da endpoint async.
+
+Ogni worker è un processo separato collegato con una Pipe: l'analisi
+CPU-bound non tiene il GIL del server né uno slot del threadpool FastAPI,
+e l'event loop attende il risultato senza bloccarsi (add_reader sul file
+descriptor della pipe, quindi solo su event loop Unix).
+
+Un job che supera il timeout, o un worker che muore su audio patologico,
+causa il kill del processo e la sua sostituzione con un worker nuovo.
+
+Configurazione da variabili d'ambiente:
+- ANALYSIS_WORKERS: numero massimo di worker (default: numero di CPU)
+- ANALYSIS_TIMEOUT: timeout per job in secondi (default: 120)
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+
+
+class AnalysisError(Exception):
+    """Errore sollevato dalla funzione di analisi dentro il worker"""
+
+
+class AnalysisTimeout(AnalysisError):
+    """Il job ha superato il timeout: il worker è stato terminato e sostituito"""
+
+
+class WorkerCrashed(AnalysisError):
+    """Il worker è terminato durante il job ed è stato sostituito"""
+
+
+def _worker_main(conn):
+    """Loop del processo worker: riceve (fn, args, kwargs), risponde (stato, valore)"""
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+
+        fn, args, kwargs = job
+        try:
+            conn.send(("ok", fn(*args, **kwargs)))
+        except Exception as e:
+            # Le eccezioni viaggiano come testo: non tutte sono serializzabili
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def stop(self, timeout=1.0):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class AnalysisPool:
+    """Pool limitato di processi worker con timeout per job"""
+
+    def __init__(self, max_workers=None, timeout=120.0, start_method="spawn"):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        # Durata media (media mobile esponenziale) dei job riusciti, per stimare l'attesa
+        self.mean_run_seconds = None
+        self.replaced_workers = 0
+        self._ctx = multiprocessing.get_context(start_method)
+        self._workers = []
+        self._idle = None
+
+    def _ensure_started(self):
+        # Avvio pigro: la coda va creata dentro l'event loop che la userà
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for _ in range(self.max_workers):
+                worker = _Worker(self._ctx)
+                self._workers.append(worker)
+                self._idle.put_nowait(worker)
+
+    def _replace(self, worker):
+        worker.kill()
+        self._workers.remove(worker)
+        fresh = _Worker(self._ctx)
+        self._workers.append(fresh)
+        self.replaced_workers += 1
+        return fresh
+
+    async def _receive(self, worker):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        fd = worker.conn.fileno()
+        loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            loop.remove_reader(fd)
+        # I risultati sono piccoli dict: una volta leggibile, recv non blocca a lungo
+        return worker.conn.recv()
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Esegue fn(*args, **kwargs) in un worker e ne restituisce il risultato.
+
+        fn deve essere una funzione di modulo importabile (pickle). Solleva
+        AnalysisTimeout, WorkerCrashed o AnalysisError.
+        """
+        self._ensure_started()
+        self.waiting += 1
+        try:
+            worker = await self._idle.get()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        completed = False
+        start = time.monotonic()
+        try:
+            worker.conn.send((fn, args, kwargs))
+            status, payload = await asyncio.wait_for(self._receive(worker), self.timeout)
+            completed = True
+            self._observe_run(time.monotonic() - start)
+        except asyncio.TimeoutError:
+            raise AnalysisTimeout(f"Analisi oltre il limite di {self.timeout:g} s") from None
+        except (EOFError, OSError) as e:
+            raise WorkerCrashed("Worker di analisi terminato inaspettatamente") from e
+        finally:
+            # Timeout, crash o richiesta annullata: il worker potrebbe avere ancora
+            # un job in corso, quindi non torna nel pool e viene sostituito
+            if not completed:
+                worker = self._replace(worker)
+            self.in_flight -= 1
+            self._idle.put_nowait(worker)
+
+        if status == "error":
+            raise AnalysisError(payload)
+        return payload
+
+    def _observe_run(self, seconds):
+        if self.mean_run_seconds is None:
+            self.mean_run_seconds = seconds
+        else:
+            self.mean_run_seconds += 0.2 * (seconds - self.mean_run_seconds)
+
+    def estimated_wait(self, default_run_seconds=5.0):
+        """Secondi stimati prima che un nuovo job in coda venga completato"""
+        run_seconds = self.mean_run_seconds or default_run_seconds
+        return (self.waiting / self.max_workers + 1) * run_seconds
+
+    def shutdown(self):
+        """Ferma tutti i worker (da chiamare allo spegnimento del server)"""
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+        self._idle = None
+
+
+def pool_from_env():
+    """Crea il pool leggendo ANALYSIS_WORKERS e ANALYSIS_TIMEOUT"""
+    workers = int(os.environ.get("ANALYSIS_WORKERS", "0")) or None
+    timeout = float(os.environ.get("ANALYSIS_TIMEOUT", "120"))
+    return AnalysisPool(max_workers=workers, timeout=timeout)
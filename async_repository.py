@@ -0,0 +1,248 @@
+"""
+Accesso asincrono ai dati per l'API (main.py).
+
+Stessa interfaccia di repository.py, con metodi coroutine:
+- AsyncSupabaseRepository: client Supabase asincrono. Tutte le richieste
+  passano da un unico httpx.AsyncClient con pool di connessioni keep-alive:
+  una richiesta in attesa del database non occupa un thread e le query
+  indipendenti possono essere in volo insieme (asyncio.gather) riusando
+  poche connessioni TLS già aperte.
+- ThreadedRepository: un repository sincrono (SQLite locale) eseguito in
+  un gruppo di thread dedicato e limitato, separato dal threadpool di
+  FastAPI e dai thread delle visite.
+
+Configurazione da variabili d'ambiente:
+- STORAGE_BACKEND, SQLITE_PATH: come in repository.py
+- SUPABASE_MAX_CONNECTIONS: connessioni HTTP massime verso Supabase (default 50)
+- SUPABASE_TIMEOUT_SECONDS: timeout di una richiesta (default 30)
+- SQLITE_THREADS: thread per il backend SQLite (default 4)
+"""
+import asyncio
+import functools
+import os
+
+import httpx
+from anyio import CapacityLimiter, to_thread
+
+from repository import (
+    DELETE_CHUNK, MEASUREMENT_CURSOR, PAGE_SIZE, PATIENT_CURSOR, DuplicateError, SqliteRepository, _page,
+    _with_keys, decode_cursor,
+)
+
+# Aggiornamenti di pazienti diversi in volo insieme (PostgREST non ha un update multiplo)
+MAX_PARALLEL_UPDATES = 10
+
+
+class AsyncSupabaseRepository:
+    """Backend sul client Supabase asincrono (anche strumentato, vedi metrics.InstrumentedAsyncSupabase)"""
+
+    def __init__(self, client, http_client=None, page_size=PAGE_SIZE):
+        self.client = client
+        self.page_size = page_size
+        # Pool HTTP condiviso, chiuso da aclose()
+        self.http_client = http_client
+
+    async def aclose(self):
+        if self.http_client is not None:
+            await self.http_client.aclose()
+
+    def _select(self, table, columns=None, **filters):
+        query = self.client.table(table).select(", ".join(columns) if columns else "*")
+        for name, value in filters.items():
+            query = query.eq(name, value)
+        return query
+
+    async def _insert(self, table, rows):
+        try:
+            return (await self.client.table(table).insert(rows).execute()).data
+        except Exception as e:
+            if "duplicate" in str(e).lower():
+                raise DuplicateError(str(e)) from e
+            raise
+
+    # Pazienti
+
+    async def get_patient(self, codice_fiscale, columns=None, **filters):
+        data = (await self._select("patients", columns, codice_fiscale=codice_fiscale, **filters).execute()).data
+        return data[0] if data else None
+
+    async def get_patients(self, codici_fiscali, columns=None):
+        codici_fiscali = sorted(set(codici_fiscali))
+        if not codici_fiscali:
+            return []
+        return (await self._select("patients", columns).in_("codice_fiscale", codici_fiscali).execute()).data
+
+    async def list_patients(self, doctor_username=None, columns=None):
+        filters = {"doctor_username": doctor_username} if doctor_username else {}
+        return (await self._select("patients", columns, **filters).execute()).data
+
+    async def insert_patient(self, row):
+        await self._insert("patients", row)
+
+    async def update_patient(self, codice_fiscale, values):
+        await self.client.table("patients").update(values).eq("codice_fiscale", codice_fiscale).execute()
+
+    async def set_missing_baselines(self, baselines):
+        """
+        Baseline solo ai pazienti che non l'hanno ancora (condizione nel
+        database), fino a MAX_PARALLEL_UPDATES aggiornamenti in volo insieme
+        """
+        semaphore = asyncio.Semaphore(MAX_PARALLEL_UPDATES)
+
+        async def update(codice_fiscale, updrs):
+            async with semaphore:
+                await self.client.table("patients").update({"baseline_updrs": updrs}).eq(
+                    "codice_fiscale", codice_fiscale
+                ).is_("baseline_updrs", "null").execute()
+
+        await asyncio.gather(*(update(cf, updrs) for cf, updrs in baselines.items()))
+
+    # Medici
+
+    async def find_doctor(self, columns=None, **filters):
+        data = (await self._select("doctors", columns, **filters).limit(1).execute()).data
+        return data[0] if data else None
+
+    async def list_doctors(self, columns=None):
+        return (await self._select("doctors", columns).execute()).data
+
+    async def insert_doctor(self, row):
+        await self._insert("doctors", row)
+
+    async def update_doctor(self, username, values):
+        await self.client.table("doctors").update(values).eq("username", username).execute()
+
+    # Misurazioni
+
+    async def insert_measurements(self, rows):
+        if rows:
+            await self._insert("measurements", list(rows))
+
+    async def insert_measurements_once(self, rows):
+        if rows:
+            await self.client.table("measurements").upsert(
+                list(rows), on_conflict="client_id", ignore_duplicates=True
+            ).execute()
+
+    async def measurements_page(self, codice_fiscale, columns=None, cursor=None, limit=PAGE_SIZE,
+                                since=None, until=None, descending=False):
+        query = self._select("measurements", _with_keys(columns, ("timestamp", "id")), codice_fiscale=codice_fiscale)
+        if since:
+            query = query.gte("timestamp", since)
+        if until:
+            query = query.lt("timestamp", until)
+        if cursor:
+            timestamp, last_id = decode_cursor(cursor, MEASUREMENT_CURSOR)
+            op = "lt" if descending else "gt"
+            query = query.or_(f'timestamp.{op}."{timestamp}",and(timestamp.eq."{timestamp}",id.{op}.{last_id})')
+        rows = (await query.order("timestamp", desc=descending).order("id", desc=descending).limit(
+            limit + 1
+        ).execute()).data
+        return _page(rows, limit, ("timestamp", "id"))
+
+    async def patients_page(self, doctor_username=None, columns=None, cursor=None, limit=PAGE_SIZE):
+        filters = {"doctor_username": doctor_username} if doctor_username else {}
+        query = self._select("patients", _with_keys(columns, ("codice_fiscale",)), **filters)
+        if cursor:
+            query = query.gt("codice_fiscale", decode_cursor(cursor, PATIENT_CURSOR)[0])
+        rows = (await query.order("codice_fiscale").limit(limit + 1).execute()).data
+        return _page(rows, limit, ("codice_fiscale",))
+
+    # Aggregati per paziente
+
+    async def get_aggregate(self, codice_fiscale, columns=None):
+        data = (await self._select("patient_aggregates", columns, codice_fiscale=codice_fiscale).execute()).data
+        return data[0] if data else None
+
+    async def get_aggregates(self, codici_fiscali, columns=None):
+        codici_fiscali = sorted(set(codici_fiscali))
+        if not codici_fiscali:
+            return []
+        return (await self._select("patient_aggregates", columns).in_(
+            "codice_fiscale", codici_fiscali
+        ).execute()).data
+
+    async def replace_aggregates(self, rows):
+        """Come SupabaseRepository.replace_aggregates: upsert, poi via le righe non ricalcolate"""
+        rows = list(rows)
+        for i in range(0, len(rows), self.page_size):
+            await self.client.table("patient_aggregates").upsert(
+                rows[i:i + self.page_size], on_conflict="codice_fiscale"
+            ).execute()
+        rebuilt = {row["codice_fiscale"] for row in rows}
+        stale = [cf for cf in await self._aggregate_keys() if cf not in rebuilt]
+        for i in range(0, len(stale), DELETE_CHUNK):
+            await self.client.table("patient_aggregates").delete().in_(
+                "codice_fiscale", stale[i:i + DELETE_CHUNK]
+            ).execute()
+
+    async def _aggregate_keys(self):
+        keys = []
+        start = 0
+        while True:
+            page = (await self._select("patient_aggregates", ["codice_fiscale"]).order("codice_fiscale").range(
+                start, start + self.page_size - 1
+            ).execute()).data
+            keys.extend(row["codice_fiscale"] for row in page)
+            if len(page) < self.page_size:
+                return keys
+            start += self.page_size
+
+    async def measurements_after(self, last_id, limit, columns=None):
+        query = self._select("measurements", columns)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        return (await query.order("id").limit(limit).execute()).data
+
+    async def upsert_measurements(self, rows):
+        if rows:
+            await self.client.table("measurements").upsert(list(rows), on_conflict="id").execute()
+
+
+class ThreadedRepository:
+    """
+    Repository sincrono con interfaccia asincrona: ogni metodo gira in uno
+    dei `threads` thread riservati (per SQLite, dove le query sono locali e brevi).
+    """
+
+    def __init__(self, repository, threads=4):
+        self.repository = repository
+        # Creato dentro l'event loop (async_repository_from_env è una coroutine)
+        self._limiter = CapacityLimiter(threads)
+
+    def __getattr__(self, name):
+        method = getattr(self.repository, name)
+
+        async def run(*args, **kwargs):
+            return await to_thread.run_sync(functools.partial(method, *args, **kwargs), limiter=self._limiter)
+        return run
+
+    async def aclose(self):
+        pass
+
+
+def http_client_from_env():
+    """Pool HTTP condiviso verso Supabase (SUPABASE_MAX_CONNECTIONS, SUPABASE_TIMEOUT_SECONDS)"""
+    max_connections = int(os.environ.get("SUPABASE_MAX_CONNECTIONS", "50"))
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        timeout=float(os.environ.get("SUPABASE_TIMEOUT_SECONDS", "30")),
+    )
+
+
+async def async_repository_from_env(supabase_client=None):
+    """
+    Backend asincrono scelto da STORAGE_BACKEND. `supabase_client` è una
+    coroutine che riceve il pool HTTP e crea il client asincrono: chiamata
+    solo per il backend Supabase. Va chiamata dentro l'event loop (avvio dell'app).
+    """
+    backend = os.environ.get("STORAGE_BACKEND", "supabase").lower()
+    if backend == "sqlite":
+        return ThreadedRepository(
+            SqliteRepository(os.environ.get("SQLITE_PATH", "telemonitoring.sqlite3")),
+            int(os.environ.get("SQLITE_THREADS", "4")),
+        )
+    if backend != "supabase":
+        raise ValueError(f"STORAGE_BACKEND sconosciuto: {backend}")
+    http_client = http_client_from_env()
+    return AsyncSupabaseRepository(await supabase_client(http_client), http_client)
@@ -0,0 +1,168 @@
+"""
+Decodifica audio in memoria, senza file temporanei.
+
+I WAV caricati vengono letti direttamente dai byte della richiesta in un
+array NumPy e passati a parselmouth.Sound(values, sampling_frequency):
+nessuna scrittura su disco, quindi funziona anche su filesystem in sola
+lettura o con tmpfs limitato.
+
+Per le registrazioni lunghe open_wav espone il chunk dei campioni senza
+decodificarlo (memory map per i file su disco, memoryview per i byte) e
+read_frames decodifica solo l'intervallo richiesto.
+"""
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Struttura di un WAV: formato dei campioni e posizione del chunk 'data'
+WavLayout = namedtuple(
+    "WavLayout", "fmt_tag channels sampling_frequency block_align data_offset n_frames"
+)
+
+
+def _parse_layout(read_at, total_size):
+    """Legge i chunk RIFF con read_at(offset, n) -> bytes fino al chunk 'data'"""
+    header = read_at(0, 12)
+    if len(header) < 12 or header[0:4] != b"RIFF" or header[8:12] != b"WAVE":
+        raise ValueError("il file non è un WAV (RIFF/WAVE)")
+
+    fmt = None
+    pos = 12
+    while pos + 8 <= total_size:
+        chunk = read_at(pos, 8)
+        chunk_id = chunk[0:4]
+        size = struct.unpack_from("<I", chunk, 4)[0]
+        body = pos + 8
+
+        if chunk_id == b"fmt ":
+            if size < 16:
+                raise ValueError("chunk 'fmt ' troppo corto")
+            fmt_chunk = read_at(body, min(size, 40))
+            fmt_tag, channels, rate, _, block_align, _ = struct.unpack_from("<HHIIHH", fmt_chunk)
+            if fmt_tag == WAVE_FORMAT_EXTENSIBLE and size >= 26:
+                # Il sotto-formato reale è nei primi 2 byte del GUID
+                fmt_tag = struct.unpack_from("<H", fmt_chunk, 24)[0]
+            if channels < 1 or block_align < channels:
+                raise ValueError("intestazione WAV non valida")
+            fmt = (fmt_tag, channels, rate, block_align)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("chunk 'data' prima di 'fmt '")
+            fmt_tag, channels, rate, block_align = fmt
+            # I registratori in streaming possono lasciare una dimensione errata: si tronca al file
+            data_size = min(size, total_size - body)
+            n_frames = data_size // block_align
+            if n_frames == 0:
+                raise ValueError("il file WAV non contiene campioni")
+            return WavLayout(fmt_tag, channels, float(rate), block_align, body, n_frames)
+
+        pos = body + size + (size & 1)
+
+    raise ValueError("chunk 'data' mancante")
+
+
+def _decode_frames(raw, fmt_tag, channels, block_align):
+    """Campioni interleaved -> array float64 (canali, campioni) in [-1, 1], scalati come Praat"""
+    width = block_align // channels
+    n_frames = len(raw) // block_align
+    raw = raw[:n_frames * block_align]
+
+    if fmt_tag == WAVE_FORMAT_PCM:
+        if width == 1:
+            values = (np.frombuffer(raw, dtype=np.uint8).astype(np.float64) - 128.0) / 128.0
+        elif width == 2:
+            values = np.frombuffer(raw, dtype="<i2") / 32768.0
+        elif width == 3:
+            b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+            ints = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+            values = ((ints ^ 0x800000) - 0x800000) / 8388608.0
+        elif width == 4:
+            values = np.frombuffer(raw, dtype="<i4") / 2147483648.0
+        else:
+            raise ValueError(f"PCM a {width * 8} bit non supportato")
+    elif fmt_tag == WAVE_FORMAT_IEEE_FLOAT:
+        if width == 4:
+            values = np.frombuffer(raw, dtype="<f4").astype(np.float64)
+        elif width == 8:
+            values = np.frombuffer(raw, dtype="<f8").astype(np.float64)
+        else:
+            raise ValueError(f"float a {width * 8} bit non supportato")
+    else:
+        raise ValueError(f"formato WAV non supportato (0x{fmt_tag:04x})")
+
+    return np.ascontiguousarray(values.reshape(n_frames, channels).T)
+
+
+def wav_layout(data):
+    """Struttura di un WAV dai suoi byte, senza decodificare i campioni"""
+    view = memoryview(data)
+    return _parse_layout(lambda offset, n: bytes(view[offset:offset + n]), len(view))
+
+
+def open_wav(source):
+    """
+    Apre un WAV senza decodificarlo: `source` è un percorso (memory map del
+    chunk 'data') oppure i byte del file (memoryview, nessuna copia).
+    Ritorna (layout, buffer) da usare con read_frames.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        layout = wav_layout(source)
+        data_size = layout.n_frames * layout.block_align
+        buffer = memoryview(source)[layout.data_offset:layout.data_offset + data_size]
+        return layout, buffer
+
+    with open(source, "rb") as f:
+        def read_at(offset, n):
+            f.seek(offset)
+            return f.read(n)
+        f.seek(0, 2)
+        layout = _parse_layout(read_at, f.tell())
+
+    buffer = np.memmap(
+        source, dtype=np.uint8, mode="r",
+        offset=layout.data_offset, shape=(layout.n_frames * layout.block_align,)
+    )
+    return layout, buffer
+
+
+def read_frames(buffer, layout, start, stop):
+    """Decodifica solo i frame [start, stop) -> array float64 (canali, campioni)"""
+    stop = min(stop, layout.n_frames)
+    raw = buffer[start * layout.block_align:stop * layout.block_align]
+    return _decode_frames(raw, layout.fmt_tag, layout.channels, layout.block_align)
+
+
+def decode_wav(data):
+    """
+    Decodifica un WAV (PCM 8/16/24/32 bit o float 32/64 bit) dai suoi byte.
+
+    Ritorna (samples, sampling_frequency) con samples float64 di forma
+    (canali, campioni), pronta per parselmouth.Sound(samples, sampling_frequency).
+    Solleva ValueError se i byte non sono un WAV supportato.
+    """
+    layout, buffer = open_wav(data)
+    return read_frames(buffer, layout, 0, layout.n_frames), layout.sampling_frequency
+
+
+def encode_wav(samples, sampling_frequency):
+    """
+    Codifica campioni float in [-1, 1] (forma (canali, campioni) o (campioni,))
+    come WAV PCM 16 bit, il formato tipico delle registrazioni caricate.
+    """
+    samples = np.atleast_2d(np.asarray(samples, dtype=np.float64))
+    channels, n_frames = samples.shape
+    ints = np.clip(np.round(samples.T * 32768.0), -32768, 32767).astype("<i2")
+    data = ints.tobytes()
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + len(data), b"WAVE",
+        b"fmt ", 16, WAVE_FORMAT_PCM, channels, int(sampling_frequency),
+        int(sampling_frequency) * channels * 2, channels * 2, 16,
+        b"data", len(data)
+    )
+    return header + data
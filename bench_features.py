@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Benchmark estrazione feature vocali.
+
+Confronta, su uno o più file WAV, la lettura dei contorni frame per frame
+(get_value / get_value_at_time, implementazione storica) con la lettura
+vettoriale NumPy di vocal_analysis, separata dal calcolo di Pitch e
+Intensity in Praat che domina il costo dei contorni, e riporta la
+ripartizione dei tempi per stage della pipeline completa.
+
+Con --sintetico misura invece la pipeline di produzione (byte WAV ->
+feature -> UPDRS) su un corpus di vocali sintetiche generate in NumPy, a
+varie durate e frequenze di campionamento, e scrive un report JSON
+confrontabile tra versioni dell'estrattore. Ogni caso è misurato con il
+range di pitch fisso (75-500 Hz) e con quello adattivo (sesso, età e prima
+stima di F0), riportando speedup e scarti delle feature.
+
+Il range adattivo sposta l'UPDRS di circa ±1 punto rispetto al range fisso
+(jitter e PPE dipendono dai periodi trovati): oltre --tolleranza-updrs punti
+su un caso il benchmark termina con codice 1, così un cambio dell'estrattore
+che altera i punteggi non passa inosservato. Lo scarto tra frequenze di
+campionamento (ad es. 15.74 a 16 kHz contro 13.37 a 44.1 kHz sulla stessa
+voce) è dell'estrattore in sé ed è solo riportato.
+
+Uso:
+    python bench_features.py registrazione1.wav [registrazione2.wav ...]
+    python bench_features.py --sintetico [--durate 1 3 10] [--frequenze 16000 44100]
+                             [--ripetizioni 3] [--report bench_report.json]
+                             [--tolleranza-updrs 1.5]
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import parselmouth
+
+import synthetic_voice
+import vocal_analysis
+from updrs_model import compute_updrs
+
+
+def praat_contours(sound):
+    """Oggetti Intensity e Pitch calcolati da Praat (comuni alle due letture)"""
+    intensity = sound.to_intensity(time_step=vocal_analysis.TIME_STEP)
+    pitch = sound.to_pitch(
+        time_step=vocal_analysis.TIME_STEP,
+        pitch_floor=vocal_analysis.PITCH_FLOOR,
+        pitch_ceiling=vocal_analysis.PITCH_CEILING
+    )
+    return intensity, pitch
+
+
+def legacy_contours(intensity, pitch):
+    """Contorni di intensità e pitch letti frame per frame (versione storica)"""
+    intensity_values = [
+        intensity.get_value(t) for t in intensity.xs()
+        if not np.isnan(intensity.get_value(t))
+    ]
+    pitch_values = [
+        pitch.get_value_at_time(t) for t in pitch.xs()
+        if not np.isnan(pitch.get_value_at_time(t))
+    ]
+    return np.array(intensity_values), np.array(pitch_values)
+
+
+def vectorized_contours(intensity, pitch):
+    """Contorni di intensità e pitch letti come array interi"""
+    return vocal_analysis.intensity_contour(intensity), vocal_analysis.pitch_contour(pitch)
+
+
+def time_call(fn, *args, repeat=3):
+    """Miglior tempo (in secondi) su `repeat` esecuzioni"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_file(path):
+    sound = parselmouth.Sound(str(path))
+
+    praat_time, (intensity, pitch) = time_call(praat_contours, sound)
+    legacy_time, (legacy_int, legacy_pitch) = time_call(legacy_contours, intensity, pitch)
+    vector_time, (vector_int, vector_pitch) = time_call(vectorized_contours, intensity, pitch)
+
+    # Pipeline di produzione: decodifica, condizionamento e analisi
+    timings = {}
+    vocal_analysis.extract_features_from_path(path, timings=timings)
+
+    print("=" * 60)
+    print(f"{path} - durata {sound.duration:.1f} s @ {sound.sampling_frequency:.0f} Hz")
+    print("=" * 60)
+    print(f"Calcolo Pitch/Intensity:  {praat_time * 1000:9.2f} ms")
+    print(f"Lettura frame per frame:  {legacy_time * 1000:9.2f} ms")
+    print(f"Lettura vettoriale:       {vector_time * 1000:9.2f} ms")
+    print(f"Speedup lettura:          {legacy_time / max(vector_time, 1e-9):9.1f}x")
+    print(f"Speedup contorni:         {(praat_time + legacy_time) / max(praat_time + vector_time, 1e-9):9.2f}x")
+    same = (
+        legacy_int.shape == vector_int.shape and legacy_pitch.shape == vector_pitch.shape
+        and np.allclose(legacy_int, vector_int) and np.allclose(legacy_pitch, vector_pitch)
+    )
+    print(f"Contorni identici:        {'sì' if same else 'NO'}")
+    print()
+    print("Pipeline completa per stage:")
+    for stage, seconds in timings.items():
+        print(f"  {stage:<15} {seconds * 1000:9.2f} ms")
+    print(f"  {'totale':<15} {sum(timings.values()) * 1000:9.2f} ms")
+    print()
+
+    # Varianti di DFA e PPE a confronto (valore e costo della sola feature)
+    variant_timings = {}
+    variants = vocal_analysis.extract_features(
+        sound, timings=variant_timings, features=("dfa", "dfa_cv", "ppe_entropy", "ppe_ratio")
+    )
+    print("Varianti DFA / PPE:")
+    for name, value in variants.items():
+        print(f"  {name:<15} {value:9.4f}   {variant_timings[name] * 1000:9.2f} ms")
+    print()
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def synthetic_speaker(params):
+    """Paziente plausibile per una voce sintetica: maschile sotto i 165 Hz, 70 anni"""
+    return {"sex": 1 if params["f0"] < 165 else 0, "age": 70}
+
+
+def expected_jitter_abs(params):
+    """Jitter assoluto atteso: E|T(i) - T(i+1)| con periodi gaussiani indipendenti = 2σ/√π"""
+    return 2.0 * params["jitter"] / params["f0"] / np.sqrt(np.pi)
+
+
+def run_pipeline(wav, repeat, speaker):
+    """Mediana dei tempi (totale e per stage) su `repeat` esecuzioni e feature misurate"""
+    totals = []
+    stage_runs = []
+    features = None
+    for _ in range(repeat):
+        timings = {}
+        start = time.perf_counter()
+        features = vocal_analysis.extract_features_from_wav(wav, timings=timings, **speaker)
+        totals.append(time.perf_counter() - start)
+        stage_runs.append(timings)
+    return {
+        "totale_s": float(np.median(totals)),
+        "stage_s": {
+            stage: float(np.median([run.get(stage, 0.0) for run in stage_runs]))
+            for stage in stage_runs[0]
+        },
+        "feature": features,
+    }
+
+
+def bench_case(params, repeat):
+    """
+    Tempi di una vocale sintetica con range di pitch fisso e adattivo:
+    pipeline completa e singoli stage, feature misurate e loro scarti
+    """
+    wav = synthetic_voice.synthetic_wav(**params)
+    speaker = synthetic_speaker(params)
+
+    with vocal_analysis.pitch_range_mode(False):
+        fixed = run_pipeline(wav, repeat, speaker)
+    with vocal_analysis.pitch_range_mode(True):
+        adaptive = run_pipeline(wav, repeat, speaker)
+        prior = vocal_analysis.pitch_prior(**speaker)
+        refined = vocal_analysis.refine_pitch_range(vocal_analysis.sound_from_wav(wav), prior)
+
+    updrs_time, updrs = time_call(compute_updrs, fixed["feature"], repeat=max(repeat, 100))
+    adaptive_updrs = compute_updrs(adaptive["feature"])
+
+    return {
+        "parametri": params,
+        "paziente": speaker,
+        "byte_wav": len(wav),
+        **fixed,
+        "compute_updrs_s": updrs_time,
+        "motor_updrs": updrs,
+        "jitter_abs_atteso": expected_jitter_abs(params),
+        "pitch_adattivo": {
+            **adaptive,
+            "range_a_priori": list(prior),
+            "range_raffinato": [float(v) for v in refined],
+            "speedup": fixed["totale_s"] / max(adaptive["totale_s"], 1e-9),
+            "motor_updrs": adaptive_updrs,
+            "scarto_updrs": adaptive_updrs - updrs,
+            "scarti": {
+                name: adaptive["feature"][name] - fixed["feature"][name] for name in fixed["feature"]
+            },
+        },
+    }
+
+
+def bench_synthetic(durations, sampling_frequencies, repeat, report_path, updrs_tolerance):
+    """Esegue il corpus sintetico e scrive il report; False se lo scarto UPDRS supera la tolleranza"""
+    cases = synthetic_voice.corpus(durations, sampling_frequencies)
+    results = []
+    for params in cases:
+        result = bench_case(params, repeat)
+        results.append(result)
+        adaptive = result["pitch_adattivo"]
+        print(
+            f"f0 {params['f0']:5.0f} Hz  {params['duration']:5.1f} s @ {params['sampling_frequency']:6.0f} Hz"
+            f"  totale {result['totale_s'] * 1000:9.2f} ms  UPDRS {result['motor_updrs']:6.2f}"
+            f"  | pitch adattivo {adaptive['range_raffinato'][0]:.0f}-{adaptive['range_raffinato'][1]:.0f} Hz"
+            f"  speedup {adaptive['speedup']:5.2f}x  UPDRS {adaptive['motor_updrs']:6.2f}"
+        )
+
+    drifted = [
+        result for result in results
+        if abs(result["pitch_adattivo"]["scarto_updrs"]) > updrs_tolerance
+    ]
+
+    report = {
+        "versione_estrattore": vocal_analysis.EXTRACTOR_VERSION,
+        "revisione_git": _git_revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "parselmouth": parselmouth.__version__,
+        "ripetizioni": repeat,
+        "tolleranza_updrs": updrs_tolerance,
+        "casi_fuori_tolleranza": len(drifted),
+        "casi": results,
+    }
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report scritto in {report_path}")
+
+    for result in drifted:
+        params = result["parametri"]
+        print(
+            f"ERRORE: f0 {params['f0']:.0f} Hz {params['duration']:.1f} s @ {params['sampling_frequency']:.0f} Hz:"
+            f" scarto UPDRS {result['pitch_adattivo']['scarto_updrs']:+.2f} oltre ±{updrs_tolerance:g}"
+        )
+    return not drifted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark estrazione feature vocali")
+    parser.add_argument("files", nargs="*", help="file WAV da analizzare")
+    parser.add_argument("--sintetico", action="store_true", help="usa il corpus sintetico")
+    parser.add_argument("--durate", type=float, nargs="+", default=[1.0, 3.0, 10.0])
+    parser.add_argument("--frequenze", type=float, nargs="+", default=[16000, 44100])
+    parser.add_argument("--ripetizioni", type=int, default=3)
+    parser.add_argument("--report", default="bench_report.json")
+    parser.add_argument("--tolleranza-updrs", type=float, default=1.5,
+                        help="scarto UPDRS massimo tra range di pitch adattivo e fisso")
+    args = parser.parse_args()
+
+    if args.sintetico:
+        if not bench_synthetic(args.durate, args.frequenze, args.ripetizioni, args.report, args.tolleranza_updrs):
+            sys.exit(1)
+    elif args.files:
+        for path in args.files:
+            bench_file(path)
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
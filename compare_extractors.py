@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Confronto "golden output" tra estrattori di feature.
+
+Esegue un estrattore di riferimento e uno alternativo sullo stesso corpus
+(file WAV o vocali sintetiche) e riporta, per ogni registrazione, lo
+scarto di ogni feature e dell'UPDRS rispetto a tolleranze configurabili,
+insieme al rapporto di velocità. Un'ottimizzazione (vettorizzazione,
+condivisione dei passaggi, ricampionamento) va in produzione solo se il
+confronto passa: il codice di uscita è 1 se almeno uno scarto eccede.
+
+Una feature passa se |alternativa - riferimento| <= assoluta + relativa * |riferimento|.
+
+Estrattori:
+- riferimento: l'estrattore originale (extract_vocal_features di main.py
+  prima della serie di ottimizzazioni), chiamata per chiamata: PointProcess
+  periodico cc sul suono, pitch ac, HNR con floor 75, range fisso 75-500 Hz.
+  È il confronto che dice se i valori clinici sono cambiati.
+- esatto: pipeline attuale sul segnale originale, range di pitch fisso
+- produzione: pipeline attuale come in /visit (trimming, ricampionamento, range adattivo)
+- finestre: analisi a finestre di produzione
+- storico: DFA e PPE approssimate sulla pipeline attuale, range di pitch fisso
+
+Uso:
+    python compare_extractors.py [file.wav ...] [--riferimento riferimento] [--alternativa produzione]
+                                 [--tolleranza hnr=0.5] [--tolleranza jitter_abs=0,0.05]
+                                 [--report confronto.json]
+Senza file usa il corpus sintetico di synthetic_voice.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import parselmouth
+
+import synthetic_voice
+import vocal_analysis
+from audio_io import decode_wav
+from updrs_model import compute_updrs
+
+
+def _reference(data):
+    # Copia dell'estrattore originale: stesse chiamate Praat, stessi parametri
+    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
+        f.write(data)
+    try:
+        sound = parselmouth.Sound(f.name)
+    finally:
+        os.unlink(f.name)
+    point_process = parselmouth.praat.call(sound, "To PointProcess (periodic, cc)", 75, 500)
+
+    jitter_abs = parselmouth.praat.call(
+        point_process, "Get jitter (local, absolute)", 0, 0, 0.0001, 0.02, 1.3
+    )
+    shimmer_local = parselmouth.praat.call(
+        [sound, point_process], "Get shimmer (local)", 0, 0, 0.0001, 0.02, 1.3, 1.6
+    )
+
+    harmonicity = parselmouth.praat.call(sound, "To Harmonicity (cc)", 0.01, 75, 0.1, 1.0)
+    hnr = parselmouth.praat.call(harmonicity, "Get mean", 0, 0)
+    nhr = 1.0 / (hnr + 1e-6) if hnr > 0 else 1.0
+
+    intensity = sound.to_intensity(time_step=0.01)
+    intensity_values = [
+        intensity.get_value(t) for t in intensity.xs()
+        if not np.isnan(intensity.get_value(t))
+    ]
+    if len(intensity_values) > 10:
+        dfa = np.std(intensity_values) / (np.mean(intensity_values) + 1e-6)
+    else:
+        dfa = 0.0
+
+    pitch = sound.to_pitch(time_step=0.01, pitch_floor=75, pitch_ceiling=500)
+    pitch_values = [
+        pitch.get_value_at_time(t) for t in pitch.xs()
+        if not np.isnan(pitch.get_value_at_time(t))
+    ]
+    if len(pitch_values) > 5:
+        pitch_diffs = np.diff(pitch_values)
+        ppe = np.std(pitch_diffs) / (np.mean(np.abs(pitch_diffs)) + 1e-6)
+    else:
+        ppe = 0.0
+
+    return {
+        "jitter_abs": float(jitter_abs),
+        "shimmer_local": float(shimmer_local),
+        "hnr": float(hnr),
+        "nhr": float(nhr),
+        "dfa": float(dfa),
+        "ppe": float(ppe),
+    }
+
+
+def _exact(data):
+    # Segnale originale, senza trimming né ricampionamento, range di pitch fisso
+    samples, sampling_frequency = decode_wav(data)
+    with vocal_analysis.pitch_range_mode(False):
+        return vocal_analysis.extract_features(parselmouth.Sound(samples, sampling_frequency))
+
+
+def _windowed(data):
+    return vocal_analysis.extract_features_windowed(data)["features"]
+
+
+def _legacy(data):
+    # DFA e PPE approssimate storiche, senza condizionamento del segnale
+    samples, sampling_frequency = decode_wav(data)
+    sound = parselmouth.Sound(samples, sampling_frequency)
+    with vocal_analysis.pitch_range_mode(False):
+        features = vocal_analysis.extract_features(
+            sound, features=("jitter_abs", "shimmer_local", "hnr", "nhr", "dfa_cv", "ppe_ratio")
+        )
+    features["dfa"] = features.pop("dfa_cv")
+    features["ppe"] = features.pop("ppe_ratio")
+    return features
+
+
+# Estrattori confrontabili: nome -> funzione(byte WAV) -> dict delle 6 feature
+ENGINES = {
+    "riferimento": _reference,
+    "esatto": _exact,
+    "produzione": vocal_analysis.extract_features_from_wav,
+    "finestre": _windowed,
+    "storico": _legacy,
+}
+
+# Tolleranze di default: nome -> (assoluta, relativa)
+DEFAULT_TOLERANCES = {
+    "jitter_abs": (0.0, 0.10),
+    "shimmer_local": (0.0, 0.10),
+    "hnr": (1.0, 0.0),
+    "nhr": (0.0, 0.10),
+    "dfa": (0.02, 0.0),
+    "ppe": (0.03, 0.0),
+    "motor_updrs": (1.0, 0.0),
+}
+
+
+def parse_tolerance(text):
+    """"nome=assoluta[,relativa]" -> (nome, (assoluta, relativa))"""
+    name, _, values = text.partition("=")
+    parts = [float(v) for v in values.split(",") if v]
+    if name not in DEFAULT_TOLERANCES or not 1 <= len(parts) <= 2:
+        raise argparse.ArgumentTypeError(f"tolleranza non valida: {text}")
+    return name, (parts[0], parts[1] if len(parts) == 2 else 0.0)
+
+
+def timed(engine, data):
+    start = time.perf_counter()
+    features = engine(data)
+    return time.perf_counter() - start, features
+
+
+def compare_values(reference, alternative, tolerances):
+    """Scarto di ogni valore e verifica della tolleranza"""
+    deltas = {}
+    for name, (absolute, relative) in tolerances.items():
+        ref = float(reference[name])
+        alt = float(alternative[name])
+        delta = alt - ref
+        deltas[name] = {
+            "riferimento": ref,
+            "alternativa": alt,
+            "scarto": delta,
+            "scarto_relativo": delta / abs(ref) if ref else None,
+            "ok": bool(abs(delta) <= absolute + relative * abs(ref)),
+        }
+    return deltas
+
+
+def compare_case(label, data, reference_engine, alternative_engine, tolerances):
+    ref_time, reference = timed(reference_engine, data)
+    alt_time, alternative = timed(alternative_engine, data)
+    reference["motor_updrs"] = compute_updrs(reference)
+    alternative["motor_updrs"] = compute_updrs(alternative)
+
+    deltas = compare_values(reference, alternative, tolerances)
+    return {
+        "caso": label,
+        "tempo_riferimento_s": ref_time,
+        "tempo_alternativa_s": alt_time,
+        "speedup": ref_time / max(alt_time, 1e-9),
+        "ok": all(d["ok"] for d in deltas.values()),
+        "valori": deltas,
+    }
+
+
+def load_corpus(paths):
+    """Lista di (etichetta, byte WAV): i file indicati o il corpus sintetico"""
+    if paths:
+        items = []
+        for path in paths:
+            with open(path, "rb") as f:
+                items.append((path, f.read()))
+        return items
+    return [
+        (
+            f"sintetico f0={p['f0']:g} {p['duration']:g}s @ {p['sampling_frequency']:g}Hz",
+            synthetic_voice.synthetic_wav(**p)
+        )
+        for p in synthetic_voice.corpus()
+    ]
+
+
+def summarize(cases, tolerances):
+    """Scarto massimo per valore, casi fuori tolleranza e speedup complessivo"""
+    ref_total = sum(c["tempo_riferimento_s"] for c in cases)
+    alt_total = sum(c["tempo_alternativa_s"] for c in cases)
+    return {
+        "casi": len(cases),
+        "casi_fuori_tolleranza": sum(not c["ok"] for c in cases),
+        "speedup_complessivo": ref_total / max(alt_total, 1e-9),
+        "scarto_massimo": {
+            name: max(abs(c["valori"][name]["scarto"]) for c in cases) for name in tolerances
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Confronto tra estrattori di feature vocali")
+    parser.add_argument("files", nargs="*", help="file WAV (default: corpus sintetico)")
+    parser.add_argument("--riferimento", choices=sorted(ENGINES), default="esatto")
+    parser.add_argument("--alternativa", choices=sorted(ENGINES), default="produzione")
+    parser.add_argument("--tolleranza", type=parse_tolerance, action="append", default=[],
+                        help="nome=assoluta[,relativa], ripetibile")
+    parser.add_argument("--report", help="scrive il confronto completo in JSON")
+    args = parser.parse_args()
+
+    tolerances = {**DEFAULT_TOLERANCES, **dict(args.tolleranza)}
+    reference_engine = ENGINES[args.riferimento]
+    alternative_engine = ENGINES[args.alternativa]
+
+    cases = []
+    for label, data in load_corpus(args.files):
+        case = compare_case(label, data, reference_engine, alternative_engine, tolerances)
+        cases.append(case)
+        failed = [name for name, d in case["valori"].items() if not d["ok"]]
+        print(
+            f"{'OK ' if case['ok'] else 'KO '} {label:<45} speedup {case['speedup']:6.2f}x"
+            f"  UPDRS {case['valori']['motor_updrs']['scarto']:+7.3f}"
+            + (f"  fuori tolleranza: {', '.join(failed)}" if failed else "")
+        )
+
+    summary = summarize(cases, tolerances)
+    print()
+    print(f"{args.alternativa} vs {args.riferimento}: "
+          f"{summary['casi'] - summary['casi_fuori_tolleranza']}/{summary['casi']} casi in tolleranza, "
+          f"speedup complessivo {summary['speedup_complessivo']:.2f}x")
+    for name, delta in summary["scarto_massimo"].items():
+        absolute, relative = tolerances[name]
+        print(f"  {name:<15} scarto max {delta:12.6g}   tolleranza {absolute:g} + {relative:g}·|rif|")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({
+                "riferimento": args.riferimento,
+                "alternativa": args.alternativa,
+                "versione_estrattore": vocal_analysis.EXTRACTOR_VERSION,
+                "tolleranze": tolerances,
+                "riepilogo": summary,
+                "casi": cases,
+            }, f, indent=2)
+
+    sys.exit(0 if summary["casi_fuori_tolleranza"] == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
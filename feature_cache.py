@@ -0,0 +1,190 @@
+"""
+Cache delle feature vocali indirizzata per contenuto.
+
+La chiave è lo SHA-256 dei campioni audio decodificati (float64), della
+frequenza di campionamento e della versione dell'estrattore: lo stesso
+audio ricaricato (retry di rete, portale + API, container diverso) produce
+la stessa chiave, mentre un cambio dell'algoritmo invalida tutto.
+
+Due livelli:
+- memoria: LRU a numero di voci limitato
+- disco: un file JSON per chiave, con eviction dei meno usati oltre una
+  dimensione massima totale (condivisibile tra API e Streamlit)
+
+Configurazione da variabili d'ambiente:
+- FEATURE_CACHE_DIR: cartella del livello su disco ("" per disattivarlo)
+- FEATURE_CACHE_ENTRIES: voci in memoria (default 1024)
+- FEATURE_CACHE_MAX_MB: dimensione massima su disco in MB (default 64)
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from audio_io import open_wav, read_frames
+from vocal_analysis import EXTRACTOR_VERSION
+
+
+# Frame decodificati per blocco durante l'hashing: la memoria resta limitata anche su file lunghi
+KEY_CHUNK_FRAMES = 1 << 16
+
+
+def _key_digest(sampling_frequency, channels, n_frames, version):
+    digest = hashlib.sha256()
+    digest.update(f"{version}|{float(sampling_frequency)}|{channels}x{n_frames}".encode())
+    return digest
+
+
+def wav_key(data, version=EXTRACTOR_VERSION):
+    """
+    SHA-256 dei campioni decodificati (float64, ordine per frame) +
+    frequenza di campionamento + versione estrattore, dai byte del WAV
+    decodificando un blocco alla volta
+    """
+    layout, buffer = open_wav(data)
+    digest = _key_digest(layout.sampling_frequency, layout.channels, layout.n_frames, version)
+    for start in range(0, layout.n_frames, KEY_CHUNK_FRAMES):
+        samples = read_frames(buffer, layout, start, start + KEY_CHUNK_FRAMES)
+        digest.update(np.ascontiguousarray(samples.T).tobytes())
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """Cache a due livelli (memoria LRU + disco con eviction per dimensione)"""
+
+    def __init__(self, max_entries=1024, cache_dir=None, max_disk_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+
+        if self.cache_dir is not None:
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                self._disk_bytes = sum(p.stat().st_size for p in self.cache_dir.glob("*.json"))
+            except OSError:
+                # Filesystem in sola lettura: resta solo il livello in memoria
+                self.cache_dir = None
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key):
+        """Feature in cache per la chiave, oppure None"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return dict(self._memory[key])
+
+        features = self._read_disk(key)
+
+        with self._lock:
+            if features is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, features)
+        return dict(features)
+
+    def put(self, key, features):
+        with self._lock:
+            self._remember(key, dict(features))
+        self._write_disk(key, features)
+
+    def _remember(self, key, features):
+        self._memory[key] = features
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key):
+        if self.cache_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                features = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            # Aggiorna mtime: l'eviction su disco rimuove i meno usati di recente
+            os.utime(path)
+        except OSError:
+            pass
+        return features
+
+    def _write_disk(self, key, features):
+        if self.cache_dir is None:
+            return
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(features, f)
+            size = tmp_path.stat().st_size
+        except OSError:
+            return
+
+        with self._lock:
+            # Una chiave riscritta (stesso audio da due richieste) sostituisce il
+            # file esistente: conta solo la differenza di dimensione
+            try:
+                replaced = path.stat().st_size
+            except OSError:
+                replaced = 0
+            try:
+                os.replace(tmp_path, path)
+            except OSError:
+                return
+            self._disk_bytes += size - replaced
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        for p in self.cache_dir.glob("*.json"):
+            try:
+                stat = p.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, p))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        # Scende sotto l'80% del limite per non ripetere l'eviction a ogni scrittura
+        target = self.max_disk_bytes * 0.8
+        for _, size, p in entries:
+            if total <= target:
+                break
+            try:
+                p.unlink()
+                total -= size
+            except OSError:
+                pass
+        self._disk_bytes = total
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_entries": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+        }
+
+
+def cache_from_env():
+    """Crea la cache leggendo FEATURE_CACHE_DIR, FEATURE_CACHE_ENTRIES e FEATURE_CACHE_MAX_MB"""
+    return FeatureCache(
+        max_entries=int(os.environ.get("FEATURE_CACHE_ENTRIES", "1024")),
+        cache_dir=os.environ.get("FEATURE_CACHE_DIR", ".feature_cache"),
+        max_disk_bytes=int(float(os.environ.get("FEATURE_CACHE_MAX_MB", "64")) * 1024 * 1024),
+    )
@@ -0,0 +1,241 @@
+"""
+Coda locale dei job di visita asincroni, su SQLite (nessun broker esterno).
+
+Il client carica l'audio e riceve subito un job ID; l'audio resta nel
+database finché un dispatcher lo prende in carico, poi viene eliminato e
+resta solo il risultato. Più processi del server possono condividere lo
+stesso file: la presa in carico è un singolo UPDATE atomico.
+
+Ogni job in_corso registra il processo che lo esegue (owner) e un
+heartbeat, rinnovato periodicamente finché l'analisi è in corso: torna in
+coda solo un job il cui heartbeat è scaduto (processo terminato), anche se
+a controllarlo è un altro processo. I job conclusi sono eliminati dopo il
+periodo di conservazione (purge).
+
+Stati: in_coda -> in_corso -> completato | fallito
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+QUEUED = "in_coda"
+RUNNING = "in_corso"
+DONE = "completato"
+FAILED = "fallito"
+
+FINAL_STATES = (DONE, FAILED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS visit_jobs (
+    id TEXT PRIMARY KEY,
+    codice_fiscale TEXT NOT NULL,
+    status TEXT NOT NULL,
+    options TEXT NOT NULL,
+    audio BLOB,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    owner TEXT,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS visit_jobs_status_created ON visit_jobs (status, created_at);
+"""
+
+# Colonne aggiunte dopo la prima versione dello schema: file esistenti aggiornati all'apertura
+_ADDED_COLUMNS = {"owner": "TEXT", "heartbeat_at": "REAL"}
+
+
+class JobStore:
+    """Archivio SQLite dei job di visita"""
+
+    def __init__(self, path, owner=None):
+        self.path = str(path)
+        # Identifica questo processo nei job che prende in carico
+        self.owner = owner or uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(visit_jobs)")}
+        for name, kind in _ADDED_COLUMNS.items():
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE visit_jobs ADD COLUMN {name} {kind}")
+
+    def create(self, codice_fiscale, audio_bytes, options=None):
+        """Accoda un job e ne ritorna l'ID"""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO visit_jobs (id, codice_fiscale, status, options, audio, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, codice_fiscale, QUEUED, json.dumps(options or {}), audio_bytes, time.time())
+            )
+        return job_id
+
+    def claim_next(self):
+        """
+        Prende in carico il job in coda più vecchio (atomico anche tra processi).
+        Ritorna (id, codice_fiscale, audio, options) oppure None se la coda è vuota.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE visit_jobs SET status = ?, started_at = ?, owner = ?, heartbeat_at = ? "
+                "WHERE id = (SELECT id FROM visit_jobs WHERE status = ? ORDER BY created_at LIMIT 1) "
+                "RETURNING id, codice_fiscale, audio, options",
+                (RUNNING, now, self.owner, now, QUEUED)
+            ).fetchone()
+        if row is None:
+            return None
+        return row["id"], row["codice_fiscale"], row["audio"], json.loads(row["options"])
+
+    def complete(self, job_id, result):
+        self._finish(job_id, DONE, result=json.dumps(result))
+
+    def fail(self, job_id, error):
+        self._finish(job_id, FAILED, error=str(error))
+
+    def _finish(self, job_id, status, result=None, error=None):
+        # L'audio non serve più: resta solo il risultato
+        with self._lock:
+            self._conn.execute(
+                "UPDATE visit_jobs SET status = ?, result = ?, error = ?, finished_at = ?, audio = NULL "
+                "WHERE id = ?",
+                (status, result, error, time.time(), job_id)
+            )
+
+    def requeue(self, job_id):
+        """Rimette in coda un job in_corso (analisi interrotta dall'arresto del server)"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE visit_jobs SET status = ?, started_at = NULL, owner = NULL, heartbeat_at = NULL "
+                "WHERE id = ? AND status = ? AND audio IS NOT NULL",
+                (QUEUED, job_id, RUNNING)
+            )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, job_ids):
+        """Rinnova l'heartbeat dei job in_corso di questo processo ancora in esecuzione"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE visit_jobs SET heartbeat_at = ? "
+                "WHERE status = ? AND owner = ? AND id IN (SELECT value FROM json_each(?))",
+                (time.time(), RUNNING, self.owner, json.dumps(list(job_ids)))
+            )
+        return cursor.rowcount
+
+    def requeue_stale(self, older_than_seconds):
+        """
+        Rimette in coda i job in_corso il cui heartbeat è più vecchio di
+        `older_than_seconds` (processo terminato durante l'analisi), di
+        qualunque processo. I job presi in carico prima dell'heartbeat
+        contano dall'avvio.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE visit_jobs SET status = ?, started_at = NULL, owner = NULL, heartbeat_at = NULL "
+                "WHERE status = ? AND COALESCE(heartbeat_at, started_at) < ? AND audio IS NOT NULL",
+                (QUEUED, RUNNING, time.time() - older_than_seconds)
+            )
+        return cursor.rowcount
+
+    def purge(self, older_than_seconds):
+        """Elimina i job conclusi da più di `older_than_seconds`; ritorna quanti"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM visit_jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (DONE, FAILED, time.time() - older_than_seconds)
+            )
+        return cursor.rowcount
+
+    def queue_depth(self):
+        """Job in attesa di essere presi in carico"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM visit_jobs WHERE status = ?", (QUEUED,)
+            ).fetchone()[0]
+
+    def get(self, job_id):
+        """Stato del job (senza audio), oppure None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, codice_fiscale, status, result, error, created_at, started_at, finished_at "
+                "FROM visit_jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+            position = None
+            if row is not None and row["status"] == QUEUED:
+                position = self._conn.execute(
+                    "SELECT COUNT(*) FROM visit_jobs WHERE status = ? AND created_at < ?",
+                    (QUEUED, row["created_at"])
+                ).fetchone()[0] + 1
+        if row is None:
+            return None
+        return _job_view(row, position)
+
+    def stats(self, recent=200):
+        """Conteggi per stato, profondità della coda e durate degli ultimi job conclusi"""
+        with self._lock:
+            counts = {
+                status: n for status, n in self._conn.execute(
+                    "SELECT status, COUNT(*) FROM visit_jobs GROUP BY status"
+                )
+            }
+            durations = self._conn.execute(
+                "SELECT started_at - created_at, finished_at - started_at FROM visit_jobs "
+                "WHERE status IN (?, ?) AND started_at IS NOT NULL "
+                "ORDER BY finished_at DESC LIMIT ?",
+                (DONE, FAILED, recent)
+            ).fetchall()
+
+        waits = sorted(d[0] for d in durations)
+        runs = sorted(d[1] for d in durations)
+        return {
+            "stati": {s: counts.get(s, 0) for s in (QUEUED, RUNNING, DONE, FAILED)},
+            "profondita_coda": counts.get(QUEUED, 0),
+            "ultimi_job": len(durations),
+            "attesa_s": _summary(waits),
+            "esecuzione_s": _summary(runs),
+        }
+
+
+def _summary(sorted_values):
+    if not sorted_values:
+        return None
+    n = len(sorted_values)
+    return {
+        "media": round(sum(sorted_values) / n, 3),
+        "p50": round(sorted_values[n // 2], 3),
+        "p95": round(sorted_values[min(int(n * 0.95), n - 1)], 3),
+        "max": round(sorted_values[-1], 3),
+    }
+
+
+def _job_view(row, position):
+    job = {
+        "job_id": row["id"],
+        "codice_fiscale": row["codice_fiscale"],
+        "stato": row["status"],
+        "creato": row["created_at"],
+        "avviato": row["started_at"],
+        "concluso": row["finished_at"],
+        "attesa_s": None,
+        "esecuzione_s": None,
+    }
+    if position is not None:
+        job["posizione"] = position
+    if row["started_at"] is not None:
+        job["attesa_s"] = round(row["started_at"] - row["created_at"], 3)
+        if row["finished_at"] is not None:
+            job["esecuzione_s"] = round(row["finished_at"] - row["started_at"], 3)
+    if row["result"] is not None:
+        job["risultato"] = json.loads(row["result"])
+    if row["error"] is not None:
+        job["errore"] = row["error"]
+    return job
@@ -0,0 +1,321 @@
+"""
+Cache read-through delle righe di pazienti e medici.
+
+/visit, /history, il reset password e i dashboard leggono a ogni richiesta
+la riga del paziente o del medico, che cambia di rado. CachedRepository
+avvolge un repository (vedi repository.py) e tiene in memoria le righe
+complete lette per chiave (codice fiscale del paziente, username o codice
+fiscale del medico): proiezione delle colonne e filtri di uguaglianza
+(doctor_username) sono applicati alla riga in cache. Solo le righe trovate
+vanno in cache: un paziente appena registrato non resta nascosto da un
+"non trovato".
+
+Le verifiche delle credenziali (filtro su password_hash, cioè i login)
+leggono sempre dal database: una password cambiata o revocata da un altro
+processo non resta valida fino alla scadenza della voce.
+
+AsyncCachedRepository fa lo stesso sul repository asincrono dell'API
+(vedi async_repository.py), con la stessa TtlCache.
+
+Le scritture che passano dal repository avvolto (registrazione, reset
+password, aggiornamento della baseline) invalidano subito le voci
+interessate; una lettura dal database iniziata prima dell'invalidazione
+non rimette in cache la riga vecchia (generazione della chiave, vedi
+TtlCache.generation). Le scritture di altri processi (il portale
+Streamlit, l'API, doc_register.py) si vedono al più dopo il TTL: va tenuto breve.
+
+Configurazione da variabili d'ambiente:
+- LOOKUP_CACHE_TTL_SECONDS: durata di una voce (default 30; 0 disattiva la cache)
+- LOOKUP_CACHE_ENTRIES: numero massimo di voci, eviction LRU (default 4096)
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+_MISSING = object()
+
+
+class TtlCache:
+    """
+    Cache LRU in memoria con scadenza delle voci (thread-safe).
+
+    Ogni invalidazione riceve un numero di generazione crescente, ricordato
+    per chiave (e per prefisso). Chi legge dal database dopo un mancato hit
+    prende prima generation() e lo passa a put(): se nel frattempo la
+    chiave è stata invalidata la riga letta può essere vecchia e non entra
+    in cache. Le generazioni ricordate sono limitate a max_entries; oltre,
+    le più vecchie diventano una soglia unica (si scarta qualche put in più).
+    """
+
+    def __init__(self, ttl_seconds=30.0, max_entries=4096):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._invalidated = OrderedDict()
+        self._generation = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl_seconds > 0 and self.max_entries > 0
+
+    def get(self, key):
+        """Valore in cache per la chiave, oppure _MISSING se assente o scaduto"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return _MISSING
+
+    def generation(self):
+        """Generazione corrente, da prendere prima di leggere il valore da mettere in cache"""
+        with self._lock:
+            return self._generation
+
+    def put(self, key, value, generation=None):
+        """Mette in cache il valore, tranne se la chiave è stata invalidata dopo `generation`"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation is not None and self._invalidated_since(key, generation):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._stamp(key)
+
+    def invalidate_prefix(self, prefix):
+        """Rimuove le voci la cui chiave (tupla) inizia con `prefix`"""
+        with self._lock:
+            for key in [k for k in self._entries if k[:len(prefix)] == prefix]:
+                del self._entries[key]
+            self._stamp(prefix)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self._floor = self._generation
+            self._invalidated.clear()
+
+    def _stamp(self, key):
+        self._generation += 1
+        self._invalidated[key] = self._generation
+        self._invalidated.move_to_end(key)
+        while len(self._invalidated) > max(self.max_entries, 1):
+            _, generation = self._invalidated.popitem(last=False)
+            self._floor = max(self._floor, generation)
+
+    def _invalidated_since(self, key, generation):
+        if generation < self._floor:
+            return True
+        prefixes = [key[:n] for n in range(1, len(key) + 1)] if isinstance(key, tuple) else [key]
+        return any(self._invalidated.get(k, 0) > generation for k in prefixes)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+def _project(row, columns, filters):
+    """Copia della riga con le sole `columns`, oppure None se non soddisfa i filtri"""
+    if any(row.get(name) != value for name, value in filters.items()):
+        return None
+    if columns:
+        return {name: row.get(name) for name in columns}
+    return dict(row)
+
+
+# Chiavi per cui find_doctor può usare la cache
+DOCTOR_KEYS = ("username", "codice_fiscale")
+
+# Filtri che non passano mai dalla cache (verifica delle credenziali)
+UNCACHED_FILTERS = ("password_hash",)
+
+
+def _uncached(filters):
+    return any(name in filters for name in UNCACHED_FILTERS)
+
+
+def _doctor_key(filters):
+    """Chiave di cache per i filtri di find_doctor, oppure None se non c'è una chiave usabile"""
+    name = next((name for name in DOCTOR_KEYS if name in filters), None)
+    return None if name is None else ("doctors", name, filters[name])
+
+
+class _CachedLookups:
+    """
+    Passi della cache read-through comuni a CachedRepository e
+    AsyncCachedRepository: chiavi, lettura, inserimento e invalidazione.
+    Le sottoclassi aggiungono solo le chiamate al repository avvolto.
+    """
+
+    def __init__(self, repository, cache):
+        self.repository = repository
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.repository, name)
+
+    def _patient_cache_key(self, codice_fiscale, filters):
+        """Chiave di cache di get_patient, oppure None se la lettura va al database"""
+        if not self.cache.enabled or _uncached(filters):
+            return None
+        return ("patients", codice_fiscale)
+
+    def _doctor_cache_key(self, filters):
+        """Chiave di cache di find_doctor, oppure None se la lettura va al database"""
+        if not self.cache.enabled or _uncached(filters):
+            return None
+        return _doctor_key(filters)
+
+    def _lookup(self, key):
+        """(riga in cache oppure _MISSING, generazione da passare a _fill)"""
+        generation = self.cache.generation()
+        return self.cache.get(key), generation
+
+    def _fill(self, key, row, generation, columns, filters):
+        """Riga letta dal database dopo un mancato hit: in cache se trovata, poi proiettata"""
+        if row is None:
+            return None
+        self.cache.put(key, row, generation=generation)
+        return _project(row, columns, filters)
+
+    @contextmanager
+    def _invalidating_patients(self, codici_fiscali):
+        try:
+            yield
+        finally:
+            for codice_fiscale in codici_fiscali:
+                self.cache.invalidate(("patients", codice_fiscale))
+
+    @contextmanager
+    def _invalidating_doctors(self):
+        try:
+            yield
+        finally:
+            # Un medico è in cache sia per username sia per codice fiscale
+            self.cache.invalidate_prefix(("doctors",))
+
+
+class CachedRepository(_CachedLookups):
+    """
+    Repository con cache read-through di get_patient e find_doctor.
+    Tutti gli altri metodi sono delegati al repository avvolto.
+    """
+
+    # Pazienti
+
+    def get_patient(self, codice_fiscale, columns=None, **filters):
+        key = self._patient_cache_key(codice_fiscale, filters)
+        if key is None:
+            return self.repository.get_patient(codice_fiscale, columns, **filters)
+        row, generation = self._lookup(key)
+        if row is not _MISSING:
+            return _project(row, columns, filters)
+        return self._fill(key, self.repository.get_patient(codice_fiscale), generation, columns, filters)
+
+    def insert_patient(self, row):
+        with self._invalidating_patients([row["codice_fiscale"]]):
+            self.repository.insert_patient(row)
+
+    def update_patient(self, codice_fiscale, values):
+        with self._invalidating_patients([codice_fiscale]):
+            self.repository.update_patient(codice_fiscale, values)
+
+    def set_missing_baselines(self, baselines):
+        with self._invalidating_patients(baselines):
+            self.repository.set_missing_baselines(baselines)
+
+    # Medici
+
+    def find_doctor(self, columns=None, **filters):
+        key = self._doctor_cache_key(filters)
+        if key is None:
+            return self.repository.find_doctor(columns, **filters)
+        row, generation = self._lookup(key)
+        if row is not _MISSING:
+            return _project(row, columns, filters)
+        return self._fill(key, self.repository.find_doctor(**{key[1]: key[2]}), generation, columns, filters)
+
+    def insert_doctor(self, row):
+        with self._invalidating_doctors():
+            self.repository.insert_doctor(row)
+
+    def update_doctor(self, username, values):
+        with self._invalidating_doctors():
+            self.repository.update_doctor(username, values)
+
+
+class AsyncCachedRepository(_CachedLookups):
+    """Come CachedRepository, per un repository con metodi coroutine"""
+
+    # Pazienti
+
+    async def get_patient(self, codice_fiscale, columns=None, **filters):
+        key = self._patient_cache_key(codice_fiscale, filters)
+        if key is None:
+            return await self.repository.get_patient(codice_fiscale, columns, **filters)
+        row, generation = self._lookup(key)
+        if row is not _MISSING:
+            return _project(row, columns, filters)
+        return self._fill(key, await self.repository.get_patient(codice_fiscale), generation, columns, filters)
+
+    async def insert_patient(self, row):
+        with self._invalidating_patients([row["codice_fiscale"]]):
+            await self.repository.insert_patient(row)
+
+    async def update_patient(self, codice_fiscale, values):
+        with self._invalidating_patients([codice_fiscale]):
+            await self.repository.update_patient(codice_fiscale, values)
+
+    async def set_missing_baselines(self, baselines):
+        with self._invalidating_patients(baselines):
+            await self.repository.set_missing_baselines(baselines)
+
+    # Medici
+
+    async def find_doctor(self, columns=None, **filters):
+        key = self._doctor_cache_key(filters)
+        if key is None:
+            return await self.repository.find_doctor(columns, **filters)
+        row, generation = self._lookup(key)
+        if row is not _MISSING:
+            return _project(row, columns, filters)
+        return self._fill(key, await self.repository.find_doctor(**{key[1]: key[2]}), generation, columns, filters)
+
+    async def insert_doctor(self, row):
+        with self._invalidating_doctors():
+            await self.repository.insert_doctor(row)
+
+    async def update_doctor(self, username, values):
+        with self._invalidating_doctors():
+            await self.repository.update_doctor(username, values)
+
+
+def lookup_cache_from_env():
+    """Crea la cache leggendo LOOKUP_CACHE_TTL_SECONDS e LOOKUP_CACHE_ENTRIES"""
+    return TtlCache(
+        ttl_seconds=float(os.environ.get("LOOKUP_CACHE_TTL_SECONDS", "30")),
+        max_entries=int(os.environ.get("LOOKUP_CACHE_ENTRIES", "4096")),
+    )
@@ -1,36 +1,344 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-import parselmouth
-import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import hashlib
-import uuid
-import os
-import shutil
 import re
-from pathlib import Path
+import asyncio
+import functools
+import json
+import logging
+import os
+import time
+import zipfile
+from typing import List, Optional
+from pathlib import PurePosixPath
 from datetime import datetime
-from supabase import create_client, Client
+from anyio import CapacityLimiter, to_thread
+from supabase import AsyncClientOptions, acreate_client
 import streamlit as st
 
+import vocal_analysis
+from admission import Rejection, admission_from_env
+from analysis_pool import AnalysisTimeout, pool_from_env
+from feature_cache import wav_key, cache_from_env
+import job_store
+import metrics
+from async_repository import async_repository_from_env
+from lookup_cache import AsyncCachedRepository, lookup_cache_from_env
+import patient_stats
+from repository import COLUMNS, MEASUREMENT_COLUMN_SETS, PATIENT_PUBLIC_COLUMNS, DuplicateError
+from updrs_model import features_matrix, registry_from_env
+from write_behind import write_behind_from_env
+
 app = FastAPI(title="Parkinson Telemonitoring API")
 
+logger = logging.getLogger(__name__)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
 )
-supabase_url = st.secrets["SUPABASE_URL"]
-supabase_key = st.secrets["SUPABASE_KEY"]
+# Metriche esposte su /metrics
+HTTP_LATENCY = metrics.Histogram(
+    "http_request_duration_seconds", "Durata delle richieste per endpoint", ("method", "endpoint", "status")
+)
+HTTP_IN_FLIGHT = metrics.Gauge("http_requests_in_flight", "Richieste HTTP in corso")
+VISIT_STAGE_LATENCY = metrics.Histogram(
+    "visit_stage_duration_seconds", "Durata delle fasi di una visita (upload, paziente, analisi, salvataggio)",
+    ("stage",)
+)
+EXTRACTION_STAGE_LATENCY = metrics.Histogram(
+    "extraction_stage_duration_seconds", "Durata esclusiva degli stage di estrazione nel worker", ("stage",)
+)
+SUPABASE_LATENCY = metrics.Histogram(
+    "supabase_request_duration_seconds", "Chiamate Supabase per tabella e operazione", ("table", "operation")
+)
+SUPABASE_ERRORS = metrics.Counter(
+    "supabase_request_errors_total", "Chiamate Supabase fallite", ("table", "operation")
+)
+ANALYSIS_IN_FLIGHT = metrics.Gauge("analysis_in_flight", "Analisi in esecuzione nei worker")
+ANALYSIS_WAITING = metrics.Gauge("analysis_waiting", "Analisi in attesa di un worker libero")
+ANALYSIS_REPLACED_WORKERS = metrics.Counter(
+    "analysis_replaced_workers_total", "Worker sostituiti dopo timeout o crash"
+)
+FEATURE_CACHE_HITS = metrics.Counter("feature_cache_hits_total", "Letture della cache feature riuscite")
+FEATURE_CACHE_MISSES = metrics.Counter("feature_cache_misses_total", "Letture della cache feature mancate")
+LOOKUP_CACHE_HITS = metrics.Counter("lookup_cache_hits_total", "Letture di pazienti e medici servite dalla cache")
+LOOKUP_CACHE_MISSES = metrics.Counter("lookup_cache_misses_total", "Letture di pazienti e medici andate al database")
+LOOKUP_CACHE_ENTRIES = metrics.Gauge("lookup_cache_entries", "Righe di pazienti e medici in cache")
+ADMISSION_IN_FLIGHT = metrics.Gauge("admission_in_flight", "Richieste di analisi ammesse e non concluse")
+ADMISSION_REJECTIONS = metrics.Counter(
+    "admission_rejections_total", "Richieste rifiutate dal controllo di ammissione", ("reason",)
+)
+JOB_QUEUE_DEPTH = metrics.Gauge("visit_jobs_queued", "Job di visita asincroni in coda")
+WRITE_BEHIND_PENDING = metrics.Gauge("write_behind_pending", "Scritture differite in attesa di consegna")
+WRITE_BEHIND_DELIVERED = metrics.Counter(
+    "write_behind_delivered_total", "Misurazioni differite consegnate al database"
+)
+WRITE_BEHIND_FAILURES = metrics.Counter(
+    "write_behind_failures_total", "Consegne differite fallite (ritentate al giro successivo)"
+)
+WRITE_BEHIND_DEAD_LETTERS = metrics.Gauge(
+    "write_behind_dead_letters", "Scritture differite scartate dopo troppi errori permanenti"
+)
+
+
+
+async def _supabase_client(http_client):
+    # Client asincrono sul pool HTTP condiviso; ogni chiamata è conteggiata e
+    # cronometrata per tabella e operazione
+    client = await acreate_client(
+        st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"],
+        options=AsyncClientOptions(httpx_client=http_client)
+    )
+    return metrics.InstrumentedAsyncSupabase(client, SUPABASE_LATENCY, SUPABASE_ERRORS)
+
+
+# Archivio dati asincrono: Supabase, oppure SQLite locale con
+# STORAGE_BACKEND=sqlite (async_repository.py). Creato all'avvio, dentro
+# l'event loop. Le righe di pazienti e medici passano da una cache TTL
+# invalidata dalle scritture (LOOKUP_CACHE_TTL_SECONDS, LOOKUP_CACHE_ENTRIES)
+lookup_cache = lookup_cache_from_env()
+db = None
+
+# Scrittura differita delle misurazioni (WRITE_BEHIND, vedi write_behind.py):
+# None se disattivata, altrimenti creata all'avvio insieme al database
+write_behind = None
+
+# Numero massimo di registrazioni accettate da /visit_batch in una richiesta
+MAX_BATCH_FILES = 200
+
+# Righe per pagina di /history e /patients (default e massimo)
+PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+# Pool di processi per l'analisi Praat (ANALYSIS_WORKERS, ANALYSIS_TIMEOUT)
+analysis_pool = pool_from_env()
+
+# Controllo di ammissione: coda limitata, dimensione e durata massime (admission.py)
+admission = admission_from_env(analysis_pool)
 
-# Crea il client
-supabase: Client = create_client(supabase_url, supabase_key)
+# Endpoint che avviano un'analisi: path -> corpo con più registrazioni
+ANALYSIS_PATHS = {"/visit": False, "/visit_batch": True}
 
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
+# Thread per hashing e cache delle visite, limitati a parte: una raffica di
+# analisi non esaurisce i thread che servono login e dashboard (VISIT_THREADS)
+VISIT_THREADS = int(os.environ.get("VISIT_THREADS", "4"))
+_visit_threads = None
 
+# Modelli UPDRS versionati, ricaricati a caldo (UPDRS_MODEL_DIR, UPDRS_MODEL_VERSION)
+updrs_models = registry_from_env()
 
-def extract_vocal_features(audio_path):
+# Cache delle feature per audio già analizzato (FEATURE_CACHE_DIR, FEATURE_CACHE_ENTRIES, FEATURE_CACHE_MAX_MB)
+feature_cache = cache_from_env()
+
+ANALYSIS_IN_FLIGHT.set_function(lambda: analysis_pool.in_flight)
+ANALYSIS_WAITING.set_function(lambda: analysis_pool.waiting)
+ANALYSIS_REPLACED_WORKERS.set_function(lambda: analysis_pool.replaced_workers)
+FEATURE_CACHE_HITS.set_function(lambda: feature_cache.hits)
+FEATURE_CACHE_MISSES.set_function(lambda: feature_cache.misses)
+LOOKUP_CACHE_HITS.set_function(lambda: lookup_cache.hits)
+LOOKUP_CACHE_MISSES.set_function(lambda: lookup_cache.misses)
+LOOKUP_CACHE_ENTRIES.set_function(lambda: lookup_cache.stats()["entries"])
+ADMISSION_IN_FLIGHT.set_function(lambda: admission.in_flight)
+
+# Coda SQLite dei job di visita asincroni (JOB_STORE_PATH); i job conclusi
+# restano consultabili per JOB_RETENTION_HOURS ore, poi sono eliminati
+visit_jobs = job_store.JobStore(os.environ.get("JOB_STORE_PATH", "visit_jobs.sqlite3"))
+JOB_RETENTION_SECONDS = float(os.environ.get("JOB_RETENTION_HOURS", "168")) * 3600
+
+# Attesa tra due controlli della coda vuota e tra due eventi SSE, in secondi
+JOB_POLL_SECONDS = 0.5
+
+JOB_QUEUE_DEPTH.set_function(visit_jobs.queue_depth)
+
+_job_dispatchers = []
+
+# Job presi in carico da questo processo e non ancora conclusi: il loro
+# heartbeat è rinnovato finché sono in esecuzione
+_running_jobs = set()
+_stopping_dispatchers = False
+
+
+def _rejected(rejection):
+    """Conta il rifiuto e lo converte in HTTPException (con Retry-After se previsto)"""
+    ADMISSION_REJECTIONS.inc(reason=rejection.reason)
+    return HTTPException(
+        status_code=rejection.status_code, detail=rejection.detail, headers=rejection.headers()
+    )
+
+
+class UploadLimit:
+    """
+    Limite di dimensione applicato mentre il corpo arriva: senza
+    Content-Length (upload chunked) il controllo di admission_control non
+    basta, e il parser multipart salverebbe tutto il corpo prima
+    dell'endpoint. Oltre il limite la lettura si interrompe con 413.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path")
+        if scope["type"] != "http" or scope["method"] != "POST" or (
+                path not in ANALYSIS_PATHS and path != "/visit_jobs"):
+            return await self.app(scope, receive, send)
+
+        batch = ANALYSIS_PATHS.get(path, False)
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                try:
+                    admission.check_size(received, batch=batch)
+                except Rejection as e:
+                    raise _rejected(e)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+app.add_middleware(UploadLimit)
+
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """
+    Ammissione delle richieste di analisi prima di leggere il corpo: limite
+    di dimensione dal Content-Length (i byte effettivi li conta UploadLimit),
+    coda delle analisi (503) e coda dei job asincroni (429). Le altre
+    richieste passano senza controlli.
+    """
+    path = request.url.path
+    if request.method != "POST" or (path not in ANALYSIS_PATHS and path != "/visit_jobs"):
+        return await call_next(request)
+
+    # I job asincroni non occupano un posto nella coda delle analisi: li limita la coda dei job
+    analysis = path in ANALYSIS_PATHS
+    content_length = request.headers.get("content-length")
+    try:
+        admission.check_size(
+            int(content_length) if content_length and content_length.isdigit() else None,
+            batch=ANALYSIS_PATHS.get(path, False)
+        )
+        if analysis:
+            admission.admit()
+        else:
+            admission.check_job_queue(await run_in_threadpool(visit_jobs.queue_depth))
+    except Rejection as e:
+        ADMISSION_REJECTIONS.inc(reason=e.reason)
+        request.scope["admission_path"] = path
+        return JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers())
+
+    try:
+        return await call_next(request)
+    finally:
+        if analysis:
+            admission.release()
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    with HTTP_IN_FLIGHT.track():
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            # Template della route (/history/{codice_fiscale}), non il path: etichette limitate
+            route = request.scope.get("route")
+            if route is not None:
+                endpoint = route.path
+            else:
+                # Rifiutata dal controllo di ammissione prima del routing
+                endpoint = request.scope.get("admission_path", "non_trovato")
+            HTTP_LATENCY.observe(
+                time.perf_counter() - start, method=request.method, endpoint=endpoint, status=status
+            )
+
+
+@app.on_event("startup")
+async def open_repository():
+    global db, write_behind
+    # Registrato per primo: i dispatcher dei job usano già il database
+    db = AsyncCachedRepository(await async_repository_from_env(_supabase_client), lookup_cache)
+
+    write_behind = write_behind_from_env(db)
+    if write_behind is not None:
+        await write_behind.start()
+        # Contatore in memoria: /metrics non interroga la coda SQLite dall'event loop
+        WRITE_BEHIND_PENDING.set_function(lambda: write_behind.queued)
+        WRITE_BEHIND_DELIVERED.set_function(lambda: write_behind.delivered)
+        WRITE_BEHIND_FAILURES.set_function(lambda: write_behind.failures)
+        WRITE_BEHIND_DEAD_LETTERS.set_function(lambda: write_behind.dead_letters)
+
+
+@app.on_event("startup")
+async def start_visit_threads():
+    global _visit_threads
+    # Il limiter va creato dentro l'event loop
+    _visit_threads = CapacityLimiter(VISIT_THREADS)
+
+
+async def run_in_visit_thread(fn, *args):
+    """Come run_in_threadpool, ma entro i VISIT_THREADS riservati alle visite"""
+    return await to_thread.run_sync(functools.partial(fn, *args), limiter=_visit_threads)
+
+
+@app.on_event("startup")
+async def start_job_dispatchers():
+    # Un dispatcher per worker: la coda si svuota al ritmo del pool
+    for _ in range(analysis_pool.max_workers):
+        _start_dispatcher()
+    # Heartbeat, job rimasti in_corso da un processo terminato e pulizia dei job conclusi
+    _job_dispatchers.append(asyncio.create_task(_maintain_visit_jobs()))
+
+
+def _start_dispatcher():
+    task = asyncio.create_task(_dispatch_visit_jobs())
+    task.add_done_callback(_dispatcher_done)
+    _job_dispatchers.append(task)
+
+
+def _dispatcher_done(task):
+    """Un dispatcher terminato fuori dall'arresto del server viene segnalato e sostituito"""
+    _job_dispatchers.remove(task)
+    if task.cancelled() or _stopping_dispatchers:
+        return
+    logger.error("Dispatcher dei job di visita terminato: sostituito", exc_info=task.exception())
+    _start_dispatcher()
+
+
+@app.on_event("shutdown")
+async def shutdown_analysis_pool():
+    global _stopping_dispatchers
+    _stopping_dispatchers = True
+    tasks = list(_job_dispatchers)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _job_dispatchers.clear()
+    analysis_pool.shutdown()
+
+
+@app.on_event("shutdown")
+async def close_repository():
+    # Dopo l'arresto dei dispatcher: le ultime visite sono già in coda
+    if write_behind is not None:
+        await write_behind.stop()
+    await db.aclose()
+
+
+def extract_vocal_features(audio_path, timings=None, sex=None, age=None):
     """
     Estrae SOLO le 6 feature vocali necessarie per il calcolo UPDRS.
     Basato su: Tsanas et al. "Accurate Telemonitoring of Parkinson's Disease
@@ -43,140 +351,116 @@ def extract_vocal_features(audio_path):
     - nhr: Noise-to-Harmonics Ratio
     - dfa: Detrended Fluctuation Analysis
     - ppe: Pitch Period Entropy
+
+    Se `timings` è un dict, viene popolato con la durata di ogni stage di analisi.
+    `sex` e `age` del paziente restringono il range di ricerca del pitch.
     """
     try:
-        sound = parselmouth.Sound(str(audio_path))
-        point_process = parselmouth.praat.call(sound, "To PointProcess (periodic, cc)", 75, 500)
-
-        # JITTER (Absolute): variabilità frequenza fondamentale (F0)
-        jitter_abs = parselmouth.praat.call(
-            point_process, "Get jitter (local, absolute)", 0, 0, 0.0001, 0.02, 1.3
-        )
+        return vocal_analysis.extract_features_from_path(audio_path, timings=timings, sex=sex, age=age)
 
-        # SHIMMER (Local): variabilità ampiezza
-        shimmer_local = parselmouth.praat.call(
-            [sound, point_process], "Get shimmer (local)", 0, 0, 0.0001, 0.02, 1.3, 1.6
-        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore analisi audio: {str(e)}")
 
-        # HNR: rapporto armoniche/rumore
-        harmonicity = parselmouth.praat.call(sound, "To Harmonicity (cc)", 0.01, 75, 0.1, 1.0)
-        hnr = parselmouth.praat.call(harmonicity, "Get mean", 0, 0)
 
-        # NHR: noise-to-harmonics ratio (inverso di HNR)
-        nhr = 1.0 / (hnr + 1e-6) if hnr > 0 else 1.0
+async def extract_vocal_features_async(audio_bytes, windowed=False, sex=None, age=None):
+    """
+    Come extract_vocal_features, ma sui byte del WAV caricato ed eseguita nel
+    pool di processi: l'event loop resta libero per login e letture mentre
+    l'analisi gira. Il WAV è decodificato in memoria, senza file temporanei.
 
-        # DFA: Detrended Fluctuation Analysis
-        intensity = sound.to_intensity(time_step=0.01)
-        intensity_values = [
-            intensity.get_value(t) for t in intensity.xs()
-            if not np.isnan(intensity.get_value(t))
-        ]
+    Con windowed=True l'analisi procede a finestre sovrapposte (memoria
+    limitata) e ritorna anche la serie per finestra.
+    """
+    try:
+        result, timings = await analysis_pool.run(
+            vocal_analysis.analyze_wav, audio_bytes, windowed, sex=sex, age=age
+        )
+    except AnalysisTimeout as e:
+        raise HTTPException(status_code=504, detail=f"Errore analisi audio: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore analisi audio: {str(e)}")
 
-        if len(intensity_values) > 10:
-            dfa = np.std(intensity_values) / (np.mean(intensity_values) + 1e-6)
-        else:
-            dfa = 0.0
+    for stage, seconds in timings.items():
+        EXTRACTION_STAGE_LATENCY.observe(seconds, stage=stage)
+    return result
 
-        # PPE: Pitch Period Entropy
-        pitch = sound.to_pitch(time_step=0.01, pitch_floor=75, pitch_ceiling=500)
-        pitch_values = [
-            pitch.get_value_at_time(t) for t in pitch.xs()
-            if not np.isnan(pitch.get_value_at_time(t))
-        ]
 
-        if len(pitch_values) > 5:
-            pitch_diffs = np.diff(pitch_values)
-            ppe = np.std(pitch_diffs) / (np.mean(np.abs(pitch_diffs)) + 1e-6)
-        else:
-            ppe = 0.0
+async def _read_upload(audio):
+    """Byte della registrazione, letti al più fino al limite (+1 per riconoscere il superamento)"""
+    return await audio.read(admission.max_upload_bytes + 1)
 
-        return {
-            'jitter_abs': float(jitter_abs),
-            'shimmer_local': float(shimmer_local),
-            'hnr': float(hnr),
-            'nhr': float(nhr),
-            'dfa': float(dfa),
-            'ppe': float(ppe)
-        }
 
+def _checked_duration(audio_bytes):
+    """Dimensione e durata (dall'intestazione WAV) verificate prima di decodificare: 413 oltre i limiti"""
+    try:
+        admission.check_size(len(audio_bytes))
+    except Rejection as e:
+        raise _rejected(e)
+    try:
+        duration = vocal_analysis.wav_duration(audio_bytes)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Errore analisi audio: {str(e)}")
-
+        raise HTTPException(status_code=400, detail=f"Audio non leggibile: {str(e)}")
+    try:
+        admission.check_duration(duration)
+    except Rejection as e:
+        raise _rejected(e)
+    return duration
 
-def compute_updrs(features):
-    """
-    Calcola UPDRS motorio con regressione lineare calibrata e normalizzazione.
-    Basato su Tsanas et al. (2010) - IEEE Transactions on Biomedical Engineering
 
-    Normalizzazione basata su statistiche del dataset Parkinson's Telemonitoring originale:
-    - Dataset: 5,875 registrazioni da 42 pazienti
-    - Range UPDRS: 7-54 punti (scala 0-108)
-    - MAE stimato: ~8-10 punti
-    """
+def _audio_cache_key(audio_bytes, windowed, sex, age):
+    return wav_key(audio_bytes, version=vocal_analysis.extractor_version(windowed, sex, age))
 
-    # Valori medi e deviazioni standard dal dataset Parkinson's Telemonitoring
-    # Fonte: Tsanas et al. (2010), Little et al. (2008)
-    MEANS = {
-        'jitter_abs': 0.00004,
-        'shimmer_local': 0.030,
-        'nhr': 0.025,
-        'hnr': 21.7,
-        'dfa': 0.718,
-        'ppe': 0.206
-    }
 
-    STDS = {
-        'jitter_abs': 0.00006,
-        'shimmer_local': 0.018,
-        'nhr': 0.040,
-        'hnr': 4.3,
-        'dfa': 0.055,
-        'ppe': 0.090
-    }
+async def extract_vocal_features_cached(audio_bytes, serie_temporale=False, patient=None):
+    """
+    Feature dalla cache se lo stesso audio è già stato analizzato
+    (chiave: SHA-256 dei campioni decodificati + versione estrattore),
+    altrimenti analisi nel pool e memorizzazione del risultato.
+
+    Le registrazioni oltre LONG_RECORDING_SECONDS, o quelle per cui è
+    richiesta la serie temporale, sono analizzate a finestre.
+    Sesso ed età del paziente, se noti, scelgono il range di ricerca del pitch.
+    Ritorna (features, finestre) con finestre None nell'analisi intera.
+    """
+    patient = patient or {}
+    sex, age = patient.get("sex"), patient.get("age")
+    # Durata dalla sola intestazione: una registrazione troppo lunga non viene decodificata
+    duration = _checked_duration(audio_bytes)
+    windowed = serie_temporale or duration > vocal_analysis.LONG_RECORDING_SECONDS
+    try:
+        with VISIT_STAGE_LATENCY.time(stage="cache_key"):
+            key = await run_in_visit_thread(_audio_cache_key, audio_bytes, windowed, sex, age)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Audio non leggibile: {str(e)}")
 
-    # Normalizza le feature (z-score standardization)
-    jitter_norm = (features['jitter_abs'] - MEANS['jitter_abs']) / STDS['jitter_abs']
-    shimmer_norm = (features['shimmer_local'] - MEANS['shimmer_local']) / STDS['shimmer_local']
-    nhr_norm = (features['nhr'] - MEANS['nhr']) / STDS['nhr']
-    hnr_norm = (features['hnr'] - MEANS['hnr']) / STDS['hnr']
-    dfa_norm = (features['dfa'] - MEANS['dfa']) / STDS['dfa']
-    ppe_norm = (features['ppe'] - MEANS['ppe']) / STDS['ppe']
-
-    # Coefficienti calibrati da letteratura scientifica
-    # Basato su Multiple Linear Regression con feature selection ottimale
-    # I coefficienti positivi indicano correlazione positiva con severità Parkinson
-    # Il coefficiente negativo per HNR indica che valori più bassi = maggiore severità
-    updrs = (
-            21.0 +  # Baseline (UPDRS medio nel dataset ~21 punti)
-            3.2 * jitter_norm +  # Jitter aumenta con severità (+)
-            2.8 * shimmer_norm +  # Shimmer aumenta con severità (+)
-            2.5 * nhr_norm +  # NHR aumenta con severità (+)
-            -1.8 * hnr_norm +  # HNR diminuisce con severità (-)
-            2.1 * dfa_norm +  # DFA aumenta con severità (+)
-            1.9 * ppe_norm  # PPE aumenta con severità (+)
-    )
+    with VISIT_STAGE_LATENCY.time(stage="cache_lookup"):
+        result = await run_in_visit_thread(feature_cache.get, key)
+    if result is None:
+        # Attesa di un worker libero inclusa: è il tempo percepito dal client
+        with VISIT_STAGE_LATENCY.time(stage="analysis"):
+            result = await extract_vocal_features_async(audio_bytes, windowed, sex, age)
+        await run_in_visit_thread(feature_cache.put, key, result)
 
-    # Limita al range valido UPDRS motorio (0-108)
-    return max(0.0, min(108.0, round(updrs, 2)))
+    if windowed:
+        return result["features"], result["finestre"]
+    return result, None
 
 
 @app.post("/login_doctor")
-def login_doctor(username: str = Form(...), password: str = Form(...)):
+async def login_doctor(username: str = Form(...), password: str = Form(...)):
     """Autenticazione medico tramite username o codice fiscale"""
     pw_hash = hashlib.sha256(password.encode()).hexdigest()
     username_upper = username.upper()
 
     try:
-        response = supabase.table("doctors").select("*").eq("username", username).eq("password_hash", pw_hash).execute()
+        user = await db.find_doctor(username=username, password_hash=pw_hash)
 
-        if not response.data:
-            response = supabase.table("doctors").select("*").eq("codice_fiscale", username_upper).eq("password_hash",
-                                                                                                     pw_hash).execute()
+        if user is None:
+            user = await db.find_doctor(codice_fiscale=username_upper, password_hash=pw_hash)
 
-        if not response.data:
+        if user is None:
             raise HTTPException(status_code=401, detail="Credenziali errate")
 
-        user = response.data[0]
         return {
             "username": user["username"],
             "codice_fiscale": user.get("codice_fiscale", ""),
@@ -189,19 +473,16 @@ def login_doctor(username: str = Form(...), password: str = Form(...)):
 
 
 @app.post("/login_patient")
-def login_patient(codice_fiscale: str = Form(...), password: str = Form(...)):
+async def login_patient(codice_fiscale: str = Form(...), password: str = Form(...)):
     """Autenticazione paziente tramite codice fiscale"""
     pw_hash = hashlib.sha256(password.encode()).hexdigest()
 
     try:
-        response = supabase.table("patients").select("*").eq(
-            "codice_fiscale", codice_fiscale.upper()
-        ).eq("password_hash", pw_hash).execute()
+        patient = await db.get_patient(codice_fiscale.upper(), password_hash=pw_hash)
 
-        if not response.data:
+        if patient is None:
             raise HTTPException(status_code=401, detail="Credenziali errate")
 
-        patient = response.data[0]
         return {
             "codice_fiscale": patient["codice_fiscale"],
             "nome": patient.get("nome", ""),
@@ -215,7 +496,7 @@ def login_patient(codice_fiscale: str = Form(...), password: str = Form(...)):
 
 
 @app.post("/register_patient")
-def register_patient(
+async def register_patient(
         codice_fiscale: str = Form(...),
         nome: str = Form(...),
         cognome: str = Form(...),
@@ -233,7 +514,7 @@ def register_patient(
     pw_hash = hashlib.sha256(password.encode()).hexdigest()
 
     try:
-        supabase.table("patients").insert({
+        await db.insert_patient({
             "codice_fiscale": cf_upper,
             "nome": nome,
             "cognome": cognome,
@@ -242,34 +523,44 @@ def register_patient(
             "sex": 1 if sex == "M" else 0,
             "doctor_username": doctor_username,
             "baseline_date": datetime.now().isoformat()
-        }).execute()
+        })
 
         return {"message": f"Paziente {nome} {cognome} registrato"}
+    except DuplicateError:
+        raise HTTPException(status_code=400, detail="Codice fiscale già registrato")
     except Exception as e:
-        if "duplicate" in str(e).lower():
-            raise HTTPException(status_code=400, detail="Codice fiscale già registrato")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/patients")
-def list_patients(doctor_username: str = None):
-    """Lista pazienti (filtrata per medico se specificato)"""
+async def list_patients(
+        response: Response,
+        doctor_username: str = None,
+        limite: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        cursore: Optional[str] = None
+):
+    """
+    Lista pazienti (filtrata per medico se specificato), a pagine in ordine di
+    codice fiscale. Se ci sono altri pazienti, l'header X-Cursore-Successivo
+    contiene il cursore da passare come `cursore` per la pagina seguente.
+    """
     try:
-        query = supabase.table("patients").select(
-            "codice_fiscale, nome, cognome, age, sex, doctor_username"
+        patients, next_cursor = await db.patients_page(
+            doctor_username, ["codice_fiscale", "nome", "cognome", "age", "sex", "doctor_username"],
+            cursor=cursore, limit=limite
         )
-
-        if doctor_username:
-            query = query.eq("doctor_username", doctor_username)
-
-        response = query.execute()
-        return response.data
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    if next_cursor:
+        response.headers["X-Cursore-Successivo"] = next_cursor
+    return patients
+
 
 @app.post("/reset_patient_password")
-def reset_patient_password(
+async def reset_patient_password(
         doctor_username: str = Form(...),
         codice_fiscale_paziente: str = Form(...),
         new_password: str = Form(...)
@@ -278,11 +569,9 @@ def reset_patient_password(
     cf_upper = codice_fiscale_paziente.upper()
 
     try:
-        patient_check = supabase.table("patients").select("*").eq(
-            "codice_fiscale", cf_upper
-        ).eq("doctor_username", doctor_username).execute()
+        patient = await db.get_patient(cf_upper, doctor_username=doctor_username)
 
-        if not patient_check.data:
+        if patient is None:
             raise HTTPException(
                 status_code=403,
                 detail="Paziente non trovato o non appartiene a questo medico"
@@ -290,11 +579,8 @@ def reset_patient_password(
 
         pw_hash = hashlib.sha256(new_password.encode()).hexdigest()
 
-        supabase.table("patients").update({
-            "password_hash": pw_hash
-        }).eq("codice_fiscale", cf_upper).execute()
+        await db.update_patient(cf_upper, {"password_hash": pw_hash})
 
-        patient = patient_check.data[0]
         return {
             "message": f"Password aggiornata",
             "codice_fiscale": cf_upper,
@@ -307,75 +593,412 @@ def reset_patient_password(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _measurement_columns(colonne):
+    """Nome di un insieme di colonne (updrs, feature, completo) o elenco separato da virgole"""
+    if colonne in MEASUREMENT_COLUMN_SETS:
+        return list(MEASUREMENT_COLUMN_SETS[colonne])
+    columns = [c.strip() for c in colonne.split(",") if c.strip()]
+    unknown = set(columns) - set(COLUMNS["measurements"])
+    if not columns or unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Colonne non valide: {', '.join(sorted(unknown)) or colonne}. "
+                   f"Insiemi disponibili: {', '.join(MEASUREMENT_COLUMN_SETS)}"
+        )
+    return columns
+
+
 @app.get("/history/{codice_fiscale}")
-def get_history(codice_fiscale: str):
-    """Storico misurazioni di un paziente"""
+async def get_history(
+        codice_fiscale: str,
+        colonne: str = "completo",
+        dal: Optional[str] = None,
+        al: Optional[str] = None,
+        limite: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        cursore: Optional[str] = None,
+        recenti_prima: bool = False
+):
+    """
+    Storico misurazioni di un paziente, a pagine.
+
+    - colonne: insieme (updrs, feature, completo) o elenco separato da virgole
+    - dal / al: intervallo di timestamp (dal incluso, al escluso, es. 2024-01-01)
+    - limite, cursore: dimensione della pagina e cursore_successivo della pagina precedente
+    - recenti_prima: dalla misurazione più recente
+    """
     cf_upper = codice_fiscale.upper()
+    columns = _measurement_columns(colonne)
 
     try:
-        patient_response = supabase.table("patients").select("*").eq(
-            "codice_fiscale", cf_upper
-        ).execute()
+        # Anagrafica e pagina dello storico sono indipendenti: richieste in parallelo
+        info, (measurements, next_cursor) = await asyncio.gather(
+            db.get_patient(cf_upper, PATIENT_PUBLIC_COLUMNS),
+            db.measurements_page(
+                cf_upper, columns, cursor=cursore, limit=limite, since=dal, until=al, descending=recenti_prima
+            )
+        )
 
-        if not patient_response.data:
+        if info is None:
             raise HTTPException(status_code=404, detail="Paziente non trovato")
 
-        info = patient_response.data[0]
-
-        measurements_response = supabase.table("measurements").select("*").eq(
-            "codice_fiscale", cf_upper
-        ).order("timestamp", desc=False).execute()
-
-        measurements = measurements_response.data
-
         return {
             "info": info,
-            "history": measurements
+            "history": measurements,
+            "cursore_successivo": next_cursor
         }
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/visit")
-def visit(codice_fiscale: str = Form(...), audio: UploadFile = File(...)):
+async def visit(
+        codice_fiscale: str = Form(...),
+        audio: UploadFile = File(...),
+        serie_temporale: bool = Form(False)
+):
     """
     Endpoint principale: analisi vocale e calcolo UPDRS
 
     Input:
     - codice_fiscale: CF del paziente
     - audio: file WAV della registrazione vocale
+    - serie_temporale: se vero, ritorna anche le feature per finestra
 
     Output:
     - motor_UPDRS: punteggio UPDRS calcolato (0-108)
     - 6 feature vocali estratte
+    - finestre: serie temporale per finestra (solo con serie_temporale)
+    """
+    cf_upper = codice_fiscale.upper()
+
+    # L'audio resta in memoria: nessuna copia su disco
+    with VISIT_STAGE_LATENCY.time(stage="upload_read"):
+        audio_bytes = await _read_upload(audio)
+
+    patient = await _get_patient(cf_upper)
+    return await _process_visit(cf_upper, patient, audio_bytes, serie_temporale)
+
+
+async def _get_patient(cf_upper):
+    # Verifica esistenza paziente
+    with VISIT_STAGE_LATENCY.time(stage="patient_lookup"):
+        patient = await db.get_patient(cf_upper)
+
+    if patient is None:
+        raise HTTPException(status_code=404, detail="Paziente non trovato")
+    return patient
+
+
+async def _process_visit(cf_upper, patient, audio_bytes, serie_temporale=False):
+    """Analisi, calcolo UPDRS e salvataggio di una visita (condiviso da /visit e dai job)"""
+    # Estrai le 6 feature vocali dall'audio (cache o pool di processi)
+    features, finestre = await extract_vocal_features_cached(audio_bytes, serie_temporale, patient)
+
+    # Calcola UPDRS con il modello attivo (la versione viene salvata con la misurazione)
+    with VISIT_STAGE_LATENCY.time(stage="updrs"):
+        model = updrs_models.active()
+        updrs = model.compute(features)
+
+    # Salva nel database con TUTTE le feature per analisi future
+    measurement = {
+        "codice_fiscale": cf_upper,
+        "timestamp": datetime.now().isoformat(),
+        "motor_updrs": updrs,
+        "jitter": features['jitter_abs'],
+        "shimmer": features['shimmer_local'],
+        "hnr": features['hnr'],
+        "nhr": features['nhr'],
+        "dfa": features['dfa'],
+        "ppe": features['ppe'],
+        "model_version": model.version
+    }
+    first_visit = not patient.get("baseline_updrs")
+
+    if write_behind is not None:
+        # Misurazione (ed eventuale baseline) nella coda locale: il database la riceve in background
+        with VISIT_STAGE_LATENCY.time(stage="measurement_queue"):
+            await write_behind.submit([measurement], {cf_upper: updrs} if first_visit else None)
+    else:
+        with VISIT_STAGE_LATENCY.time(stage="measurement_insert"):
+            await db.insert_measurements([measurement])
+
+        # Aggiorna baseline se è la prima misurazione (solo se la misurazione è salvata
+        # e se nessuna visita concorrente l'ha già impostata)
+        if first_visit:
+            with VISIT_STAGE_LATENCY.time(stage="baseline_update"):
+                await db.set_missing_baselines({cf_upper: updrs})
+
+    # Ritorna risultati
+    result = {
+        "motor_UPDRS": updrs,
+        "model_version": model.version,
+        "jitter": features['jitter_abs'],
+        "shimmer": features['shimmer_local'],
+        "hnr": features['hnr'],
+        "nhr": features['nhr'],
+        "dfa": features['dfa'],
+        "ppe": features['ppe']
+    }
+    if serie_temporale:
+        result["finestre"] = finestre
+    return result
+
+
+@app.post("/visit_jobs")
+async def submit_visit_job(
+        codice_fiscale: str = Form(...),
+        audio: UploadFile = File(...),
+        serie_temporale: bool = Form(False)
+):
+    """
+    Come /visit, ma asincrono: l'audio viene accodato e la risposta ritorna
+    subito il job ID. Il risultato si ottiene da /visit_jobs/{job_id}
+    (polling) o da /visit_jobs/{job_id}/events (server-sent events).
     """
     cf_upper = codice_fiscale.upper()
-    temp_path = UPLOAD_DIR / f"{uuid.uuid4()}_{audio.filename}"
+    audio_bytes = await _read_upload(audio)
+
+    # Paziente e audio verificati subito: un errore non deve attendere la coda per emergere
+    _checked_duration(audio_bytes)
+    await _get_patient(cf_upper)
+
+    job_id = await run_in_threadpool(
+        visit_jobs.create, cf_upper, audio_bytes, {"serie_temporale": serie_temporale}
+    )
+    return {"job_id": job_id, "stato": job_store.QUEUED}
+
+
+@app.get("/visit_jobs")
+async def visit_jobs_stats():
+    """Job per stato, profondità della coda e durate (attesa, esecuzione) degli ultimi job"""
+    return await run_in_threadpool(visit_jobs.stats)
+
+
+@app.get("/visit_jobs/{job_id}")
+async def get_visit_job(job_id: str):
+    """Stato di un job; a job completato contiene il risultato di /visit"""
+    job = await run_in_threadpool(visit_jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return job
 
-    # Salva temporaneamente il file audio
-    with open(temp_path, "wb") as f:
-        shutil.copyfileobj(audio.file, f)
 
+@app.get("/visit_jobs/{job_id}/events")
+async def visit_job_events(job_id: str):
+    """
+    Stream SSE dello stato del job: un evento a ogni cambio di stato,
+    l'ultimo (completato o fallito) contiene il risultato o l'errore.
+    """
+    job = await run_in_threadpool(visit_jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+
+    async def events(job):
+        last_state = None
+        while True:
+            state = (job["stato"], job.get("posizione"))
+            if state != last_state:
+                yield f"event: {job['stato']}\ndata: {json.dumps(job)}\n\n"
+                last_state = state
+            if job["stato"] in job_store.FINAL_STATES:
+                return
+            await asyncio.sleep(JOB_POLL_SECONDS)
+            job = await run_in_threadpool(visit_jobs.get, job_id)
+
+    return StreamingResponse(
+        events(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+
+async def _dispatch_visit_jobs():
+    """Prende in carico i job in coda uno alla volta e li esegue come /visit"""
+    while True:
+        try:
+            await _run_next_visit_job()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Errore dell'archivio dei job (es. database bloccato): il dispatcher resta attivo
+            logger.exception("Errore del dispatcher dei job di visita")
+            await asyncio.sleep(JOB_POLL_SECONDS)
+
+
+async def _run_next_visit_job():
+    claimed = await run_in_threadpool(visit_jobs.claim_next)
+    if claimed is None:
+        await asyncio.sleep(JOB_POLL_SECONDS)
+        return
+
+    job_id, cf_upper, audio_bytes, options = claimed
+    _running_jobs.add(job_id)
     try:
-        # Verifica esistenza paziente
-        patient_check = supabase.table("patients").select("*").eq(
-            "codice_fiscale", cf_upper
-        ).execute()
+        try:
+            patient = await _get_patient(cf_upper)
+            result = await _process_visit(
+                cf_upper, patient, audio_bytes, options.get("serie_temporale", False)
+            )
+        except asyncio.CancelledError:
+            # Arresto del server: il job torna in coda e riparte al prossimo avvio.
+            # Chiamata diretta: il task è in cancellazione e non deve più attendere
+            visit_jobs.requeue(job_id)
+            raise
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            await run_in_threadpool(visit_jobs.fail, job_id, detail)
+            return
+
+        try:
+            await run_in_threadpool(visit_jobs.complete, job_id, result)
+        except Exception as e:
+            # Risultato non salvabile: il job fallisce invece di restare in_corso
+            logger.exception("Salvataggio del risultato del job %s non riuscito", job_id)
+            await run_in_threadpool(visit_jobs.fail, job_id, f"Errore salvataggio risultato: {e}")
+    finally:
+        _running_jobs.discard(job_id)
 
-        if not patient_check.data:
-            raise HTTPException(status_code=404, detail="Paziente non trovato")
 
-        # Estrai le 6 feature vocali dall'audio
-        features = extract_vocal_features(temp_path)
+async def _maintain_visit_jobs():
+    """
+    Ogni mezzo timeout di analisi rinnova l'heartbeat dei job in esecuzione
+    in questo processo e rimette in coda i job di qualunque processo senza
+    heartbeat da due timeout (processo terminato senza arresto ordinato,
+    anche mentre il server è attivo). Elimina i job conclusi oltre
+    JOB_RETENTION_SECONDS.
+    """
+    while True:
+        try:
+            await run_in_threadpool(visit_jobs.heartbeat, list(_running_jobs))
+            await run_in_threadpool(visit_jobs.requeue_stale, 2 * analysis_pool.timeout)
+            await run_in_threadpool(visit_jobs.purge, JOB_RETENTION_SECONDS)
+        except Exception:
+            logger.exception("Manutenzione dei job di visita non riuscita")
+        await asyncio.sleep(analysis_pool.timeout / 2)
+
+
+def _cf_from_archive_name(name):
+    """CF dalla cartella che contiene il file (.../CF/file.wav) o dal prefisso del nome (CF_file.wav)"""
+    path = PurePosixPath(name)
+    folder = path.parent.name.upper()
+    if re.match(r'^[A-Z0-9]{16}$', folder):
+        return folder
+    return path.stem.split("_")[0].upper()
+
+
+def _unpack_batch(files, codici_fiscali, archive):
+    """
+    Legge in memoria le registrazioni del batch.
+    Ritorna una lista di (nome file, CF, byte del WAV).
+    """
+    items = []
+
+    if files:
+        if len(codici_fiscali) == 1:
+            codici_fiscali = codici_fiscali * len(files)
+        if len(codici_fiscali) != len(files):
+            raise HTTPException(
+                status_code=400,
+                detail="Serve un codice fiscale per ogni file (o uno solo per tutti)"
+            )
+        for upload, cf in zip(files, codici_fiscali):
+            items.append((upload.filename, cf.upper(), upload.file.read()))
+
+    if archive is not None:
+        try:
+            with zipfile.ZipFile(archive.file) as zf:
+                entries = [
+                    info for info in zf.infolist()
+                    if not info.is_dir() and info.filename.lower().endswith(".wav")
+                ]
+                if len(items) + len(entries) > MAX_BATCH_FILES:
+                    raise HTTPException(
+                        status_code=400, detail=f"Massimo {MAX_BATCH_FILES} registrazioni per batch"
+                    )
+                # Limiti sulla dimensione decompressa (archivi "zip bomb"): prima dalle
+                # dimensioni dichiarate, poi su quanto letto davvero, senza mai leggere
+                # più di una registrazione oltre il limite
+                total = sum(len(audio_bytes) for _, _, audio_bytes in items)
+                for info in entries:
+                    admission.check_size(info.file_size)
+                    admission.check_size(total + info.file_size, batch=True)
+                    with zf.open(info) as f:
+                        audio_bytes = f.read(admission.max_upload_bytes + 1)
+                    admission.check_size(len(audio_bytes))
+                    total += len(audio_bytes)
+                    admission.check_size(total, batch=True)
+                    items.append((info.filename, _cf_from_archive_name(info.filename), audio_bytes))
+        except Rejection as e:
+            raise _rejected(e)
+        except (zipfile.BadZipFile, zipfile.LargeZipFile, NotImplementedError):
+            raise HTTPException(status_code=400, detail="Archivio ZIP non valido")
+
+    if not items:
+        raise HTTPException(status_code=400, detail="Nessuna registrazione WAV nel batch")
+    if len(items) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"Massimo {MAX_BATCH_FILES} registrazioni per batch")
+    return items
+
+
+@app.post("/visit_batch")
+async def visit_batch(
+        audio: Optional[List[UploadFile]] = File(None),
+        codici_fiscali: Optional[List[str]] = Form(None),
+        archive: Optional[UploadFile] = File(None)
+):
+    """
+    Ingestione di molte registrazioni in una sola richiesta.
+
+    Input (anche combinati):
+    - audio + codici_fiscali: file WAV e CF corrispondenti (stesso ordine, o un CF per tutti)
+    - archive: ZIP con i WAV in cartelle CF/ o con nome CF_*.wav
 
-        # Calcola UPDRS con algoritmo calibrato
-        updrs = compute_updrs(features)
+    Le feature sono estratte in parallelo nel pool di processi, i pazienti
+    sono verificati con una sola query e le misurazioni salvate con un
+    unico insert. La risposta riporta l'esito di ogni file.
+    """
+    items = await run_in_threadpool(_unpack_batch, audio, codici_fiscali or [], archive)
 
-        # Salva nel database con TUTTE le feature per analisi future
-        supabase.table("measurements").insert({
-            "codice_fiscale": cf_upper,
+    # Una sola query per tutti i pazienti del batch
+    cf_set = sorted({cf for _, cf, _ in items})
+    patients_data = await db.get_patients(cf_set, ["codice_fiscale", "baseline_updrs", "sex", "age"])
+    patients = {p["codice_fiscale"]: p for p in patients_data}
+
+    async def analyze(cf, audio_bytes):
+        if cf not in patients:
+            raise HTTPException(status_code=404, detail="Paziente non trovato")
+        features, _ = await extract_vocal_features_cached(audio_bytes, patient=patients[cf])
+        return features
+
+    # Il pool limita da solo la concorrenza effettiva
+    outcomes = await asyncio.gather(
+        *(analyze(cf, data) for _, cf, data in items),
+        return_exceptions=True
+    )
+
+    # Tutti i punteggi del batch in una sola chiamata al kernel vettoriale
+    model = updrs_models.active()
+    analyzed = [outcome for outcome in outcomes if not isinstance(outcome, BaseException)]
+    scores = iter(model.score(features_matrix(analyzed)).tolist())
+
+    results = []
+    rows = []
+    first_updrs = {}
+    for (filename, cf, _), outcome in zip(items, outcomes):
+        if isinstance(outcome, BaseException):
+            detail = outcome.detail if isinstance(outcome, HTTPException) else str(outcome)
+            results.append({"file": filename, "codice_fiscale": cf, "ok": False, "errore": detail})
+            continue
+
+        features = outcome
+        updrs = next(scores)
+        first_updrs.setdefault(cf, updrs)
+        rows.append({
+            "codice_fiscale": cf,
             "timestamp": datetime.now().isoformat(),
             "motor_updrs": updrs,
             "jitter": features['jitter_abs'],
@@ -383,45 +1006,62 @@ def visit(codice_fiscale: str = Form(...), audio: UploadFile = File(...)):
             "hnr": features['hnr'],
             "nhr": features['nhr'],
             "dfa": features['dfa'],
-            "ppe": features['ppe']
-        }).execute()
-
-        # Aggiorna baseline se è la prima misurazione
-        patient = patient_check.data[0]
-        if not patient.get("baseline_updrs"):
-            supabase.table("patients").update({
-                "baseline_updrs": updrs
-            }).eq("codice_fiscale", cf_upper).execute()
-
-        # Ritorna risultati
-        return {
+            "ppe": features['ppe'],
+            "model_version": model.version
+        })
+        results.append({
+            "file": filename,
+            "codice_fiscale": cf,
+            "ok": True,
             "motor_UPDRS": updrs,
+            "model_version": model.version,
             "jitter": features['jitter_abs'],
             "shimmer": features['shimmer_local'],
             "hnr": features['hnr'],
             "nhr": features['nhr'],
             "dfa": features['dfa'],
             "ppe": features['ppe']
+        })
+
+    if rows:
+        # Baseline per i pazienti alla prima misurazione
+        baselines = {
+            cf: updrs for cf, updrs in first_updrs.items() if not patients[cf].get("baseline_updrs")
         }
-    finally:
-        # Pulizia: rimuovi file temporaneo
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        try:
+            if write_behind is not None:
+                # Tutto il batch nella coda locale, consegnato in background
+                await write_behind.submit(rows, baselines)
+            else:
+                # Insert unico per tutte le misurazioni riuscite
+                await db.insert_measurements(rows)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Errore salvataggio misurazioni: {str(e)}")
+
+        # Aggiornamenti in parallelo (solo dopo l'insert riuscito, solo dove la baseline è ancora vuota)
+        if baselines and write_behind is None:
+            await db.set_missing_baselines(baselines)
+
+    return {
+        "n_file": len(results),
+        "n_ok": len(rows),
+        "n_errori": len(results) - len(rows),
+        "risultati": results
+    }
 
 
 @app.get("/patient_stats/{codice_fiscale}")
-def get_patient_stats(codice_fiscale: str):
+async def get_patient_stats(codice_fiscale: str):
     """
-    Statistiche aggregate per dashboard paziente
+    Statistiche aggregate per dashboard paziente, lette dagli aggregati
+    mantenuti a ogni misurazione (nessuna lettura dello storico)
     """
     cf_upper = codice_fiscale.upper()
 
     try:
-        measurements = supabase.table("measurements").select("*").eq(
-            "codice_fiscale", cf_upper
-        ).order("timestamp", desc=False).execute()
+        aggregate = await db.get_aggregate(cf_upper)
 
-        if not measurements.data or len(measurements.data) == 0:
+        if not aggregate or not aggregate["n_misurazioni"]:
             return {
                 "n_misurazioni": 0,
                 "ultimo_updrs": None,
@@ -429,92 +1069,72 @@ def get_patient_stats(codice_fiscale: str):
                 "variazione": None,
                 "trend": None,
                 "media_jitter": None,
-                "media_shimmer": None
+                "media_shimmer": None,
+                "deviazione_std": None
             }
 
-        data = measurements.data
-
-        updrs_values = [m['motor_updrs'] for m in data]
-        jitter_values = [m['jitter'] for m in data]
-        shimmer_values = [m['shimmer'] for m in data]
-
-        return {
-            "n_misurazioni": len(data),
-            "ultimo_updrs": updrs_values[-1],
-            "primo_updrs": updrs_values[0],
-            "variazione": updrs_values[-1] - updrs_values[0],
-            "trend": "peggioramento" if updrs_values[-1] > updrs_values[0] else "miglioramento",
-            "media_jitter": round(np.mean(jitter_values), 6),
-            "media_shimmer": round(np.mean(shimmer_values), 6)
-        }
+        return patient_stats.patient_summary(aggregate)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/doctor_overview/{doctor_username}")
-def get_doctor_overview(doctor_username: str):
+async def get_doctor_overview(doctor_username: str):
     """
     Overview per dashboard medico con pazienti critici e trend generale
     """
     try:
-        patients = supabase.table("patients").select("*").eq(
-            "doctor_username", doctor_username
-        ).execute()
+        patients = await db.list_patients(doctor_username, ["codice_fiscale", "nome", "cognome"])
 
-        if not patients.data:
+        if not patients:
             return {
                 "n_pazienti": 0,
                 "pazienti_critici": [],
                 "trend_generale": None
             }
 
-        pazienti_critici = []
-        all_trends = []
+        # Una sola query sugli aggregati per paziente (una riga ciascuno, non lo storico)
+        aggregates = await db.get_aggregates(
+            [p['codice_fiscale'] for p in patients], patient_stats.OVERVIEW_COLUMNS
+        )
+        return patient_stats.doctor_overview(patients, aggregates)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        for patient in patients.data:
-            cf = patient['codice_fiscale']
 
-            measurements = supabase.table("measurements").select("motor_updrs").eq(
-                "codice_fiscale", cf
-            ).order("timestamp", desc=False).execute()
+@app.get("/write_behind")
+async def write_behind_stats():
+    """Stato della scrittura differita: voci in coda, attesa della più vecchia, consegne ed errori"""
+    if write_behind is None:
+        return {"attiva": False}
+    return {"attiva": True, **await run_in_threadpool(write_behind.stats)}
 
-            if measurements.data and len(measurements.data) >= 2:
-                updrs_vals = [m['motor_updrs'] for m in measurements.data]
-                variazione = updrs_vals[-1] - updrs_vals[0]
-                all_trends.append(variazione)
 
-                # Criteri per paziente critico:
-                # 1. UPDRS corrente > 30 (moderato-severo)
-                # 2. Variazione > 10 punti (peggioramento significativo)
-                if updrs_vals[-1] > 30 or variazione > 10:
-                    pazienti_critici.append({
-                        "nome": f"{patient['nome']} {patient['cognome']}",
-                        "codice_fiscale": cf,
-                        "ultimo_updrs": updrs_vals[-1],
-                        "variazione": variazione
-                    })
+@app.get("/updrs_models")
+async def list_updrs_models():
+    """Modelli UPDRS disponibili, versione attiva ed eventuali file non validi"""
+    return updrs_models.versions()
 
-        trend_medio = np.mean(all_trends) if all_trends else 0
 
-        return {
-            "n_pazienti": len(patients.data),
-            "pazienti_critici": sorted(pazienti_critici, key=lambda x: x['ultimo_updrs'], reverse=True),
-            "trend_generale": round(trend_medio, 2)
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+@app.get("/metrics")
+async def get_metrics():
+    """Metriche in formato di esposizione testuale Prometheus"""
+    # Alcuni gauge leggono il job store SQLite (con il suo lock): fuori dall'event loop
+    text = await run_in_threadpool(metrics.REGISTRY.render)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
 
 
 # Endpoint di test per verificare che l'API sia funzionante
 @app.get("/")
-def read_root():
+async def read_root():
     return {
         "message": "Parkinson Telemonitoring API - Running",
         "version": "2.0 - Optimized",
         "features_used": 6,
         "endpoints": [
             "/login_doctor", "/login_patient", "/register_patient",
-            "/visit", "/history/{cf}", "/patients", "/patient_stats/{cf}",
+            "/visit", "/visit_batch", "/visit_jobs", "/visit_jobs/{job_id}",
+            "/visit_jobs/{job_id}/events", "/write_behind", "/updrs_models", "/metrics", "/history/{cf}", "/patients", "/patient_stats/{cf}",
             "/doctor_overview/{username}", "/reset_patient_password"
         ]
     }
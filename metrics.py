@@ -0,0 +1,248 @@
+"""
+Registro di metriche in-process, esposto in formato testo Prometheus.
+
+Contatori, gauge e istogrammi con etichette, thread-safe (il portale e
+gli strumenti usano il client Supabase sincrono anche da più thread). Nessuna dipendenza esterna:
+render() produce il testo servito da /metrics.
+
+Uso:
+    REQUESTS = Counter("nome_total", "descrizione", ("endpoint",))
+    REQUESTS.inc(endpoint="/visit")
+    with LATENCY.time(stage="pitch"):
+        ...
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Bucket in secondi: dalle letture veloci (ms) alle analisi lunghe (minuti)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Tutte le metriche in formato di esposizione testuale"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{_escape(v)}"' for n, v in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        self._function = None
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: etichette attese {self.labelnames}, ricevute {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def set_function(self, function):
+        """Legge il valore (senza etichette) da una funzione al momento dell'esposizione"""
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            return [f"{self.name} {_format_value(self._function())}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Counter(_Metric):
+    """Valore che può solo crescere"""
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(_Metric):
+    """Valore istantaneo (es. richieste in corso, coda di un pool)"""
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Incrementa per la durata del blocco (richieste o analisi in corso)"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """Distribuzione di osservazioni (tipicamente latenze in secondi) in bucket cumulativi"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Osserva la durata del blocco, anche se solleva un'eccezione"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, (list(s[0]), s[1], s[2])) for k, s in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                labels = _format_labels(self.labelnames, key, (("le", _format_value(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class _TimedQuery:
+    """Query builder Supabase che registra latenza ed errori di execute()"""
+
+    def __init__(self, builder, table, operation, latency, errors):
+        self._builder = builder
+        self._table = table
+        self._operation = operation
+        self._latency = latency
+        self._errors = errors
+
+    def execute(self):
+        labels = {"table": self._table, "operation": self._operation or "select"}
+        try:
+            with self._latency.time(**labels):
+                return self._builder.execute()
+        except Exception:
+            self._errors.inc(**labels)
+            raise
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            return attr
+
+        def chained(*args, **kwargs):
+            # Il primo metodo della catena (select, insert, update, delete, upsert) è l'operazione
+            return type(self)(
+                attr(*args, **kwargs), self._table, self._operation or name, self._latency, self._errors
+            )
+        return chained
+
+
+class _AsyncTimedQuery(_TimedQuery):
+    """Come _TimedQuery, per il client asincrono (execute() è una coroutine)"""
+
+    async def execute(self):
+        labels = {"table": self._table, "operation": self._operation or "select"}
+        try:
+            with self._latency.time(**labels):
+                return await self._builder.execute()
+        except Exception:
+            self._errors.inc(**labels)
+            raise
+
+
+class InstrumentedSupabase:
+    """
+    Client Supabase con conteggio e latenza di ogni chiamata per tabella e
+    operazione: si usa come il client originale (table(...)...execute()).
+    """
+
+    query_class = _TimedQuery
+
+    def __init__(self, client, latency, errors):
+        self._client = client
+        self._latency = latency
+        self._errors = errors
+
+    def table(self, name):
+        return self.query_class(self._client.table(name), name, None, self._latency, self._errors)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class InstrumentedAsyncSupabase(InstrumentedSupabase):
+    """InstrumentedSupabase per il client asincrono (acreate_client)"""
+
+    query_class = _AsyncTimedQuery
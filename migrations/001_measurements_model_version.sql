@@ -0,0 +1,2 @@
+-- Versione del modello UPDRS che ha calcolato motor_updrs (vedi updrs_model.py)
+ALTER TABLE measurements ADD COLUMN IF NOT EXISTS model_version text;
@@ -0,0 +1,79 @@
+-- Aggregati UPDRS per paziente mantenuti a ogni inserimento in measurements
+-- (conteggio, primo/ultimo UPDRS, media e M2 di Welford per feature), letti da
+-- /patient_stats e /doctor_overview. Stessa logica del trigger SQLite in repository.py.
+-- Dopo la migrazione popolare la tabella con: python rebuild_patient_stats.py
+
+CREATE TABLE IF NOT EXISTS patient_aggregates (
+    codice_fiscale text PRIMARY KEY,
+    n_misurazioni integer NOT NULL DEFAULT 0,
+    primo_timestamp timestamptz,
+    primo_updrs double precision,
+    ultimo_timestamp timestamptz,
+    ultimo_updrs double precision,
+    n_motor_updrs integer NOT NULL DEFAULT 0,
+    media_motor_updrs double precision NOT NULL DEFAULT 0,
+    m2_motor_updrs double precision NOT NULL DEFAULT 0,
+    n_jitter integer NOT NULL DEFAULT 0,
+    media_jitter double precision NOT NULL DEFAULT 0,
+    m2_jitter double precision NOT NULL DEFAULT 0,
+    n_shimmer integer NOT NULL DEFAULT 0,
+    media_shimmer double precision NOT NULL DEFAULT 0,
+    m2_shimmer double precision NOT NULL DEFAULT 0,
+    n_nhr integer NOT NULL DEFAULT 0,
+    media_nhr double precision NOT NULL DEFAULT 0,
+    m2_nhr double precision NOT NULL DEFAULT 0,
+    n_hnr integer NOT NULL DEFAULT 0,
+    media_hnr double precision NOT NULL DEFAULT 0,
+    m2_hnr double precision NOT NULL DEFAULT 0,
+    n_dfa integer NOT NULL DEFAULT 0,
+    media_dfa double precision NOT NULL DEFAULT 0,
+    m2_dfa double precision NOT NULL DEFAULT 0,
+    n_ppe integer NOT NULL DEFAULT 0,
+    media_ppe double precision NOT NULL DEFAULT 0,
+    m2_ppe double precision NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION update_patient_aggregates() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO patient_aggregates (codice_fiscale) VALUES (NEW.codice_fiscale)
+        ON CONFLICT (codice_fiscale) DO NOTHING;
+    -- Nelle espressioni di SET le colonne di "a" hanno il valore precedente all'UPDATE
+    UPDATE patient_aggregates AS a SET
+        n_misurazioni = a.n_misurazioni + 1,
+        primo_updrs = CASE WHEN a.primo_timestamp IS NULL OR NEW."timestamp"::timestamptz < a.primo_timestamp
+            THEN NEW.motor_updrs ELSE a.primo_updrs END,
+        primo_timestamp = CASE WHEN a.primo_timestamp IS NULL OR NEW."timestamp"::timestamptz < a.primo_timestamp
+            THEN NEW."timestamp"::timestamptz ELSE a.primo_timestamp END,
+        ultimo_updrs = CASE WHEN a.ultimo_timestamp IS NULL OR NEW."timestamp"::timestamptz >= a.ultimo_timestamp
+            THEN NEW.motor_updrs ELSE a.ultimo_updrs END,
+        ultimo_timestamp = CASE WHEN a.ultimo_timestamp IS NULL OR NEW."timestamp"::timestamptz >= a.ultimo_timestamp
+            THEN NEW."timestamp"::timestamptz ELSE a.ultimo_timestamp END,
+        n_motor_updrs = a.n_motor_updrs + (NEW.motor_updrs IS NOT NULL)::int,
+        media_motor_updrs = CASE WHEN NEW.motor_updrs IS NULL THEN a.media_motor_updrs ELSE a.media_motor_updrs + (NEW.motor_updrs - a.media_motor_updrs) / (a.n_motor_updrs + 1) END,
+        m2_motor_updrs = CASE WHEN NEW.motor_updrs IS NULL THEN a.m2_motor_updrs ELSE a.m2_motor_updrs + (NEW.motor_updrs - a.media_motor_updrs) * (NEW.motor_updrs - a.media_motor_updrs - (NEW.motor_updrs - a.media_motor_updrs) / (a.n_motor_updrs + 1)) END,
+        n_jitter = a.n_jitter + (NEW.jitter IS NOT NULL)::int,
+        media_jitter = CASE WHEN NEW.jitter IS NULL THEN a.media_jitter ELSE a.media_jitter + (NEW.jitter - a.media_jitter) / (a.n_jitter + 1) END,
+        m2_jitter = CASE WHEN NEW.jitter IS NULL THEN a.m2_jitter ELSE a.m2_jitter + (NEW.jitter - a.media_jitter) * (NEW.jitter - a.media_jitter - (NEW.jitter - a.media_jitter) / (a.n_jitter + 1)) END,
+        n_shimmer = a.n_shimmer + (NEW.shimmer IS NOT NULL)::int,
+        media_shimmer = CASE WHEN NEW.shimmer IS NULL THEN a.media_shimmer ELSE a.media_shimmer + (NEW.shimmer - a.media_shimmer) / (a.n_shimmer + 1) END,
+        m2_shimmer = CASE WHEN NEW.shimmer IS NULL THEN a.m2_shimmer ELSE a.m2_shimmer + (NEW.shimmer - a.media_shimmer) * (NEW.shimmer - a.media_shimmer - (NEW.shimmer - a.media_shimmer) / (a.n_shimmer + 1)) END,
+        n_nhr = a.n_nhr + (NEW.nhr IS NOT NULL)::int,
+        media_nhr = CASE WHEN NEW.nhr IS NULL THEN a.media_nhr ELSE a.media_nhr + (NEW.nhr - a.media_nhr) / (a.n_nhr + 1) END,
+        m2_nhr = CASE WHEN NEW.nhr IS NULL THEN a.m2_nhr ELSE a.m2_nhr + (NEW.nhr - a.media_nhr) * (NEW.nhr - a.media_nhr - (NEW.nhr - a.media_nhr) / (a.n_nhr + 1)) END,
+        n_hnr = a.n_hnr + (NEW.hnr IS NOT NULL)::int,
+        media_hnr = CASE WHEN NEW.hnr IS NULL THEN a.media_hnr ELSE a.media_hnr + (NEW.hnr - a.media_hnr) / (a.n_hnr + 1) END,
+        m2_hnr = CASE WHEN NEW.hnr IS NULL THEN a.m2_hnr ELSE a.m2_hnr + (NEW.hnr - a.media_hnr) * (NEW.hnr - a.media_hnr - (NEW.hnr - a.media_hnr) / (a.n_hnr + 1)) END,
+        n_dfa = a.n_dfa + (NEW.dfa IS NOT NULL)::int,
+        media_dfa = CASE WHEN NEW.dfa IS NULL THEN a.media_dfa ELSE a.media_dfa + (NEW.dfa - a.media_dfa) / (a.n_dfa + 1) END,
+        m2_dfa = CASE WHEN NEW.dfa IS NULL THEN a.m2_dfa ELSE a.m2_dfa + (NEW.dfa - a.media_dfa) * (NEW.dfa - a.media_dfa - (NEW.dfa - a.media_dfa) / (a.n_dfa + 1)) END,
+        n_ppe = a.n_ppe + (NEW.ppe IS NOT NULL)::int,
+        media_ppe = CASE WHEN NEW.ppe IS NULL THEN a.media_ppe ELSE a.media_ppe + (NEW.ppe - a.media_ppe) / (a.n_ppe + 1) END,
+        m2_ppe = CASE WHEN NEW.ppe IS NULL THEN a.m2_ppe ELSE a.m2_ppe + (NEW.ppe - a.media_ppe) * (NEW.ppe - a.media_ppe - (NEW.ppe - a.media_ppe) / (a.n_ppe + 1)) END
+    WHERE a.codice_fiscale = NEW.codice_fiscale;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS measurements_aggregates ON measurements;
+CREATE TRIGGER measurements_aggregates AFTER INSERT ON measurements
+    FOR EACH ROW EXECUTE FUNCTION update_patient_aggregates();
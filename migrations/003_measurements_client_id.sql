@@ -0,0 +1,6 @@
+-- Chiave di idempotenza delle misurazioni consegnate dalla scrittura differita
+-- (write_behind.py): un blocco riconsegnato dopo un crash non viene inserito due
+-- volte (ON CONFLICT DO NOTHING), né contato due volte dal trigger degli aggregati.
+-- NULL per le misurazioni scritte direttamente: l'indice unico ammette più NULL.
+ALTER TABLE measurements ADD COLUMN IF NOT EXISTS client_id text;
+CREATE UNIQUE INDEX IF NOT EXISTS measurements_client_id ON measurements (client_id);
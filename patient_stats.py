@@ -0,0 +1,191 @@
+"""
+Statistiche UPDRS per paziente da aggregati mantenuti incrementalmente.
+
+Per ogni paziente la tabella patient_aggregates contiene numero di
+misurazioni, primo e ultimo UPDRS e, per ogni feature, conteggio, media e
+M2 di Welford (somma dei quadrati degli scarti dalla media). Un trigger li
+aggiorna a ogni inserimento di una misurazione, nella stessa transazione
+(vedi repository.py): statistiche del paziente e dashboard del medico
+leggono una riga per paziente invece dell'intero storico.
+
+rebuild_aggregates li ricalcola dalle misurazioni (dopo un ricalcolo UPDRS,
+un'importazione o per attivarli su dati esistenti): scorre measurements a
+blocchi, aggrega ogni blocco con un groupby pandas e unisce i blocchi con
+la formula di Chan per media e varianza.
+
+Usato sia dall'API (main.py) sia dal portale Streamlit (app_fixed.py).
+"""
+import numpy as np
+import pandas as pd
+
+from repository import AGGREGATE_FEATURES, COLUMNS
+
+# Criteri per paziente critico:
+# 1. UPDRS corrente > 30 (moderato-severo)
+# 2. Variazione > 10 punti (peggioramento significativo)
+CRITICAL_UPDRS = 30
+CRITICAL_CHANGE = 10
+
+# Colonne lette dal dashboard del medico
+OVERVIEW_COLUMNS = ["codice_fiscale", "n_misurazioni", "primo_updrs", "ultimo_updrs"]
+
+AGGREGATE_COLUMNS = list(COLUMNS["patient_aggregates"])
+
+
+def _std(n, m2):
+    """Deviazione standard campionaria da conteggio e M2 (None con meno di 2 valori)"""
+    return float(np.sqrt(m2 / (n - 1))) if n >= 2 else None
+
+
+def patient_summary(aggregate):
+    """Statistiche del dashboard paziente da una riga di patient_aggregates"""
+    first = aggregate["primo_updrs"]
+    last = aggregate["ultimo_updrs"]
+    variation = last - first if first is not None and last is not None else None
+    return {
+        "n_misurazioni": aggregate["n_misurazioni"],
+        "ultimo_updrs": last,
+        "primo_updrs": first,
+        "variazione": variation,
+        "trend": None if variation is None else ("peggioramento" if variation > 0 else "miglioramento"),
+        "media_jitter": round(aggregate["media_jitter"], 6) if aggregate["n_jitter"] else None,
+        "media_shimmer": round(aggregate["media_shimmer"], 6) if aggregate["n_shimmer"] else None,
+        "deviazione_std": {
+            f: _std(aggregate[f"n_{f}"], aggregate[f"m2_{f}"]) for f in AGGREGATE_FEATURES
+        },
+    }
+
+
+def doctor_overview(patients, aggregates):
+    """
+    Pazienti critici e trend medio dei pazienti con almeno due misurazioni.
+    `patients`: righe di patients (codice_fiscale, nome, cognome);
+    `aggregates`: righe di patient_aggregates (almeno OVERVIEW_COLUMNS).
+    """
+    summary = pd.DataFrame(aggregates, columns=OVERVIEW_COLUMNS).set_index("codice_fiscale")
+    summary = summary[summary["n_misurazioni"] >= 2]
+    summary["variazione"] = summary["ultimo_updrs"] - summary["primo_updrs"]
+
+    critical = summary[
+        (summary["ultimo_updrs"] > CRITICAL_UPDRS) | (summary["variazione"] > CRITICAL_CHANGE)
+    ].sort_values("ultimo_updrs", ascending=False)
+    names = {p["codice_fiscale"]: f"{p['nome']} {p['cognome']}" for p in patients}
+
+    pazienti_critici = [
+        {
+            "nome": names.get(cf, cf),
+            "codice_fiscale": cf,
+            "ultimo_updrs": float(row.ultimo_updrs),
+            "variazione": float(row.variazione),
+        }
+        for cf, row in critical.iterrows()
+    ]
+    trend_medio = float(summary["variazione"].mean()) if len(summary) else 0
+
+    return {
+        "n_pazienti": len(patients),
+        "pazienti_critici": pazienti_critici,
+        "trend_generale": round(trend_medio, 2),
+    }
+
+
+def aggregate_measurements(df):
+    """
+    Aggregati di un insieme di misurazioni (colonne di measurements, con
+    timestamp e id): DataFrame indicizzato per codice fiscale.
+    """
+    df = df.sort_values(["timestamp", "id"], kind="stable")
+    grouped = df.groupby("codice_fiscale")
+    first = df.drop_duplicates("codice_fiscale", keep="first").set_index("codice_fiscale")
+    last = df.drop_duplicates("codice_fiscale", keep="last").set_index("codice_fiscale")
+
+    result = pd.DataFrame({
+        "n_misurazioni": grouped.size(),
+        "primo_timestamp": first["timestamp"],
+        "primo_updrs": first["motor_updrs"],
+        "ultimo_timestamp": last["timestamp"],
+        "ultimo_updrs": last["motor_updrs"],
+    })
+    for f in AGGREGATE_FEATURES:
+        values = pd.to_numeric(df[f], errors="coerce")
+        by_patient = values.groupby(df["codice_fiscale"])
+        result[f"n_{f}"] = by_patient.count()
+        result[f"media_{f}"] = by_patient.mean().fillna(0.0)
+        # var() usa n - 1: M2 = varianza campionaria * (n - 1)
+        result[f"m2_{f}"] = (by_patient.var() * (result[f"n_{f}"] - 1)).fillna(0.0)
+    return result
+
+
+def combine_aggregates(a, b):
+    """
+    Unisce gli aggregati di due insiemi disgiunti di misurazioni (formula di
+    Chan per media e M2; primo/ultimo per timestamp). Vettoriale sui pazienti.
+    """
+    index = a.index.union(b.index)
+    a = a.reindex(index)
+    b = b.reindex(index)
+    result = pd.DataFrame(index=index)
+    result["n_misurazioni"] = a["n_misurazioni"].fillna(0) + b["n_misurazioni"].fillna(0)
+
+    # A parità di timestamp resta il primo di `a` e l'ultimo di `b` (b segue a)
+    b_first = a["primo_timestamp"].isna() | (b["primo_timestamp"] < a["primo_timestamp"])
+    b_last = a["ultimo_timestamp"].isna() | (b["ultimo_timestamp"] >= a["ultimo_timestamp"])
+    b_first &= b["primo_timestamp"].notna()
+    b_last &= b["ultimo_timestamp"].notna()
+    for column, use_b in (("primo_timestamp", b_first), ("primo_updrs", b_first),
+                          ("ultimo_timestamp", b_last), ("ultimo_updrs", b_last)):
+        result[column] = a[column].where(~use_b, b[column])
+
+    for f in AGGREGATE_FEATURES:
+        n_a = a[f"n_{f}"].fillna(0)
+        n_b = b[f"n_{f}"].fillna(0)
+        mean_a = a[f"media_{f}"].fillna(0.0)
+        mean_b = b[f"media_{f}"].fillna(0.0)
+        n = n_a + n_b
+        delta = mean_b - mean_a
+        safe_n = n.where(n > 0, 1)
+        result[f"n_{f}"] = n
+        result[f"media_{f}"] = mean_a + delta * n_b / safe_n
+        result[f"m2_{f}"] = (
+            a[f"m2_{f}"].fillna(0.0) + b[f"m2_{f}"].fillna(0.0) + delta ** 2 * n_a * n_b / safe_n
+        )
+    return result
+
+
+def aggregate_rows(aggregates):
+    """DataFrame di aggregati -> righe di patient_aggregates (tipi Python, None per i mancanti)"""
+    df = aggregates.reset_index().rename(columns={"index": "codice_fiscale"})[AGGREGATE_COLUMNS]
+    rows = df.astype(object).where(df.notna(), None).to_dict("records")
+    for row in rows:
+        for name in AGGREGATE_COLUMNS:
+            if name == "n_misurazioni" or name.startswith("n_"):
+                row[name] = int(row[name] or 0)
+    return rows
+
+
+def rebuild_aggregates(db, chunk_size=5000, progress=None):
+    """
+    Ricalcola patient_aggregates da tutte le misurazioni (blocchi per id).
+    Le visite inserite durante la ricostruzione possono non essere contate:
+    va eseguita a bassa attività o ripetuta. Gli aggregati di pazienti
+    senza più misurazioni sono rimossi. Ritorna il numero di pazienti.
+    """
+    totals = None
+    last_id = None
+    read = 0
+    while True:
+        rows = db.measurements_after(last_id, chunk_size, list(COLUMNS["measurements"]))
+        if not rows:
+            break
+        chunk = aggregate_measurements(pd.DataFrame(rows, columns=COLUMNS["measurements"]))
+        totals = chunk if totals is None else combine_aggregates(totals, chunk)
+        last_id = rows[-1]["id"]
+        read += len(rows)
+        if progress:
+            progress(read, len(totals))
+        if len(rows) < chunk_size:
+            break
+
+    rows = [] if totals is None else aggregate_rows(totals)
+    db.replace_aggregates(rows)
+    return len(rows)
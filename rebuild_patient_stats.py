@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Ricostruzione degli aggregati per paziente (patient_aggregates) dalle misurazioni.
+
+Da eseguire dopo la migrazione 002 (aggregati vuoti per i dati esistenti),
+dopo rescore_measurements.py o un'importazione, o per verificare gli
+aggregati mantenuti dal trigger. Le misurazioni sono lette a blocchi per id
+(paginazione a chiave) e unite incrementalmente: la memoria dipende dal
+numero di pazienti, non dallo storico.
+
+Credenziali da variabili d'ambiente SUPABASE_URL e SUPABASE_KEY (oppure
+STORAGE_BACKEND=sqlite per un database locale, vedi repository.py).
+
+Uso:
+    python rebuild_patient_stats.py [--blocco 5000]
+"""
+import argparse
+import os
+import time
+
+from supabase import create_client
+
+from patient_stats import rebuild_aggregates
+from repository import repository_from_env
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ricostruzione degli aggregati UPDRS per paziente")
+    parser.add_argument("--blocco", type=int, default=5000, help="misurazioni lette per blocco")
+    args = parser.parse_args()
+
+    db = repository_from_env(lambda: create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"]))
+
+    start = time.perf_counter()
+    n_patients = rebuild_aggregates(
+        db, args.blocco,
+        progress=lambda read, patients: print(f"{read} misurazioni lette, {patients} pazienti")
+    )
+    print(f"Aggregati ricostruiti per {n_patients} pazienti in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
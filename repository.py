@@ -0,0 +1,645 @@
+"""
+Accesso ai dati di pazienti, medici e misurazioni.
+
+Due backend con la stessa interfaccia:
+- SupabaseRepository: il database ospitato (produzione)
+- SqliteRepository: un file SQLite locale, per benchmark, test di carico,
+  uso offline o come replica locale in sola lettura
+
+Le righe sono dict con le stesse colonne delle tabelle Supabase. `columns`
+(lista di nomi, default tutte) limita le colonne lette; le letture di più
+pazienti e le scritture di più righe sono operazioni unitarie (in_ /
+executemany), non cicli di chiamate singole.
+
+Per ogni paziente patient_aggregates mantiene conteggio, primo e ultimo
+UPDRS e media/M2 di Welford di ogni feature, aggiornati da un trigger
+sull'inserimento delle misurazioni (stessa transazione: SQLite qui sotto,
+Postgres in migrations/002_patient_aggregates.sql). Le statistiche si
+leggono in O(1); patient_stats.rebuild_aggregates le ricalcola dallo storico.
+
+Storico e liste pazienti si leggono a pagine con paginazione a chiave
+(measurements_page, patients_page): il cursore è la chiave dell'ultima riga
+letta (timestamp e id, oppure codice fiscale), codificata in una stringa
+opaca, e ogni pagina costa una query indicizzata qualunque sia la sua posizione.
+
+Configurazione da variabili d'ambiente:
+- STORAGE_BACKEND: "supabase" (default) o "sqlite"
+- SQLITE_PATH: file del database locale (default "telemonitoring.sqlite3")
+"""
+import base64
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+# Righe per pagina nelle letture di più pazienti (il limite di default di PostgREST è 1000)
+PAGE_SIZE = 1000
+
+# Codici fiscali per filtro in_ nelle cancellazioni (restano nella lunghezza massima dell'URL)
+DELETE_CHUNK = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS doctors (
+    username TEXT PRIMARY KEY,
+    codice_fiscale TEXT UNIQUE,
+    password_hash TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+);
+CREATE TABLE IF NOT EXISTS patients (
+    codice_fiscale TEXT PRIMARY KEY,
+    nome TEXT,
+    cognome TEXT,
+    password_hash TEXT,
+    age INTEGER,
+    sex INTEGER,
+    doctor_username TEXT,
+    baseline_updrs REAL,
+    baseline_date TEXT,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    codice_fiscale TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    motor_updrs REAL,
+    jitter REAL,
+    shimmer REAL,
+    nhr REAL,
+    hnr REAL,
+    dfa REAL,
+    ppe REAL,
+    model_version TEXT,
+    client_id TEXT
+);
+CREATE INDEX IF NOT EXISTS patients_doctor_username_codice_fiscale ON patients (doctor_username, codice_fiscale);
+CREATE INDEX IF NOT EXISTS measurements_codice_fiscale_timestamp ON measurements (codice_fiscale, timestamp);
+CREATE INDEX IF NOT EXISTS measurements_timestamp ON measurements (timestamp);
+"""
+
+# Feature con media e varianza incrementali in patient_aggregates
+AGGREGATE_FEATURES = ("motor_updrs", "jitter", "shimmer", "nhr", "hnr", "dfa", "ppe")
+
+
+def _aggregates_schema():
+    """Tabella patient_aggregates e trigger di aggiornamento (Welford) per SQLite"""
+    columns = "".join(
+        f",\n    n_{f} INTEGER NOT NULL DEFAULT 0,\n    media_{f} REAL NOT NULL DEFAULT 0,"
+        f"\n    m2_{f} REAL NOT NULL DEFAULT 0"
+        for f in AGGREGATE_FEATURES
+    )
+    # Nelle espressioni di SET le colonne hanno il valore precedente all'UPDATE
+    updates = "".join(
+        f",\n        n_{f} = n_{f} + (NEW.{f} IS NOT NULL)"
+        f",\n        media_{f} = CASE WHEN NEW.{f} IS NULL THEN media_{f}"
+        f" ELSE media_{f} + (NEW.{f} - media_{f}) / (n_{f} + 1) END"
+        f",\n        m2_{f} = CASE WHEN NEW.{f} IS NULL THEN m2_{f}"
+        f" ELSE m2_{f} + (NEW.{f} - media_{f}) * (NEW.{f} - media_{f} - (NEW.{f} - media_{f}) / (n_{f} + 1)) END"
+        for f in AGGREGATE_FEATURES
+    )
+    return f"""
+CREATE TABLE IF NOT EXISTS patient_aggregates (
+    codice_fiscale TEXT PRIMARY KEY,
+    n_misurazioni INTEGER NOT NULL DEFAULT 0,
+    primo_timestamp TEXT,
+    primo_updrs REAL,
+    ultimo_timestamp TEXT,
+    ultimo_updrs REAL{columns}
+);
+CREATE TRIGGER IF NOT EXISTS measurements_aggregates AFTER INSERT ON measurements
+BEGIN
+    INSERT INTO patient_aggregates (codice_fiscale) VALUES (NEW.codice_fiscale)
+        ON CONFLICT (codice_fiscale) DO NOTHING;
+    UPDATE patient_aggregates SET
+        n_misurazioni = n_misurazioni + 1,
+        primo_updrs = CASE WHEN primo_timestamp IS NULL OR NEW.timestamp < primo_timestamp
+            THEN NEW.motor_updrs ELSE primo_updrs END,
+        primo_timestamp = CASE WHEN primo_timestamp IS NULL OR NEW.timestamp < primo_timestamp
+            THEN NEW.timestamp ELSE primo_timestamp END,
+        ultimo_updrs = CASE WHEN ultimo_timestamp IS NULL OR NEW.timestamp >= ultimo_timestamp
+            THEN NEW.motor_updrs ELSE ultimo_updrs END,
+        ultimo_timestamp = CASE WHEN ultimo_timestamp IS NULL OR NEW.timestamp >= ultimo_timestamp
+            THEN NEW.timestamp ELSE ultimo_timestamp END{updates}
+    WHERE codice_fiscale = NEW.codice_fiscale;
+END;
+"""
+
+# Colonne ammesse per tabella (i nomi finiscono nel testo SQL: solo questi)
+COLUMNS = {
+    "doctors": ("username", "codice_fiscale", "password_hash", "created_at"),
+    "patients": (
+        "codice_fiscale", "nome", "cognome", "password_hash", "age", "sex",
+        "doctor_username", "baseline_updrs", "baseline_date", "created_at",
+    ),
+    "measurements": (
+        "id", "codice_fiscale", "timestamp", "motor_updrs",
+        "jitter", "shimmer", "nhr", "hnr", "dfa", "ppe", "model_version", "client_id",
+    ),
+    "patient_aggregates": (
+        "codice_fiscale", "n_misurazioni", "primo_timestamp", "primo_updrs", "ultimo_timestamp", "ultimo_updrs",
+        *(f"{prefix}_{f}" for f in AGGREGATE_FEATURES for prefix in ("n", "media", "m2")),
+    ),
+}
+
+
+# Colonne del paziente restituibili ai client (senza hash della password)
+PATIENT_PUBLIC_COLUMNS = tuple(c for c in COLUMNS["patients"] if c != "password_hash")
+
+# Insiemi di colonne dello storico selezionabili per nome
+MEASUREMENT_COLUMN_SETS = {
+    "updrs": ("timestamp", "motor_updrs", "model_version"),
+    "feature": ("timestamp", "jitter", "shimmer", "nhr", "hnr", "dfa", "ppe"),
+    "completo": tuple(c for c in COLUMNS["measurements"] if c != "client_id"),
+}
+
+
+def encode_cursor(*key):
+    """Chiave dell'ultima riga di una pagina -> cursore opaco"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+# Timestamp ISO-8601 accettati in un cursore: solo cifre e separatori, nessun
+# carattere che possa alterare un filtro PostgREST (virgolette, virgole, parentesi)
+_CURSOR_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?(Z|[+-]\d{2}(:?\d{2})?)?)?")
+
+
+def _timestamp_field(value):
+    if not isinstance(value, str) or not _CURSOR_TIMESTAMP.fullmatch(value):
+        raise ValueError("cursore non valido")
+    try:
+        datetime.fromisoformat(value)
+    except ValueError as e:
+        raise ValueError("cursore non valido") from e
+    return value
+
+
+def _id_field(value):
+    # bool è una sottoclasse di int
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ValueError("cursore non valido")
+    return value
+
+
+def _text_field(value):
+    if not isinstance(value, str):
+        raise ValueError("cursore non valido")
+    return value
+
+
+# Campi della chiave di ogni paginazione, con il controllo del tipo
+MEASUREMENT_CURSOR = (_timestamp_field, _id_field)
+PATIENT_CURSOR = (_text_field,)
+
+
+def decode_cursor(cursor, fields):
+    """Cursore opaco -> chiave con i `fields` verificati (es. MEASUREMENT_CURSOR); ValueError se non valido"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError("cursore non valido") from e
+    if not isinstance(key, list) or len(key) != len(fields):
+        raise ValueError("cursore non valido")
+    return [field(value) for field, value in zip(fields, key)]
+
+
+def _with_keys(columns, keys):
+    # Le colonne della chiave servono a costruire il cursore della pagina successiva
+    if not columns:
+        return None
+    return list(columns) + [k for k in keys if k not in columns]
+
+
+def _page(rows, limit, key):
+    """Righe della pagina e cursore della successiva (si legge una riga in più per saperlo)"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*(rows[-1][k] for k in key))
+
+
+class DuplicateError(Exception):
+    """Inserimento di una chiave già presente (codice fiscale, username)"""
+
+
+class SupabaseRepository:
+    """Backend sul client Supabase (anche strumentato, vedi metrics.InstrumentedSupabase)"""
+
+    def __init__(self, client, page_size=PAGE_SIZE):
+        self.client = client
+        self.page_size = page_size
+
+    def _select(self, table, columns=None, **filters):
+        query = self.client.table(table).select(", ".join(columns) if columns else "*")
+        for name, value in filters.items():
+            query = query.eq(name, value)
+        return query
+
+    def _insert(self, table, rows):
+        try:
+            return self.client.table(table).insert(rows).execute().data
+        except Exception as e:
+            if "duplicate" in str(e).lower():
+                raise DuplicateError(str(e)) from e
+            raise
+
+    # Pazienti
+
+    def get_patient(self, codice_fiscale, columns=None, **filters):
+        """Paziente per codice fiscale (con eventuali altri filtri di uguaglianza), oppure None"""
+        data = self._select("patients", columns, codice_fiscale=codice_fiscale, **filters).execute().data
+        return data[0] if data else None
+
+    def get_patients(self, codici_fiscali, columns=None):
+        """Più pazienti con una sola query"""
+        codici_fiscali = sorted(set(codici_fiscali))
+        if not codici_fiscali:
+            return []
+        return self._select("patients", columns).in_("codice_fiscale", codici_fiscali).execute().data
+
+    def list_patients(self, doctor_username=None, columns=None):
+        filters = {"doctor_username": doctor_username} if doctor_username else {}
+        return self._select("patients", columns, **filters).execute().data
+
+    def insert_patient(self, row):
+        self._insert("patients", row)
+
+    def update_patient(self, codice_fiscale, values):
+        self.client.table("patients").update(values).eq("codice_fiscale", codice_fiscale).execute()
+
+    def set_missing_baselines(self, baselines):
+        """
+        Imposta la baseline ({codice_fiscale: updrs}) solo ai pazienti che non
+        l'hanno ancora: la condizione è nel database, così due prime visite
+        concorrenti (o una consegna differita in ritardo) non si sovrascrivono
+        """
+        # PostgREST non ha un update multiplo con valori diversi per riga
+        for codice_fiscale, updrs in baselines.items():
+            self.client.table("patients").update({"baseline_updrs": updrs}).eq(
+                "codice_fiscale", codice_fiscale
+            ).is_("baseline_updrs", "null").execute()
+
+    # Medici
+
+    def find_doctor(self, columns=None, **filters):
+        """Primo medico che soddisfa i filtri di uguaglianza, oppure None"""
+        data = self._select("doctors", columns, **filters).limit(1).execute().data
+        return data[0] if data else None
+
+    def list_doctors(self, columns=None):
+        return self._select("doctors", columns).execute().data
+
+    def insert_doctor(self, row):
+        self._insert("doctors", row)
+
+    def update_doctor(self, username, values):
+        self.client.table("doctors").update(values).eq("username", username).execute()
+
+    # Misurazioni
+
+    def insert_measurements(self, rows):
+        """Inserisce più misurazioni con un'unica richiesta"""
+        if rows:
+            self._insert("measurements", list(rows))
+
+    def insert_measurements_once(self, rows):
+        """Come insert_measurements, ma salta le righe con un client_id già presente (riconsegne)"""
+        if rows:
+            self.client.table("measurements").upsert(
+                list(rows), on_conflict="client_id", ignore_duplicates=True
+            ).execute()
+
+    def measurements_page(self, codice_fiscale, columns=None, cursor=None, limit=PAGE_SIZE,
+                          since=None, until=None, descending=False):
+        """
+        Una pagina dello storico di un paziente in ordine di (timestamp, id),
+        dal più recente con descending. since incluso, until escluso.
+        Ritorna (righe, cursore della pagina successiva o None).
+        """
+        query = self._select("measurements", _with_keys(columns, ("timestamp", "id")), codice_fiscale=codice_fiscale)
+        if since:
+            query = query.gte("timestamp", since)
+        if until:
+            query = query.lt("timestamp", until)
+        if cursor:
+            timestamp, last_id = decode_cursor(cursor, MEASUREMENT_CURSOR)
+            op = "lt" if descending else "gt"
+            query = query.or_(f'timestamp.{op}."{timestamp}",and(timestamp.eq."{timestamp}",id.{op}.{last_id})')
+        rows = query.order("timestamp", desc=descending).order("id", desc=descending).limit(limit + 1).execute().data
+        return _page(rows, limit, ("timestamp", "id"))
+
+    def patients_page(self, doctor_username=None, columns=None, cursor=None, limit=PAGE_SIZE):
+        """Una pagina di pazienti in ordine di codice fiscale: (righe, cursore successivo o None)"""
+        filters = {"doctor_username": doctor_username} if doctor_username else {}
+        query = self._select("patients", _with_keys(columns, ("codice_fiscale",)), **filters)
+        if cursor:
+            query = query.gt("codice_fiscale", decode_cursor(cursor, PATIENT_CURSOR)[0])
+        rows = query.order("codice_fiscale").limit(limit + 1).execute().data
+        return _page(rows, limit, ("codice_fiscale",))
+
+    # Aggregati per paziente (aggiornati dal trigger di migrations/002_patient_aggregates.sql)
+
+    def get_aggregate(self, codice_fiscale, columns=None):
+        """Aggregati di un paziente, oppure None se non ha misurazioni"""
+        data = self._select("patient_aggregates", columns, codice_fiscale=codice_fiscale).execute().data
+        return data[0] if data else None
+
+    def get_aggregates(self, codici_fiscali, columns=None):
+        """Aggregati di più pazienti con una sola query"""
+        codici_fiscali = sorted(set(codici_fiscali))
+        if not codici_fiscali:
+            return []
+        return self._select("patient_aggregates", columns).in_("codice_fiscale", codici_fiscali).execute().data
+
+    def replace_aggregates(self, rows):
+        """
+        Sostituisce tutti gli aggregati con `rows` (ricostruzione): upsert
+        delle righe ricalcolate, poi cancellazione di quelle dei pazienti che
+        non hanno più misurazioni. PostgREST non ha transazioni su più
+        richieste: durante la sostituzione le letture vedono uno stato misto.
+        """
+        rows = list(rows)
+        for i in range(0, len(rows), self.page_size):
+            self.client.table("patient_aggregates").upsert(
+                rows[i:i + self.page_size], on_conflict="codice_fiscale"
+            ).execute()
+        rebuilt = {row["codice_fiscale"] for row in rows}
+        stale = [cf for cf in self._aggregate_keys() if cf not in rebuilt]
+        for i in range(0, len(stale), DELETE_CHUNK):
+            self.client.table("patient_aggregates").delete().in_(
+                "codice_fiscale", stale[i:i + DELETE_CHUNK]
+            ).execute()
+
+    def _aggregate_keys(self):
+        """Codici fiscali di tutte le righe di patient_aggregates, a pagine"""
+        keys = []
+        start = 0
+        while True:
+            page = self._select("patient_aggregates", ["codice_fiscale"]).order("codice_fiscale").range(
+                start, start + self.page_size - 1
+            ).execute().data
+            keys.extend(row["codice_fiscale"] for row in page)
+            if len(page) < self.page_size:
+                return keys
+            start += self.page_size
+
+    def measurements_after(self, last_id, limit, columns=None):
+        """Blocco di misurazioni con id > last_id in ordine di id (paginazione a chiave)"""
+        query = self._select("measurements", columns)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        return query.order("id").limit(limit).execute().data
+
+    def upsert_measurements(self, rows):
+        """Riscrive più misurazioni esistenti (per id) con un'unica richiesta"""
+        if rows:
+            self.client.table("measurements").upsert(list(rows), on_conflict="id").execute()
+
+
+class SqliteRepository:
+    """
+    Backend su file SQLite locale: WAL, una connessione per thread (letture
+    concorrenti), indici su codice_fiscale, doctor_username e timestamp,
+    scritture multiple in una sola transazione.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA + _aggregates_schema())
+        self._migrate()
+
+    def _migrate(self):
+        """Colonne aggiunte dopo la creazione di un database esistente"""
+        conn = self._conn()
+        if "client_id" not in {row["name"] for row in conn.execute("PRAGMA table_info(measurements)")}:
+            conn.execute("ALTER TABLE measurements ADD COLUMN client_id TEXT")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS measurements_client_id ON measurements (client_id)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _columns(table, columns):
+        if not columns:
+            return "*"
+        unknown = set(columns) - set(COLUMNS[table])
+        if unknown:
+            raise ValueError(f"colonne sconosciute in {table}: {', '.join(sorted(unknown))}")
+        return ", ".join(columns)
+
+    def _select(self, table, columns=None, order="", limit=None, **filters):
+        self._columns(table, filters)
+        sql = f"SELECT {self._columns(table, columns)} FROM {table}"
+        if filters:
+            sql += " WHERE " + " AND ".join(f"{name} = ?" for name in filters)
+        if order:
+            sql += f" ORDER BY {order}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return [dict(row) for row in self._conn().execute(sql, tuple(filters.values()))]
+
+    def _select_in(self, table, columns, codici_fiscali, order=""):
+        # Un solo parametro JSON al posto di una lista di ?: nessun limite di variabili
+        sql = (f"SELECT {self._columns(table, columns)} FROM {table} "
+               f"WHERE codice_fiscale IN (SELECT value FROM json_each(?))")
+        if order:
+            sql += f" ORDER BY {order}"
+        return [dict(row) for row in self._conn().execute(sql, (json.dumps(sorted(set(codici_fiscali))),))]
+
+    def _insert(self, table, rows, on_conflict=None):
+        """Con `on_conflict` (colonna unica) le righe già presenti sono saltate"""
+        rows = list(rows)
+        if not rows:
+            return
+        names = list(rows[0])
+        sql = (f"INSERT INTO {table} ({self._columns(table, names)}) "
+               f"VALUES ({', '.join('?' * len(names))})")
+        if on_conflict:
+            sql += f" ON CONFLICT ({self._columns(table, [on_conflict])}) DO NOTHING"
+        try:
+            with self._transaction() as conn:
+                conn.executemany(sql, [tuple(row.get(name) for name in names) for row in rows])
+        except sqlite3.IntegrityError as e:
+            if "UNIQUE" in str(e):
+                raise DuplicateError(f"duplicate key: {e}") from e
+            raise
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN/COMMIT (ROLLBACK in caso di errore) sulla connessione in autocommit del thread"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _update(self, table, key, updates):
+        """updates: lista di (valore chiave, valori) in un'unica transazione"""
+        with self._transaction() as conn:
+            for key_value, values in updates:
+                self._columns(table, values)
+                assignments = ", ".join(f"{name} = ?" for name in values)
+                conn.execute(
+                    f"UPDATE {table} SET {assignments} WHERE {key} = ?",
+                    (*values.values(), key_value)
+                )
+
+    # Pazienti
+
+    def get_patient(self, codice_fiscale, columns=None, **filters):
+        rows = self._select("patients", columns, limit=1, codice_fiscale=codice_fiscale, **filters)
+        return rows[0] if rows else None
+
+    def get_patients(self, codici_fiscali, columns=None):
+        return self._select_in("patients", columns, codici_fiscali)
+
+    def list_patients(self, doctor_username=None, columns=None):
+        filters = {"doctor_username": doctor_username} if doctor_username else {}
+        return self._select("patients", columns, **filters)
+
+    def insert_patient(self, row):
+        self._insert("patients", [row])
+
+    def update_patient(self, codice_fiscale, values):
+        self._update("patients", "codice_fiscale", [(codice_fiscale, values)])
+
+    def set_missing_baselines(self, baselines):
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE patients SET baseline_updrs = ? WHERE codice_fiscale = ? AND baseline_updrs IS NULL",
+                [(updrs, codice_fiscale) for codice_fiscale, updrs in baselines.items()]
+            )
+
+    # Medici
+
+    def find_doctor(self, columns=None, **filters):
+        rows = self._select("doctors", columns, limit=1, **filters)
+        return rows[0] if rows else None
+
+    def list_doctors(self, columns=None):
+        return self._select("doctors", columns)
+
+    def insert_doctor(self, row):
+        self._insert("doctors", [row])
+
+    def update_doctor(self, username, values):
+        self._update("doctors", "username", [(username, values)])
+
+    # Misurazioni
+
+    def insert_measurements(self, rows):
+        self._insert("measurements", rows)
+
+    def insert_measurements_once(self, rows):
+        # Il trigger degli aggregati scatta solo per le righe inserite davvero
+        self._insert("measurements", rows, on_conflict="client_id")
+
+    def measurements_page(self, codice_fiscale, columns=None, cursor=None, limit=PAGE_SIZE,
+                          since=None, until=None, descending=False):
+        where = ["codice_fiscale = ?"]
+        params = [codice_fiscale]
+        if since:
+            where.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            where.append("timestamp < ?")
+            params.append(until)
+        if cursor:
+            where.append(f"(timestamp, id) {'<' if descending else '>'} (?, ?)")
+            params.extend(decode_cursor(cursor, MEASUREMENT_CURSOR))
+        direction = "DESC" if descending else "ASC"
+        rows = [dict(row) for row in self._conn().execute(
+            f"SELECT {self._columns('measurements', _with_keys(columns, ('timestamp', 'id')))} "
+            f"FROM measurements WHERE {' AND '.join(where)} "
+            f"ORDER BY timestamp {direction}, id {direction} LIMIT ?",
+            (*params, int(limit) + 1)
+        )]
+        return _page(rows, limit, ("timestamp", "id"))
+
+    def patients_page(self, doctor_username=None, columns=None, cursor=None, limit=PAGE_SIZE):
+        where = []
+        params = []
+        if doctor_username:
+            where.append("doctor_username = ?")
+            params.append(doctor_username)
+        if cursor:
+            where.append("codice_fiscale > ?")
+            params.append(decode_cursor(cursor, PATIENT_CURSOR)[0])
+        rows = [dict(row) for row in self._conn().execute(
+            f"SELECT {self._columns('patients', _with_keys(columns, ('codice_fiscale',)))} FROM patients"
+            + (f" WHERE {' AND '.join(where)}" if where else "")
+            + " ORDER BY codice_fiscale LIMIT ?",
+            (*params, int(limit) + 1)
+        )]
+        return _page(rows, limit, ("codice_fiscale",))
+
+    # Aggregati per paziente (aggiornati dal trigger measurements_aggregates)
+
+    def get_aggregate(self, codice_fiscale, columns=None):
+        rows = self._select("patient_aggregates", columns, codice_fiscale=codice_fiscale)
+        return rows[0] if rows else None
+
+    def get_aggregates(self, codici_fiscali, columns=None):
+        return self._select_in("patient_aggregates", columns, codici_fiscali)
+
+    def replace_aggregates(self, rows):
+        rows = list(rows)
+        # Svuotamento e reinserimento in un'unica transazione: nessuna riga di
+        # pazienti senza misurazioni, e i lettori vedono lo stato vecchio o il nuovo
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM patient_aggregates")
+            if rows:
+                names = list(rows[0])
+                conn.executemany(
+                    f"INSERT INTO patient_aggregates ({self._columns('patient_aggregates', names)}) "
+                    f"VALUES ({', '.join('?' * len(names))})",
+                    [tuple(row.get(name) for name in names) for row in rows]
+                )
+
+    def measurements_after(self, last_id, limit, columns=None):
+        return [dict(row) for row in self._conn().execute(
+            f"SELECT {self._columns('measurements', columns)} FROM measurements "
+            f"WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id if last_id is not None else -1, int(limit))
+        )]
+
+    def upsert_measurements(self, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        names = list(rows[0])
+        columns = self._columns("measurements", names)
+        assignments = ", ".join(f"{name} = excluded.{name}" for name in names if name != "id")
+        with self._transaction() as conn:
+            conn.executemany(
+                f"INSERT INTO measurements ({columns}) VALUES ({', '.join('?' * len(names))}) "
+                f"ON CONFLICT(id) DO UPDATE SET {assignments}",
+                [tuple(row.get(name) for name in names) for row in rows]
+            )
+
+
+def repository_from_env(supabase_client=None):
+    """
+    Backend scelto da STORAGE_BACKEND. `supabase_client` è una funzione che
+    crea il client: chiamata solo per il backend Supabase, così il backend
+    SQLite funziona anche senza credenziali.
+    """
+    backend = os.environ.get("STORAGE_BACKEND", "supabase").lower()
+    if backend == "sqlite":
+        return SqliteRepository(os.environ.get("SQLITE_PATH", "telemonitoring.sqlite3"))
+    if backend != "supabase":
+        raise ValueError(f"STORAGE_BACKEND sconosciuto: {backend}")
+    return SupabaseRepository(supabase_client())
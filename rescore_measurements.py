@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Ricalcolo in blocco dell'UPDRS delle misurazioni storiche con un modello versionato.
+
+Scorre la tabella measurements a blocchi ordinati per id (paginazione a
+chiave: id > ultimo id visto, nessun OFFSET), calcola i punteggi del blocco
+con un'unica chiamata vettoriale e riscrive solo le righe cambiate con un
+upsert per blocco. Dopo ogni blocco salva un checkpoint: se il job si
+interrompe riparte dall'ultimo id completato (solo se il modello è lo stesso).
+Alla fine ricostruisce gli aggregati per paziente (il trigger che li mantiene
+scatta solo sugli inserimenti).
+
+Credenziali da variabili d'ambiente SUPABASE_URL e SUPABASE_KEY (oppure
+STORAGE_BACKEND=sqlite per un database locale, vedi repository.py).
+
+Uso:
+    python rescore_measurements.py [--modello tsanas2010-v1] [--blocco 1000]
+                                   [--checkpoint rescore_checkpoint.json] [--ricomincia] [--dry-run]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from supabase import create_client
+
+from patient_stats import rebuild_aggregates
+from repository import COLUMNS as TABLE_COLUMNS, repository_from_env
+from updrs_model import registry_from_env
+
+COLUMNS = list(TABLE_COLUMNS["measurements"])
+
+
+def load_checkpoint(path, version):
+    """Ultimo id completato e contatori, se il checkpoint è dello stesso modello"""
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if checkpoint.get("modello") != version:
+        print(f"Checkpoint di un altro modello ({checkpoint.get('modello')}): si riparte dall'inizio")
+        return None
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    # Scrittura atomica: un'interruzione non lascia un checkpoint troncato
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp, path)
+
+
+def rescore_chunk(rows, model):
+    """Righe da riscrivere (punteggio o versione cambiati) con il nuovo UPDRS"""
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    scores = model.score_measurements(df)
+    old = pd.to_numeric(df["motor_updrs"], errors="coerce")
+    changed = (
+        ~np.isclose(scores, old, atol=0.005, equal_nan=True)
+        | (df["model_version"] != model.version)
+    ) & scores.notna()
+
+    updates = []
+    for row, score in zip(df[changed].to_dict("records"), scores[changed]):
+        # L'upsert riscrive la riga intera: si passano tutte le colonne lette
+        row = {k: (None if isinstance(v, float) and np.isnan(v) else v) for k, v in row.items()}
+        row["motor_updrs"] = float(score)
+        row["model_version"] = model.version
+        updates.append(row)
+    return updates, int(scores.isna().sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ricalcolo UPDRS delle misurazioni con un modello versionato")
+    parser.add_argument("--modello", help="versione del modello (default: quella attiva)")
+    parser.add_argument("--blocco", type=int, default=1000, help="righe per blocco")
+    parser.add_argument("--checkpoint", default="rescore_checkpoint.json")
+    parser.add_argument("--ricomincia", action="store_true", help="ignora il checkpoint esistente")
+    parser.add_argument("--dry-run", action="store_true", help="calcola senza scrivere")
+    args = parser.parse_args()
+
+    registry = registry_from_env()
+    try:
+        model = registry.get(args.modello)
+    except KeyError:
+        sys.exit(f"Modello sconosciuto: {args.modello}. Disponibili: "
+                 + ", ".join(m["versione"] for m in registry.versions()["modelli"]))
+
+    db = repository_from_env(lambda: create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"]))
+
+    checkpoint = None if args.ricomincia else load_checkpoint(args.checkpoint, model.version)
+    if checkpoint is None:
+        checkpoint = {"modello": model.version, "ultimo_id": None, "lette": 0, "aggiornate": 0, "non_calcolabili": 0}
+    elif checkpoint["ultimo_id"] is not None:
+        print(f"Ripresa dal checkpoint: id > {checkpoint['ultimo_id']}")
+
+    start = time.perf_counter()
+    while True:
+        rows = db.measurements_after(checkpoint["ultimo_id"], args.blocco, COLUMNS)
+        if not rows:
+            break
+
+        updates, missing = rescore_chunk(rows, model)
+        if updates and not args.dry_run:
+            db.upsert_measurements(updates)
+
+        checkpoint["ultimo_id"] = rows[-1]["id"]
+        checkpoint["lette"] += len(rows)
+        checkpoint["aggiornate"] += len(updates)
+        checkpoint["non_calcolabili"] += missing
+        if not args.dry_run:
+            save_checkpoint(args.checkpoint, checkpoint)
+
+        elapsed = time.perf_counter() - start
+        print(f"id <= {checkpoint['ultimo_id']}: {checkpoint['lette']} lette, "
+              f"{checkpoint['aggiornate']} aggiornate ({len(rows) / max(elapsed, 1e-9):.0f} righe/s)")
+        start = time.perf_counter()
+
+        if len(rows) < args.blocco:
+            break
+
+    print(f"Completato con {model.version}: {checkpoint['lette']} lette, "
+          f"{checkpoint['aggiornate']} aggiornate, {checkpoint['non_calcolabili']} con feature mancanti"
+          + (" (dry run, nessuna scrittura)" if args.dry_run else ""))
+
+    if checkpoint["aggiornate"] and not args.dry_run:
+        print(f"Aggregati per paziente ricostruiti: {rebuild_aggregates(db)} pazienti")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Condizionamento del segnale prima dell'analisi Praat.
+
+Le registrazioni arrivano spesso stereo a 48 kHz con lunghi silenzi
+iniziali e finali: ogni passaggio Praat le scandirebbe per intero.
+Il condizionamento, solo NumPy, riduce il segnale alla fonazione utile:
+1. mix a mono (media dei canali)
+2. rimozione di testa e coda non sonore con un rilevatore di energia a frame
+3. limite di durata (si tiene il tratto centrale, il più stabile in una vocale sostenuta)
+4. ricampionamento alla frequenza di analisi (solo verso il basso, via FFT)
+
+Configurazione da variabili d'ambiente (0 disattiva il passo):
+- ANALYSIS_RATE: frequenza di analisi in Hz (default 22050)
+- ANALYSIS_MAX_SECONDS: durata massima analizzata (default 30)
+- TRIM_THRESHOLD_DB: soglia sotto il frame più energetico, in dB (default 35)
+"""
+import os
+
+import numpy as np
+
+ANALYSIS_RATE = float(os.environ.get("ANALYSIS_RATE", "22050"))
+ANALYSIS_MAX_SECONDS = float(os.environ.get("ANALYSIS_MAX_SECONDS", "30"))
+TRIM_THRESHOLD_DB = float(os.environ.get("TRIM_THRESHOLD_DB", "35"))
+
+# Frame del rilevatore di energia e margine lasciato attorno alla fonazione
+TRIM_FRAME_SECONDS = 0.02
+TRIM_MARGIN_SECONDS = 0.05
+
+
+def conditioning_tag():
+    """Parametri del condizionamento in forma compatta (entra nella versione dell'estrattore)"""
+    return f"sr{ANALYSIS_RATE:g}-max{ANALYSIS_MAX_SECONDS:g}-trim{TRIM_THRESHOLD_DB:g}"
+
+
+def mix_to_mono(samples):
+    """(canali, campioni) o (campioni,) -> (campioni,)"""
+    samples = np.asarray(samples, dtype=float)
+    if samples.ndim == 1:
+        return samples
+    return samples.mean(axis=0)
+
+
+def trim_frame_length(sampling_frequency):
+    """Lunghezza in campioni di un frame del rilevatore di energia"""
+    return max(int(TRIM_FRAME_SECONDS * sampling_frequency), 1)
+
+
+def frame_levels_db(signal, frame):
+    """Livello (dB) di ogni frame completo di `frame` campioni"""
+    n_frames = signal.size // frame
+    energy = np.mean(signal[:n_frames * frame].reshape(n_frames, frame) ** 2, axis=1)
+    return 10.0 * np.log10(energy + 1e-20)
+
+
+def voiced_bounds(signal, sampling_frequency, threshold_db=TRIM_THRESHOLD_DB):
+    """
+    Indici (inizio, fine) del tratto con energia entro `threshold_db` dal
+    frame più forte, allargato di TRIM_MARGIN_SECONDS per lato.
+    """
+    frame = trim_frame_length(sampling_frequency)
+    if signal.size < frame:
+        return 0, signal.size
+
+    level_db = frame_levels_db(signal, frame)
+    active = np.flatnonzero(level_db > level_db.max() - threshold_db)
+
+    margin = int(TRIM_MARGIN_SECONDS * sampling_frequency)
+    start = max(active[0] * frame - margin, 0)
+    end = min((active[-1] + 1) * frame + margin, signal.size)
+    return start, end
+
+
+def cap_duration(signal, sampling_frequency, max_seconds=ANALYSIS_MAX_SECONDS):
+    """Tratto centrale di al più `max_seconds` secondi"""
+    max_samples = int(max_seconds * sampling_frequency)
+    if max_samples <= 0 or signal.size <= max_samples:
+        return signal
+    start = (signal.size - max_samples) // 2
+    return signal[start:start + max_samples]
+
+
+def resample(signal, sampling_frequency, target_rate):
+    """Ricampionamento band-limited via FFT (troncamento dello spettro)"""
+    n_out = int(round(signal.size * target_rate / sampling_frequency))
+    if n_out < 2:
+        return signal
+    spectrum = np.fft.rfft(signal)
+    return np.fft.irfft(spectrum[:n_out // 2 + 1], n_out) * (n_out / signal.size)
+
+
+def condition(samples, sampling_frequency, target_rate=ANALYSIS_RATE,
+              max_seconds=ANALYSIS_MAX_SECONDS, threshold_db=TRIM_THRESHOLD_DB):
+    """
+    Applica mono-mix, trimming, limite di durata e ricampionamento.
+    Ritorna (segnale mono, frequenza di campionamento).
+    """
+    signal = mix_to_mono(samples)
+
+    if threshold_db > 0:
+        start, end = voiced_bounds(signal, sampling_frequency, threshold_db)
+        signal = signal[start:end]
+
+    if max_seconds > 0:
+        signal = cap_duration(signal, sampling_frequency, max_seconds)
+
+    if 0 < target_rate < sampling_frequency:
+        signal = resample(signal, sampling_frequency, target_rate)
+        sampling_frequency = float(target_rate)
+
+    return np.ascontiguousarray(signal), float(sampling_frequency)
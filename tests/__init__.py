@@ -0,0 +1,6 @@
+"""
+Test dei moduli di analisi, modello e persistenza.
+
+Da eseguire dalla radice del repository:
+    python -m pytest tests
+"""
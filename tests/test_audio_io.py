@@ -0,0 +1,107 @@
+"""Decodifica WAV in memoria (audio_io)"""
+import struct
+
+import numpy as np
+import parselmouth
+import pytest
+
+from audio_io import (
+    WAVE_FORMAT_EXTENSIBLE, WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_PCM,
+    decode_wav, encode_wav, open_wav, read_frames, wav_layout,
+)
+
+
+def make_wav(payload, fmt_tag, channels, rate, width, extensible=False, data_size=None, extra_chunk=b""):
+    """Byte di un WAV con il chunk 'data' dato (dimensione dichiarata modificabile)"""
+    block_align = channels * width
+    fmt = struct.pack("<HHIIHH", WAVE_FORMAT_EXTENSIBLE if extensible else fmt_tag,
+                      channels, rate, rate * block_align, block_align, width * 8)
+    if extensible:
+        # cbSize, bit validi, maschera canali, GUID del sotto-formato (primi 2 byte = formato)
+        fmt += struct.pack("<HHI", 22, width * 8, 0) + struct.pack("<H", fmt_tag) + bytes(14)
+    body = b"WAVE" + b"fmt " + struct.pack("<I", len(fmt)) + fmt + extra_chunk
+    body += b"data" + struct.pack("<I", len(payload) if data_size is None else data_size) + payload
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+def test_pcm16_round_trip_mono_and_stereo():
+    rng = np.random.default_rng(0)
+    for samples in (rng.uniform(-0.9, 0.9, 1000), rng.uniform(-0.9, 0.9, (2, 1000))):
+        decoded, rate = decode_wav(encode_wav(samples, 16000))
+        assert rate == 16000.0
+        assert decoded.shape == np.atleast_2d(samples).shape
+        np.testing.assert_allclose(decoded, np.atleast_2d(samples), atol=1 / 32768)
+
+
+def test_pcm_widths_and_float_formats():
+    values = np.array([-1.0, -0.5, 0.0, 0.25, 0.5])
+
+    pcm8 = bytes(int(v * 128 + 128) for v in values)
+    pcm24 = b"".join(int(v * 8388608).to_bytes(3, "little", signed=True) for v in values)
+    pcm32 = np.round(values * 2147483648).astype("<i4").tobytes()
+    float32 = values.astype("<f4").tobytes()
+    float64 = values.astype("<f8").tobytes()
+
+    for payload, fmt_tag, width in ((pcm8, WAVE_FORMAT_PCM, 1), (pcm24, WAVE_FORMAT_PCM, 3),
+                                    (pcm32, WAVE_FORMAT_PCM, 4), (float32, WAVE_FORMAT_IEEE_FLOAT, 4),
+                                    (float64, WAVE_FORMAT_IEEE_FLOAT, 8)):
+        decoded, _ = decode_wav(make_wav(payload, fmt_tag, 1, 8000, width))
+        np.testing.assert_allclose(decoded[0], values, atol=1e-7)
+
+
+def test_extensible_header_uses_sub_format():
+    payload = np.array([0.5, -0.5], dtype="<f4").tobytes()
+    data = make_wav(payload, WAVE_FORMAT_IEEE_FLOAT, 1, 8000, 4, extensible=True)
+    assert wav_layout(data).fmt_tag == WAVE_FORMAT_IEEE_FLOAT
+    np.testing.assert_allclose(decode_wav(data)[0][0], [0.5, -0.5])
+
+
+def test_chunks_before_data_are_skipped():
+    # Chunk di lunghezza dispari: va saltato anche il byte di padding
+    data = make_wav(np.array([1000, -1000], dtype="<i2").tobytes(), WAVE_FORMAT_PCM, 1, 8000, 2,
+                    extra_chunk=b"LIST" + struct.pack("<I", 3) + b"abc\0")
+    np.testing.assert_allclose(decode_wav(data)[0][0], [1000 / 32768, -1000 / 32768])
+
+
+def test_streaming_data_size_is_truncated_to_file():
+    payload = np.arange(10, dtype="<i2").tobytes()
+    data = make_wav(payload, WAVE_FORMAT_PCM, 1, 8000, 2, data_size=0xFFFFFFFF)
+    assert wav_layout(data).n_frames == 10
+
+
+@pytest.mark.parametrize("data", [
+    b"not a wav file at all",
+    make_wav(b"", WAVE_FORMAT_PCM, 1, 8000, 2),
+    make_wav(b"\0" * 4, 0x0055, 1, 8000, 2),
+    make_wav(b"\0" * 10, WAVE_FORMAT_PCM, 1, 8000, 5),
+])
+def test_invalid_files_raise_value_error(data):
+    with pytest.raises(ValueError):
+        decode_wav(data)
+
+
+def test_read_frames_matches_full_decode_from_bytes_and_path(tmp_path):
+    samples = np.random.default_rng(1).uniform(-0.5, 0.5, (2, 5000))
+    data = encode_wav(samples, 22050)
+    full, _ = decode_wav(data)
+
+    path = tmp_path / "stereo.wav"
+    path.write_bytes(data)
+    for source in (data, str(path)):
+        layout, buffer = open_wav(source)
+        assert layout.n_frames == 5000
+        np.testing.assert_array_equal(read_frames(buffer, layout, 1200, 3400), full[:, 1200:3400])
+        # Oltre la fine: si ferma all'ultimo frame
+        assert read_frames(buffer, layout, 4990, 6000).shape == (2, 10)
+
+
+def test_scaling_matches_praat(tmp_path):
+    samples = np.random.default_rng(2).uniform(-0.8, 0.8, 4000)
+    data = encode_wav(samples, 16000)
+    path = tmp_path / "voce.wav"
+    path.write_bytes(data)
+
+    decoded, rate = decode_wav(data)
+    sound = parselmouth.Sound(str(path))
+    assert rate == sound.sampling_frequency
+    np.testing.assert_allclose(decoded, sound.values, atol=1e-12)
@@ -0,0 +1,140 @@
+"""Transizioni di stato dei job di visita (job_store)"""
+import sqlite3
+
+import pytest
+
+import job_store
+from job_store import DONE, FAILED, QUEUED, RUNNING, JobStore
+
+
+class Clock:
+    """Sostituto di time.time controllato dal test: avanza di un secondo a ogni lettura"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        self.now += 1.0
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(job_store.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+    return JobStore(tmp_path / "jobs.sqlite3")
+
+
+def test_claim_takes_oldest_job_and_keeps_queue_positions(store):
+    first = store.create("A", b"a1", {"salva": True})
+    second = store.create("B", b"b1")
+    assert store.queue_depth() == 2
+    assert store.get(second)["posizione"] == 2
+
+    assert store.claim_next() == (first, "A", b"a1", {"salva": True})
+    job = store.get(first)
+    assert job["stato"] == RUNNING
+    assert "posizione" not in job
+    assert job["attesa_s"] > 0
+    assert store.get(second)["posizione"] == 1
+    assert store.queue_depth() == 1
+
+    assert store.claim_next()[0] == second
+    assert store.claim_next() is None
+    assert store.queue_depth() == 0
+
+
+def test_complete_and_fail_drop_audio_and_keep_outcome(store):
+    done = store.create("A", b"a1")
+    failed = store.create("B", b"b1")
+    store.claim_next()
+    store.claim_next()
+    store.complete(done, {"motor_updrs": 21.5})
+    store.fail(failed, ValueError("audio illeggibile"))
+
+    job = store.get(done)
+    assert job["stato"] == DONE
+    assert job["risultato"] == {"motor_updrs": 21.5}
+    assert job["esecuzione_s"] > 0
+    job = store.get(failed)
+    assert job["stato"] == FAILED
+    assert job["errore"] == "audio illeggibile"
+
+    # Senza audio un job concluso non può tornare in coda
+    assert not store.requeue(done)
+    assert store.requeue_stale(0) == 0
+    assert store.stats()["stati"] == {QUEUED: 0, RUNNING: 0, DONE: 1, FAILED: 1}
+    assert store.stats()["ultimi_job"] == 2
+
+
+def test_requeue_only_running_jobs(store):
+    job_id = store.create("A", b"a1")
+    assert not store.requeue(job_id)
+    store.claim_next()
+    assert store.requeue(job_id)
+    job = store.get(job_id)
+    assert job["stato"] == QUEUED
+    assert job["avviato"] is None
+    assert store.claim_next()[0] == job_id
+    assert store.get("inesistente") is None
+
+
+def test_requeue_stale_follows_heartbeats_across_processes(tmp_path, store, clock):
+    # Due processi del server sullo stesso file
+    other = JobStore(tmp_path / "jobs.sqlite3")
+    crashed = store.create("A", b"a1")
+    long_running = store.create("B", b"b1")
+    store.claim_next()
+    other.claim_next()
+    clock.now += 600
+    recent = store.create("C", b"c1")
+    store.claim_next()
+
+    # Il processo che esegue B rinnova l'heartbeat; solo i propri job
+    assert other.heartbeat([long_running, crashed]) == 1
+    assert store.requeue_stale(300) == 1
+    assert store.get(crashed)["stato"] == QUEUED
+    assert store.get(long_running)["stato"] == RUNNING
+    assert store.get(recent)["stato"] == RUNNING
+    assert store.queue_depth() == 1
+
+
+def test_purge_removes_only_old_finished_jobs(store, clock):
+    old = store.create("A", b"a1")
+    store.claim_next()
+    store.complete(old, {"motor_updrs": 20.0})
+    clock.now += 3600
+    recent = store.create("B", b"b1")
+    store.claim_next()
+    store.fail(recent, "errore")
+    queued = store.create("C", b"c1")
+    clock.now += 600
+
+    assert store.purge(1800) == 1
+    assert store.get(old) is None
+    assert store.get(recent)["stato"] == FAILED
+    assert store.get(queued)["stato"] == QUEUED
+
+
+def test_existing_store_gains_heartbeat_columns(tmp_path, clock):
+    path = tmp_path / "jobs.sqlite3"
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE visit_jobs (id TEXT PRIMARY KEY, codice_fiscale TEXT NOT NULL, status TEXT NOT NULL, "
+        "options TEXT NOT NULL, audio BLOB, result TEXT, error TEXT, created_at REAL NOT NULL, "
+        "started_at REAL, finished_at REAL)"
+    )
+    conn.execute("INSERT INTO visit_jobs VALUES ('vecchio', 'A', ?, '{}', x'00', NULL, NULL, 1.0, 2.0, NULL)",
+                 (RUNNING,))
+    conn.commit()
+    conn.close()
+
+    store = JobStore(path)
+    # Senza heartbeat conta l'avvio
+    assert store.requeue_stale(300) == 1
+    assert store.claim_next()[0] == "vecchio"
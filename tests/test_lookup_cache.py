@@ -0,0 +1,210 @@
+"""Cache TTL delle righe di pazienti e medici (lookup_cache)"""
+import asyncio
+
+import pytest
+
+import lookup_cache
+from lookup_cache import _MISSING, AsyncCachedRepository, CachedRepository, TtlCache
+
+
+class Clock:
+    """Sostituto di time.monotonic controllato dal test"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(lookup_cache.time, "monotonic", clock)
+    return clock
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TtlCache(ttl_seconds=30)
+    cache.put("k", 1)
+    clock.now += 29.9
+    assert cache.get("k") == 1
+    clock.now += 0.2
+    assert cache.get("k") is _MISSING
+    assert cache.stats()["entries"] == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_lru_eviction_and_invalidation(clock):
+    cache = TtlCache(ttl_seconds=30, max_entries=2)
+    cache.put(("patients", "A"), 1)
+    cache.put(("doctors", "username", "u"), 2)
+    cache.get(("patients", "A"))
+    cache.put(("doctors", "codice_fiscale", "X"), 3)
+    # Esce la voce usata meno di recente
+    assert cache.get(("doctors", "username", "u")) is _MISSING
+    assert cache.get(("patients", "A")) == 1
+
+    cache.invalidate_prefix(("doctors",))
+    assert cache.get(("doctors", "codice_fiscale", "X")) is _MISSING
+    cache.invalidate(("patients", "A"))
+    assert cache.get(("patients", "A")) is _MISSING
+
+
+def test_put_after_invalidation_is_dropped(clock):
+    cache = TtlCache(ttl_seconds=30, max_entries=2)
+    generation = cache.generation()
+    cache.invalidate(("patients", "A"))
+    cache.put(("patients", "A"), "vecchia", generation=generation)
+    assert cache.get(("patients", "A")) is _MISSING
+    # Altre chiavi e letture iniziate dopo l'invalidazione entrano in cache
+    cache.put(("patients", "B"), 1, generation=generation)
+    cache.put(("patients", "A"), "nuova", generation=cache.generation())
+    assert cache.get(("patients", "A")) == "nuova"
+    assert cache.get(("patients", "B")) == 1
+
+    generation = cache.generation()
+    cache.invalidate_prefix(("doctors",))
+    cache.put(("doctors", "username", "u"), 2, generation=generation)
+    assert cache.get(("doctors", "username", "u")) is _MISSING
+
+    # Oltre max_entries le generazioni dimenticate scartano i put più vecchi
+    generation = cache.generation()
+    for cf in "CDE":
+        cache.invalidate(("patients", cf))
+    cache.put(("patients", "C"), 3, generation=generation)
+    assert cache.get(("patients", "C")) is _MISSING
+
+
+def test_zero_ttl_disables_the_cache():
+    cache = TtlCache(ttl_seconds=0)
+    assert not cache.enabled
+    cache.put("k", 1)
+    assert cache.get("k") is _MISSING
+
+
+class Repository:
+    """Repository in memoria che conta le letture"""
+
+    def __init__(self):
+        self.patients = {"A": {"codice_fiscale": "A", "nome": "Ada", "password_hash": "h1", "doctor_username": "doc"}}
+        self.doctors = [{"username": "doc", "codice_fiscale": "DOC1", "password_hash": "h2"}]
+        self.reads = 0
+
+    def get_patient(self, codice_fiscale, columns=None, **filters):
+        self.reads += 1
+        row = self.patients.get(codice_fiscale)
+        if row is None or any(row.get(k) != v for k, v in filters.items()):
+            return None
+        return {k: row[k] for k in columns} if columns else dict(row)
+
+    def find_doctor(self, columns=None, **filters):
+        self.reads += 1
+        for row in self.doctors:
+            if all(row.get(k) == v for k, v in filters.items()):
+                return {k: row[k] for k in columns} if columns else dict(row)
+        return None
+
+    def insert_patient(self, row):
+        self.patients[row["codice_fiscale"]] = dict(row)
+
+    def update_patient(self, codice_fiscale, values):
+        self.patients[codice_fiscale].update(values)
+
+    def update_doctor(self, username, values):
+        next(d for d in self.doctors if d["username"] == username).update(values)
+
+
+class AsyncRepository:
+    """Stesso repository con metodi coroutine"""
+
+    def __init__(self, repository):
+        self.repository = repository
+
+    def __getattr__(self, name):
+        method = getattr(self.repository, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+def test_read_through_projection_and_filters(clock):
+    repository = Repository()
+    db = CachedRepository(repository, TtlCache())
+    assert db.get_patient("A", ["nome"]) == {"nome": "Ada"}
+    assert db.get_patient("A", doctor_username="doc")["codice_fiscale"] == "A"
+    assert db.get_patient("A", doctor_username="altro") is None
+    assert repository.reads == 1
+
+    # I "non trovato" non vanno in cache: un paziente appena registrato si vede subito
+    assert db.get_patient("B") is None
+    db.insert_patient({"codice_fiscale": "B", "nome": "Bruno"})
+    assert db.get_patient("B", ["nome"]) == {"nome": "Bruno"}
+
+    # Medico in cache per username e per codice fiscale
+    assert db.find_doctor(["username"], codice_fiscale="DOC1") == {"username": "doc"}
+    reads = repository.reads
+    assert db.find_doctor(codice_fiscale="DOC1")["username"] == "doc"
+    assert repository.reads == reads
+
+
+def test_writes_invalidate_and_credentials_are_always_read(clock):
+    repository = Repository()
+    db = CachedRepository(repository, TtlCache())
+    db.get_patient("A")
+    db.update_patient("A", {"nome": "Adele"})
+    assert db.get_patient("A", ["nome"]) == {"nome": "Adele"}
+
+    # Password cambiata da un altro processo: il login la vede subito
+    assert db.get_patient("A", password_hash="h1") is not None
+    repository.patients["A"]["password_hash"] = "nuova"
+    assert db.get_patient("A", password_hash="h1") is None
+    assert db.get_patient("A", password_hash="nuova") is not None
+
+    db.find_doctor(username="doc")
+    repository.doctors[0]["password_hash"] = "nuova"
+    assert db.find_doctor(username="doc", password_hash="h2") is None
+    db.update_doctor("doc", {"codice_fiscale": "DOC2"})
+    assert db.find_doctor(username="doc")["codice_fiscale"] == "DOC2"
+
+    # Scritture di altri processi sulle righe in cache: visibili dopo il TTL
+    repository.patients["A"]["nome"] = "Alda"
+    assert db.get_patient("A", ["nome"]) == {"nome": "Adele"}
+    clock.now += 31
+    assert db.get_patient("A", ["nome"]) == {"nome": "Alda"}
+
+
+def test_read_racing_an_update_does_not_cache_the_old_row(clock):
+    class Racing(Repository):
+        """Un'altra richiesta aggiorna il paziente mentre la lettura è in corso"""
+
+        def get_patient(self, codice_fiscale, columns=None, **filters):
+            row = super().get_patient(codice_fiscale, columns, **filters)
+            if self.reads == 1:
+                db.update_patient(codice_fiscale, {"nome": "Adele"})
+            return row
+
+    repository = Racing()
+    db = CachedRepository(repository, TtlCache())
+    assert db.get_patient("A", ["nome"]) == {"nome": "Ada"}
+    assert db.get_patient("A", ["nome"]) == {"nome": "Adele"}
+    assert repository.reads == 2
+
+
+def test_async_cached_repository(clock):
+    repository = Repository()
+    db = AsyncCachedRepository(AsyncRepository(repository), TtlCache())
+
+    async def scenario():
+        assert await db.get_patient("A", ["nome"]) == {"nome": "Ada"}
+        assert await db.get_patient("A", ["nome"]) == {"nome": "Ada"}
+        assert repository.reads == 1
+        await db.update_patient("A", {"nome": "Adele"})
+        assert await db.get_patient("A", ["nome"]) == {"nome": "Adele"}
+        assert await db.find_doctor(username="doc", password_hash="h2") is not None
+        assert await db.find_doctor(username="doc", password_hash="h2") is not None
+        return repository.reads
+
+    # Le verifiche delle credenziali leggono sempre dal repository
+    assert asyncio.run(scenario()) == 4
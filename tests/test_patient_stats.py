@@ -0,0 +1,116 @@
+"""Aggregati per paziente: trigger di Welford contro ricostruzione con Chan (patient_stats)"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from patient_stats import (
+    aggregate_measurements, combine_aggregates, patient_summary, rebuild_aggregates,
+)
+from repository import AGGREGATE_FEATURES, COLUMNS, SqliteRepository
+
+
+@pytest.fixture
+def db(tmp_path):
+    return SqliteRepository(tmp_path / "telemonitoring.sqlite3")
+
+
+def random_measurements(n, seed=0):
+    """Misurazioni di tre pazienti con timestamp non in ordine di inserimento e feature mancanti"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n):
+        row = {
+            "codice_fiscale": ["A", "B", "C"][i % 3],
+            "timestamp": f"2024-{rng.integers(1, 13):02d}-{rng.integers(1, 29):02d}T{i % 24:02d}:00:00",
+            "motor_updrs": float(rng.uniform(5, 60)),
+        }
+        for f in AGGREGATE_FEATURES[1:]:
+            row[f] = None if rng.random() < 0.1 else float(rng.normal(1.0, 0.3))
+        rows.append(row)
+    return rows
+
+
+def read_aggregates(db):
+    return {row["codice_fiscale"]: row for row in db.get_aggregates(["A", "B", "C"])}
+
+
+def assert_same_aggregates(actual, expected):
+    assert actual.keys() == expected.keys()
+    for cf, row in expected.items():
+        for name, value in row.items():
+            if isinstance(value, float):
+                assert actual[cf][name] == pytest.approx(value, rel=1e-9, abs=1e-9), (cf, name)
+            else:
+                assert actual[cf][name] == value, (cf, name)
+
+
+def test_trigger_matches_direct_statistics(db):
+    rows = random_measurements(90)
+    for row in rows:
+        db.insert_measurements([row])
+    aggregates = read_aggregates(db)
+
+    df = pd.DataFrame(rows)
+    for cf, group in df.groupby("codice_fiscale"):
+        aggregate = aggregates[cf]
+        assert aggregate["n_misurazioni"] == len(group)
+        # A parità di timestamp vince l'ultima inserita (trigger con >=)
+        ordered = group.assign(ordine=range(len(group))).sort_values(["timestamp", "ordine"])
+        assert aggregate["primo_updrs"] == ordered["motor_updrs"].iloc[0]
+        assert aggregate["ultimo_updrs"] == ordered["motor_updrs"].iloc[-1]
+        for f in AGGREGATE_FEATURES:
+            values = group[f].dropna().to_numpy(dtype=float)
+            assert aggregate[f"n_{f}"] == len(values)
+            assert aggregate[f"media_{f}"] == pytest.approx(values.mean(), rel=1e-9)
+            assert aggregate[f"m2_{f}"] == pytest.approx(values.var() * len(values), rel=1e-7)
+
+
+@pytest.mark.parametrize("chunk_size", [5, 16, 1000])
+def test_rebuild_with_chan_matches_trigger(db, chunk_size):
+    db.insert_measurements(random_measurements(120, seed=1))
+    maintained = read_aggregates(db)
+
+    assert rebuild_aggregates(db, chunk_size) == 3
+    assert_same_aggregates(read_aggregates(db), maintained)
+
+
+def test_combine_of_chunks_equals_single_aggregate():
+    df = pd.DataFrame(random_measurements(60, seed=2))
+    df["id"] = range(1, len(df) + 1)
+    df = df.reindex(columns=COLUMNS["measurements"])
+
+    whole = aggregate_measurements(df)
+    combined = combine_aggregates(aggregate_measurements(df.iloc[:25]), aggregate_measurements(df.iloc[25:]))
+    for name in whole.columns:
+        if not pd.api.types.is_numeric_dtype(whole[name]):
+            assert list(combined[name]) == list(whole[name])
+        else:
+            np.testing.assert_allclose(combined[name].astype(float), whole[name].astype(float), rtol=1e-9)
+
+
+def test_rebuild_removes_aggregates_without_measurements(db):
+    db.insert_measurements(random_measurements(9, seed=3))
+    db._conn().execute("DELETE FROM measurements WHERE codice_fiscale = 'B'")
+    assert rebuild_aggregates(db) == 2
+    assert set(read_aggregates(db)) == {"A", "C"}
+
+    db._conn().execute("DELETE FROM measurements")
+    assert rebuild_aggregates(db) == 0
+    assert read_aggregates(db) == {}
+
+
+def test_patient_summary_from_aggregate(db):
+    db.insert_measurements([
+        {"codice_fiscale": "A", "timestamp": "2024-01-02", "motor_updrs": 20.0, "jitter": 1.0},
+        {"codice_fiscale": "A", "timestamp": "2024-01-01", "motor_updrs": 15.0, "jitter": 3.0},
+        {"codice_fiscale": "A", "timestamp": "2024-01-03", "motor_updrs": 26.0},
+    ])
+    summary = patient_summary(db.get_aggregate("A"))
+    assert summary["n_misurazioni"] == 3
+    assert (summary["primo_updrs"], summary["ultimo_updrs"], summary["variazione"]) == (15.0, 26.0, 11.0)
+    assert summary["trend"] == "peggioramento"
+    assert summary["media_jitter"] == 2.0
+    assert summary["media_shimmer"] is None
+    assert summary["deviazione_std"]["motor_updrs"] == pytest.approx(np.std([20, 15, 26], ddof=1))
+    assert summary["deviazione_std"]["jitter"] == pytest.approx(np.sqrt(2.0))
+    assert summary["deviazione_std"]["hnr"] is None
@@ -0,0 +1,113 @@
+"""Backend SQLite: cursori e paginazione a chiave (repository)"""
+import pytest
+
+from repository import MEASUREMENT_CURSOR, PATIENT_CURSOR, SqliteRepository, _page, decode_cursor, encode_cursor
+
+
+@pytest.fixture
+def db(tmp_path):
+    return SqliteRepository(tmp_path / "telemonitoring.sqlite3")
+
+
+def add_patients(db, codici_fiscali, doctor="doc"):
+    for cf in codici_fiscali:
+        db.insert_patient({"codice_fiscale": cf, "nome": "N", "cognome": "C", "password_hash": "h",
+                           "doctor_username": doctor})
+
+
+def test_cursor_round_trip():
+    for key, fields in (
+            (("2024-05-01T10:00:00", 42), MEASUREMENT_CURSOR),
+            (("2024-05-01T10:00:00.123456+00:00", 7), MEASUREMENT_CURSOR),
+            (("2024-05-01", 0), MEASUREMENT_CURSOR),
+            (("RSSMRA80A01H501U",), PATIENT_CURSOR),
+            (("è/+?=",), PATIENT_CURSOR),
+    ):
+        cursor = encode_cursor(*key)
+        assert "=" not in cursor
+        assert decode_cursor(cursor, fields) == list(key)
+
+
+@pytest.mark.parametrize("cursor", [
+    "", "!!!", encode_cursor("a"), encode_cursor("a", 1, 2), "eyJhIjogMX0",
+    # Timestamp non stringa o non ISO-8601: nessun carattere arriva al filtro PostgREST
+    encode_cursor(1714557600, 1),
+    encode_cursor(None, 1),
+    encode_cursor("a", 1),
+    encode_cursor('2024-05-01",id.gt.0,timestamp.gt."', 1),
+    encode_cursor("2024-05-01T10:00:00),or(id.gt.0", 1),
+    encode_cursor("2024-05-01,10:00:00", 1),
+    encode_cursor("2024-13-01", 1),
+    # Id non intero
+    encode_cursor("2024-05-01", "1"),
+    encode_cursor("2024-05-01", 1.5),
+    encode_cursor("2024-05-01", True),
+    encode_cursor("2024-05-01", None),
+])
+def test_invalid_cursors_raise_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, MEASUREMENT_CURSOR)
+
+
+@pytest.mark.parametrize("key", [(1,), (None,), (["A"],)])
+def test_patient_cursor_requires_a_string(key):
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(*key), PATIENT_CURSOR)
+
+
+def test_page_reads_one_extra_row_for_the_cursor():
+    rows = [{"timestamp": f"2024-01-0{i + 1}", "id": i} for i in range(4)]
+    assert _page(rows[:3], 3, ("timestamp", "id")) == (rows[:3], None)
+    page, cursor = _page(rows, 3, ("timestamp", "id"))
+    assert page == rows[:3]
+    assert decode_cursor(cursor, MEASUREMENT_CURSOR) == ["2024-01-03", 2]
+
+
+def walk(read_page, limit, **kwargs):
+    """Tutte le pagine seguendo i cursori: lista delle pagine"""
+    pages = []
+    cursor = None
+    while True:
+        rows, cursor = read_page(cursor=cursor, limit=limit, **kwargs)
+        pages.append(rows)
+        if cursor is None:
+            return pages
+
+
+def test_measurements_pages_cover_history_once_in_order(db):
+    # Timestamp ripetuti: l'id risolve i pari merito
+    timestamps = [f"2024-01-{day:02d}" for day in (1, 2, 2, 2, 3, 4, 4, 5, 6, 7, 8)]
+    db.insert_measurements([{"codice_fiscale": "A", "timestamp": t, "motor_updrs": float(i)}
+                            for i, t in enumerate(timestamps)])
+    db.insert_measurements([{"codice_fiscale": "B", "timestamp": "2024-01-03", "motor_updrs": 0.0}])
+
+    for descending in (False, True):
+        pages = walk(db.measurements_page, 3, codice_fiscale="A", descending=descending)
+        assert [len(p) for p in pages] == [3, 3, 3, 2]
+        keys = [(row["timestamp"], row["id"]) for page in pages for row in page]
+        assert keys == sorted(keys, reverse=descending)
+        assert len(set(keys)) == len(timestamps)
+
+
+def test_measurements_page_projection_and_time_window(db):
+    db.insert_measurements([{"codice_fiscale": "A", "timestamp": f"2024-01-{d:02d}", "motor_updrs": float(d)}
+                            for d in range(1, 11)])
+    pages = walk(db.measurements_page, 2, codice_fiscale="A", columns=["motor_updrs"],
+                 since="2024-01-03", until="2024-01-08")
+    rows = [row for page in pages for row in page]
+    assert [row["motor_updrs"] for row in rows] == [3.0, 4.0, 5.0, 6.0, 7.0]
+    # Le colonne della chiave sono aggiunte per il cursore
+    assert set(rows[0]) == {"motor_updrs", "timestamp", "id"}
+
+
+def test_patients_pages_filter_by_doctor(db):
+    add_patients(db, ["P05", "P01", "P03", "P02", "P04"])
+    add_patients(db, ["Q01"], doctor="altro")
+    pages = walk(db.patients_page, 2, doctor_username="doc", columns=["nome"])
+    assert [[row["codice_fiscale"] for row in page] for page in pages] == [["P01", "P02"], ["P03", "P04"], ["P05"]]
+    assert len(walk(db.patients_page, 10)[0]) == 6
+
+
+def test_unknown_columns_are_rejected(db):
+    with pytest.raises(ValueError):
+        db.measurements_page("A", columns=["motor_updrs; DROP TABLE measurements"])
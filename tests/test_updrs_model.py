@@ -0,0 +1,155 @@
+"""Modello UPDRS: kernel vettoriale e registro dei modelli versionati (updrs_model)"""
+import itertools
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from updrs_model import (
+    COEFFICIENTS, DEFAULT_MODEL, FEATURE_ORDER, INTERCEPT, MEANS, STDS, ModelRegistry, UpdrsModel,
+    compute_updrs, features_matrix,
+)
+
+# Modelli distribuiti con il repository
+MODEL_DIR = Path(__file__).resolve().parent.parent / "updrs_models"
+
+VISIT = {'jitter_abs': 5e-5, 'shimmer_local': 0.035, 'nhr': 0.03, 'hnr': 20.1, 'dfa': 0.72, 'ppe': 0.25}
+
+
+def reference_updrs(features):
+    """Formula scalare della versione originale, una feature alla volta"""
+    updrs = INTERCEPT
+    for i, name in enumerate(FEATURE_ORDER):
+        updrs += COEFFICIENTS[i] * (features[name] - MEANS[i]) / STDS[i]
+    return round(min(max(updrs, 0.0), 108.0), 2)
+
+
+def random_visits(n, seed=0):
+    rng = np.random.default_rng(seed)
+    values = MEANS + STDS * rng.standard_normal((n, 6))
+    return [dict(zip(FEATURE_ORDER, row)) for row in values]
+
+
+def test_vectorized_score_matches_scalar_formula():
+    visits = random_visits(500)
+    scores = DEFAULT_MODEL.score(features_matrix(visits))
+    np.testing.assert_allclose(scores, [reference_updrs(v) for v in visits], atol=0.011)
+    assert compute_updrs(VISIT) == reference_updrs(VISIT)
+    assert compute_updrs(VISIT) == DEFAULT_MODEL.score(features_matrix([VISIT]))[0]
+
+
+def test_scores_are_clipped_and_nan_propagates():
+    extreme = features_matrix([dict(VISIT, hnr=-1000.0), dict(VISIT, hnr=1000.0), dict(VISIT, ppe=np.nan)])
+    scores = DEFAULT_MODEL.score(extreme)
+    assert scores[0] == 108.0
+    assert scores[1] == 0.0
+    assert np.isnan(scores[2])
+
+
+def test_score_measurements_accepts_both_column_names():
+    visits = random_visits(20, seed=1)
+    expected = DEFAULT_MODEL.score(features_matrix(visits))
+
+    features = pd.DataFrame(visits, index=range(100, 120))
+    measurements = features.rename(columns={'jitter_abs': 'jitter', 'shimmer_local': 'shimmer'})
+    # Colonne in ordine diverso e colonne in più: contano solo i nomi
+    measurements = measurements[::-1].assign(codice_fiscale="X")[::-1]
+    for df in (features, measurements):
+        scores = DEFAULT_MODEL.score_measurements(df)
+        assert scores.name == "motor_updrs"
+        assert list(scores.index) == list(df.index)
+        np.testing.assert_array_equal(scores.to_numpy(), expected)
+
+
+def test_features_matrix_empty_input():
+    assert features_matrix([]).shape == (0, 6)
+    assert DEFAULT_MODEL.score(features_matrix([])).shape == (0,)
+
+
+# mtime sempre crescenti: il registro riconosce i file cambiati anche su filesystem a bassa risoluzione
+_MTIMES = itertools.count(time.time_ns(), 10 ** 9)
+
+
+def write_file(path, text):
+    path.write_text(text)
+    mtime = next(_MTIMES)
+    os.utime(path, ns=(mtime, mtime))
+
+
+def write_model(directory, version, intercept, **extra):
+    data = {"versione": version, "intercetta": intercept, "coefficienti": {"ppe": 1.0}, **extra}
+    write_file(directory / f"{version}.json", json.dumps(data))
+
+
+def test_shipped_default_model_matches_code():
+    shipped = UpdrsModel.from_file(MODEL_DIR / "tsanas2010-v1.json")
+    visits = features_matrix(random_visits(50, seed=2))
+    np.testing.assert_array_equal(shipped.score(visits), DEFAULT_MODEL.score(visits))
+
+
+def test_from_dict_defaults_transforms_and_validation():
+    model = UpdrsModel.from_dict({
+        "versione": "t", "intercetta": 10.0, "coefficienti": {"hnr": 20.0},
+        "trasformazioni": {"hnr": "reciproco_piu_uno"},
+    })
+    # Medie 0 e deviazioni 1 di default: 10 + 20 / (hnr + 1)
+    assert model.compute(dict(VISIT, hnr=19.0)) == 11.0
+    with pytest.raises(ValueError):
+        UpdrsModel.from_dict({"versione": "x", "intercetta": 0, "coefficienti": {"volume": 1.0}})
+    with pytest.raises(ValueError):
+        UpdrsModel.from_dict({"versione": "x", "intercetta": 0, "coefficienti": {},
+                              "trasformazioni": {"hnr": "logaritmo"}})
+
+
+def test_registry_active_file_pinning_and_unknown_versions(tmp_path):
+    for path in MODEL_DIR.glob("*.json"):
+        shutil.copy(path, tmp_path)
+    registry = ModelRegistry(tmp_path, reload_seconds=0)
+    assert registry.active() is not DEFAULT_MODEL
+    assert registry.active().version == DEFAULT_MODEL.version
+    assert {m["versione"] for m in registry.versions()["modelli"]} == {"tsanas2010-v1", "portale-v1"}
+
+    write_file(tmp_path / "ATTIVO", "portale-v1\n")
+    registry.reload()
+    assert registry.active().version == "portale-v1"
+    assert registry.get("tsanas2010-v1").version == "tsanas2010-v1"
+    with pytest.raises(KeyError):
+        registry.get("inesistente")
+
+    # Versione attiva sconosciuta: resta quella precedente, con l'errore riportato
+    write_file(tmp_path / "ATTIVO", "inesistente")
+    registry.reload()
+    assert registry.active().version == "portale-v1"
+    assert "ATTIVO" in registry.versions()["errori"]
+
+    # UPDRS_MODEL_VERSION vince sul file ATTIVO
+    assert ModelRegistry(tmp_path, active_version="tsanas2010-v1").active().version == "tsanas2010-v1"
+
+
+def test_registry_hot_reload_keeps_previous_model_on_invalid_file(tmp_path):
+    write_model(tmp_path, "prova", 10.0)
+    registry = ModelRegistry(tmp_path, active_version="prova", reload_seconds=0)
+    assert registry.active().intercept == 10.0
+
+    write_model(tmp_path, "prova", 12.0, descrizione="aggiornato")
+    registry.reload()
+    assert registry.active().intercept == 12.0
+
+    # File rotto: il modello caricato in precedenza resta attivo
+    write_file(tmp_path / "prova.json", "{ non è json")
+    registry.reload()
+    assert registry.active().intercept == 12.0
+    assert "prova.json" in registry.versions()["errori"]
+
+    # Controllo dei file al più ogni reload_seconds
+    cached = ModelRegistry(tmp_path, reload_seconds=3600)
+    write_model(tmp_path, "nuovo", 5.0)
+    with pytest.raises(KeyError):
+        cached.get("nuovo")
+    cached.reload()
+    assert cached.get("nuovo").intercept == 5.0
@@ -0,0 +1,83 @@
+"""Kernel DFA e PPE (vocal_measures)"""
+import numpy as np
+import pytest
+
+from vocal_measures import dfa_exponent, dfa_scales, fluctuation, lpc_residual, pitch_period_entropy
+
+
+def naive_fluctuation(profile, scale):
+    """F(n) con un polyfit per finestra, come nella definizione"""
+    n_windows = profile.size // scale
+    x = np.arange(scale)
+    residuals = []
+    for i in range(n_windows):
+        window = profile[i * scale:(i + 1) * scale]
+        trend = np.polyval(np.polyfit(x, window, 1), x)
+        residuals.append((window - trend) ** 2)
+    return np.sqrt(np.concatenate(residuals).mean())
+
+
+def sigmoid(alpha):
+    return 1.0 / (1.0 + np.exp(-alpha))
+
+
+def test_fluctuation_matches_per_window_fit():
+    profile = np.cumsum(np.random.default_rng(0).standard_normal(5003))
+    for scale in (4, 50, 137, 200):
+        assert fluctuation(profile, scale) == pytest.approx(naive_fluctuation(profile, scale), rel=1e-9)
+
+
+def test_scales_follow_sampling_frequency():
+    np.testing.assert_array_equal(dfa_scales(44100), [50, 61, 74, 91, 110, 135, 164, 200])
+    for rate in (8000, 16000, 22050):
+        scales = dfa_scales(rate)
+        assert scales[0] >= 4
+        assert np.all(np.diff(scales) > 0)
+        assert scales[-1] == round(200 * rate / 44100)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_white_and_brownian_noise_exponents(seed):
+    noise = np.random.default_rng(seed).standard_normal(44100)
+    # Rumore bianco: alpha ~ 0.5; moto browniano (rumore integrato): alpha ~ 1.5
+    assert dfa_exponent(noise, 44100) == pytest.approx(sigmoid(0.5), abs=0.02)
+    assert dfa_exponent(np.cumsum(noise), 44100) == pytest.approx(sigmoid(1.5), abs=0.02)
+    # Stesse finestre in secondi a un'altra frequenza di campionamento
+    assert dfa_exponent(noise[:16000], 16000) == pytest.approx(sigmoid(0.5), abs=0.02)
+
+
+def test_degenerate_signals_return_zero():
+    scales = dfa_scales(44100)
+    assert dfa_exponent(np.random.default_rng(0).standard_normal(4 * scales[-1] - 1), 44100) == 0.0
+    assert dfa_exponent(np.ones(44100), 44100) == 0.0
+
+
+def test_lpc_residual_recovers_ar_innovations():
+    rng = np.random.default_rng(0)
+    innovations = rng.standard_normal(5000) * 0.1
+    sequence = np.zeros(5000)
+    for t in range(2, 5000):
+        sequence[t] = 1.2 * sequence[t - 1] - 0.5 * sequence[t - 2] + innovations[t]
+    residual = lpc_residual(sequence, order=2)
+    assert residual.size == sequence.size - 2
+    assert np.corrcoef(residual, innovations[2:])[0, 1] > 0.99
+
+
+def test_ppe_is_scale_invariant_and_bounded():
+    rng = np.random.default_rng(0)
+    f0 = 120 * 2 ** (rng.standard_normal(300) * 0.05 / 12)
+    ppe = pitch_period_entropy(f0)
+    # Semitoni rispetto alla mediana: stessa PPE per una voce un'ottava sopra
+    assert pitch_period_entropy(2 * f0) == pytest.approx(ppe)
+    assert 0.0 < ppe < 1.0
+    # Più variabilità non spiegata dalla predizione lineare -> entropia maggiore
+    unstable = 120 * 2 ** (rng.standard_normal(300) / 12)
+    assert ppe < pitch_period_entropy(unstable) <= 1.0
+
+
+def test_ppe_ignores_unvoiced_frames_and_short_sequences():
+    f0 = 120 * 2 ** (np.random.default_rng(1).standard_normal(200) * 0.1 / 12)
+    with_gaps = np.insert(f0, [10, 50, 120], [0.0, np.nan, -1.0])
+    assert pitch_period_entropy(with_gaps) == pitch_period_entropy(f0)
+    assert pitch_period_entropy(f0[:11]) == 0.0
+    assert pitch_period_entropy(np.full(300, 120.0)) == 0.0
@@ -0,0 +1,230 @@
+"""Coda locale e consegna differita delle misurazioni (write_behind)"""
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+from async_repository import ThreadedRepository
+from repository import SqliteRepository
+from write_behind import BASELINE, MEASUREMENT, MeasurementOutbox, WriteBehind, _is_permanent
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return MeasurementOutbox(tmp_path / "outbox.sqlite3")
+
+
+@pytest.fixture
+def db(tmp_path):
+    repository = SqliteRepository(tmp_path / "telemonitoring.sqlite3")
+    for cf in ("A", "B"):
+        repository.insert_patient({"codice_fiscale": cf, "nome": "N", "cognome": "C", "password_hash": "h"})
+    return repository
+
+
+def measurement(cf, timestamp, updrs=20.0):
+    return {"codice_fiscale": cf, "timestamp": timestamp, "motor_updrs": updrs}
+
+
+def test_outbox_keeps_order_and_acknowledges(outbox):
+    assert outbox.enqueue([measurement("A", "1"), measurement("B", "2")], {"A": 20.0}) == 3
+    assert outbox.enqueue([measurement("A", "3")]) == 1
+    batch = outbox.next_batch(10)
+    assert [(kind, cf) for _, kind, cf, _ in batch] == [
+        (MEASUREMENT, "A"), (MEASUREMENT, "B"), (BASELINE, "A"), (MEASUREMENT, "A"),
+    ]
+    assert [payload["timestamp"] for _, kind, _, payload in batch if kind == MEASUREMENT] == ["1", "2", "3"]
+    # Ogni misurazione ha la sua chiave di idempotenza
+    assert len({payload["client_id"] for _, kind, _, payload in batch if kind == MEASUREMENT}) == 3
+
+    outbox.acknowledge([seq for seq, _, _, _ in batch[:2]])
+    assert outbox.pending() == 2
+    assert [seq for seq, _, _, _ in outbox.next_batch(10)] == [seq for seq, _, _, _ in batch[2:]]
+    assert len(outbox.next_batch(1)) == 1
+
+
+def test_first_queued_baseline_wins(outbox):
+    outbox.enqueue([measurement("A", "1")], {"A": 20.0})
+    assert outbox.enqueue([measurement("A", "2")], {"A": 25.0}) == 1
+    baselines = [payload for _, kind, _, payload in outbox.next_batch(10) if kind == BASELINE]
+    assert baselines == [20.0]
+
+
+def test_outbox_survives_reopen(tmp_path):
+    MeasurementOutbox(tmp_path / "outbox.sqlite3").enqueue([measurement("A", "1")])
+    assert MeasurementOutbox(tmp_path / "outbox.sqlite3").pending() == 1
+
+
+def test_record_failure_moves_measurement_and_its_baselines(outbox):
+    outbox.enqueue([measurement("A", "1")], {"A": 20.0})
+    outbox.enqueue([measurement("B", "2")], {"B": 30.0})
+    seq = outbox.next_batch(1)[0][0]
+    assert outbox.record_failure(seq, ValueError("rifiutata"), max_attempts=2) == []
+    moved = outbox.record_failure(seq, ValueError("rifiutata"), max_attempts=2)
+    assert len(moved) == 2
+    assert outbox.dead_letters() == 2
+    assert [(kind, cf) for _, kind, cf, _ in outbox.next_batch(10)] == [(MEASUREMENT, "B"), (BASELINE, "B")]
+
+
+def test_error_classification():
+    assert _is_permanent(sqlite3.IntegrityError("NOT NULL constraint failed"))
+    assert _is_permanent(sqlite3.OperationalError("table measurements has no column named x"))
+    assert not _is_permanent(sqlite3.OperationalError("database is locked"))
+    assert not _is_permanent(ConnectionError("rete"))
+
+    class APIError(Exception):
+        def __init__(self, code):
+            super().__init__(code)
+            self.code = code
+
+    assert _is_permanent(APIError("23505"))
+    assert _is_permanent(APIError("PGRST204"))
+    assert not _is_permanent(APIError("PGRST000"))
+    assert not _is_permanent(APIError("57014"))
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_delivery_is_ordered_and_idempotent(outbox, db):
+    async def scenario():
+        write_behind = WriteBehind(outbox, ThreadedRepository(db), batch_size=3, interval=60)
+        await write_behind.start()
+
+        # Crash tra la scrittura e la rimozione dalla coda: il blocco viene riconsegnato
+        acknowledge = outbox.acknowledge
+        calls = []
+
+        def crash_once(seqs):
+            calls.append(seqs)
+            if len(calls) == 1:
+                raise OSError("crash")
+            acknowledge(seqs)
+
+        outbox.acknowledge = crash_once
+        # Oltre batch_size voci: il task in background consegna subito
+        await write_behind.submit([measurement("A", f"2024-01-{d:02d}", float(d)) for d in range(1, 8)],
+                                  {"A": 1.0})
+        assert write_behind.queued == 8
+        for _ in range(100):
+            if write_behind.failures:
+                break
+            await asyncio.sleep(0.01)
+        assert write_behind.failures == 1
+        await write_behind.stop()
+        return write_behind
+
+    write_behind = run(scenario())
+    assert write_behind.queued == 0
+    assert outbox.pending() == 0
+    rows = db._conn().execute("SELECT motor_updrs FROM measurements ORDER BY id").fetchall()
+    assert [row[0] for row in rows] == [float(d) for d in range(1, 8)]
+    assert db.get_aggregate("A")["n_misurazioni"] == 7
+    assert db.get_patient("A")["baseline_updrs"] == 1.0
+
+
+def test_queued_baseline_does_not_overwrite_existing_one(outbox, db):
+    async def scenario():
+        write_behind = WriteBehind(outbox, ThreadedRepository(db), interval=60)
+        await write_behind.start()
+        await write_behind.submit([measurement("A", "1", 20.0)], {"A": 20.0})
+        # Baseline impostata nel frattempo da un altro processo
+        db.set_missing_baselines({"A": 15.0})
+        await write_behind.stop()
+
+    run(scenario())
+    assert db.get_patient("A")["baseline_updrs"] == 15.0
+
+
+def test_permanent_errors_go_to_dead_letters_without_blocking(outbox, db):
+    async def scenario():
+        write_behind = WriteBehind(outbox, ThreadedRepository(db), batch_size=10, interval=60, max_attempts=3)
+        await write_behind.start()
+        await write_behind.submit([measurement("A", "1")], {"A": 20.0})
+        await write_behind.submit([measurement("B", None)], {"B": 30.0})
+        await write_behind.submit([measurement("A", "3")])
+        for _ in range(2):
+            with pytest.raises(sqlite3.IntegrityError):
+                await write_behind.flush()
+            # La misurazione valida prima di quella rifiutata è consegnata, le successive aspettano
+            assert outbox.pending() == 3
+        await write_behind.flush()
+        return write_behind
+
+    write_behind = run(scenario())
+    assert outbox.pending() == 0
+    assert write_behind.dead_letters == 2
+    assert write_behind.queued == 0
+    timestamps = [row[0] for row in db._conn().execute("SELECT timestamp FROM measurements ORDER BY id")]
+    assert timestamps == ["1", "3"]
+    assert db.get_patient("B")["baseline_updrs"] is None
+
+
+def test_rejected_baseline_does_not_redeliver_acknowledged_measurements(outbox, db):
+    class BaselineRejected(ThreadedRepository):
+        async def set_missing_baselines(self, baselines):
+            raise ValueError("baseline non valida")
+
+    async def scenario():
+        write_behind = WriteBehind(outbox, BaselineRejected(db), interval=60, max_attempts=1)
+        await write_behind.start()
+        await write_behind.submit([measurement("A", "1"), measurement("B", "2")], {"A": 20.0})
+        await write_behind.flush()
+        return write_behind
+
+    write_behind = run(scenario())
+    # Le misurazioni confermate dal blocco non ripassano dalla consegna una alla volta
+    assert write_behind.delivered == 2
+    assert write_behind.dead_letters == 1
+    assert write_behind.queued == 0
+    assert outbox.pending() == 0
+    assert db._conn().execute("SELECT COUNT(*) FROM measurements").fetchone()[0] == 2
+    assert db.get_patient("A")["baseline_updrs"] is None
+
+
+def test_queued_count_survives_flush_during_submit(outbox, db):
+    async def scenario():
+        write_behind = WriteBehind(outbox, ThreadedRepository(db), interval=60)
+        await write_behind.start()
+        await write_behind.submit([measurement("A", str(i)) for i in range(10)])
+
+        # Il salvataggio locale di submit resta in corso mentre flush consegna la coda
+        enqueue = outbox.enqueue
+        gate = threading.Event()
+
+        def slow_enqueue(rows, baselines=None):
+            gate.wait(5)
+            return enqueue(rows, baselines)
+
+        outbox.enqueue = slow_enqueue
+        submit = asyncio.create_task(write_behind.submit([measurement("B", "10")]))
+        await asyncio.sleep(0.05)
+        await write_behind.flush()
+        assert write_behind.queued == 0
+        gate.set()
+        await submit
+        return write_behind
+
+    write_behind = run(scenario())
+    assert write_behind.queued == outbox.pending() == 1
+
+
+def test_transient_errors_are_retried_indefinitely(outbox, db):
+    class Unavailable:
+        async def insert_measurements_once(self, rows):
+            raise ConnectionError("database irraggiungibile")
+
+    async def scenario():
+        write_behind = WriteBehind(outbox, Unavailable(), interval=60, max_attempts=1)
+        await write_behind.start()
+        await write_behind.submit([measurement("A", "1")])
+        for _ in range(5):
+            with pytest.raises(ConnectionError):
+                await write_behind.flush()
+        return write_behind
+
+    write_behind = run(scenario())
+    assert outbox.pending() == 1
+    assert write_behind.dead_letters == 0
@@ -0,0 +1,283 @@
+"""
+Modello UPDRS motorio dalle 6 feature vocali.
+
+Separato da main.py perché serve anche a strumenti che non devono
+connettersi a Supabase (benchmark, confronti tra estrattori, ricalcolo).
+
+Medie, deviazioni standard e coefficienti sono array nell'ordine di
+FEATURE_ORDER: un unico kernel vettoriale (UpdrsModel.score) calcola sia la
+singola visita (compute_updrs) sia migliaia di righe storiche
+(UpdrsModel.score_measurements), così i due percorsi non possono divergere.
+
+I modelli sono versionati: ogni file JSON in UPDRS_MODEL_DIR è un modello
+(vedi UpdrsModel.from_dict) e ModelRegistry li ricarica quando cambiano,
+senza riavvio. La versione usata è salvata in measurements.model_version.
+
+Configurazione da variabili d'ambiente:
+- UPDRS_MODEL_DIR: cartella dei modelli (default "updrs_models")
+- UPDRS_MODEL_VERSION: versione attiva; se assente si legge il file ATTIVO
+  nella cartella, altrimenti il modello predefinito
+- UPDRS_MODEL_RELOAD_SECONDS: intervallo minimo tra due controlli dei file (default 10)
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Ordine delle colonne della matrice (N, 6) delle feature
+FEATURE_ORDER = ('jitter_abs', 'shimmer_local', 'nhr', 'hnr', 'dfa', 'ppe')
+
+# Colonne corrispondenti nella tabella measurements
+MEASUREMENT_COLUMNS = {
+    'jitter_abs': 'jitter',
+    'shimmer_local': 'shimmer',
+    'nhr': 'nhr',
+    'hnr': 'hnr',
+    'dfa': 'dfa',
+    'ppe': 'ppe',
+}
+
+# Valori medi e deviazioni standard dal dataset Parkinson's Telemonitoring
+# Fonte: Tsanas et al. (2010), Little et al. (2008)
+MEANS = np.array([0.00004, 0.030, 0.025, 21.7, 0.718, 0.206])
+STDS = np.array([0.00006, 0.018, 0.040, 4.3, 0.055, 0.090])
+
+# Coefficienti calibrati da letteratura scientifica
+# Basato su Multiple Linear Regression con feature selection ottimale
+# I coefficienti positivi indicano correlazione positiva con severità Parkinson
+# Il coefficiente negativo per HNR indica che valori più bassi = maggiore severità
+COEFFICIENTS = np.array([
+    3.2,   # Jitter aumenta con severità (+)
+    2.8,   # Shimmer aumenta con severità (+)
+    2.5,   # NHR aumenta con severità (+)
+    -1.8,  # HNR diminuisce con severità (-)
+    2.1,   # DFA aumenta con severità (+)
+    1.9,   # PPE aumenta con severità (+)
+])
+INTERCEPT = 21.0  # Baseline (UPDRS medio nel dataset ~21 punti)
+
+# Range valido UPDRS motorio
+UPDRS_MIN = 0.0
+UPDRS_MAX = 108.0
+
+# Trasformazioni applicate a una feature prima della normalizzazione
+TRANSFORMS = {
+    "identita": lambda x: x,
+    "reciproco_piu_uno": lambda x: 1.0 / (x + 1.0),
+}
+
+
+class UpdrsModel:
+    """Regressione lineare sulle feature (eventualmente trasformate) normalizzate z-score"""
+
+    def __init__(self, version, means, stds, coefficients, intercept, transforms=None, description=""):
+        self.version = version
+        self.means = np.asarray(means, dtype=float)
+        self.stds = np.asarray(stds, dtype=float)
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.intercept = float(intercept)
+        self.transforms = dict(transforms or {})
+        self.description = description
+        # File da cui è stato caricato (None per i modelli definiti nel codice)
+        self.source = None
+        for name, transform in self.transforms.items():
+            if name not in FEATURE_ORDER or transform not in TRANSFORMS:
+                raise ValueError(f"trasformazione non valida: {name}={transform}")
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Modello da un dict (il contenuto di un file JSON):
+        {"versione", "descrizione", "intercetta", "coefficienti": {feature: valore},
+         "medie": {...} (default 0), "deviazioni": {...} (default 1),
+         "trasformazioni": {feature: "reciproco_piu_uno"} (opzionale)}
+        """
+        means = data.get("medie", {})
+        stds = data.get("deviazioni", {})
+        coefficients = data["coefficienti"]
+        unknown = set(coefficients) | set(means) | set(stds)
+        unknown -= set(FEATURE_ORDER)
+        if unknown:
+            raise ValueError(f"feature sconosciute: {', '.join(sorted(unknown))}")
+        return cls(
+            version=data["versione"],
+            means=[means.get(name, 0.0) for name in FEATURE_ORDER],
+            stds=[stds.get(name, 1.0) for name in FEATURE_ORDER],
+            coefficients=[coefficients.get(name, 0.0) for name in FEATURE_ORDER],
+            intercept=data["intercetta"],
+            transforms=data.get("trasformazioni"),
+            description=data.get("descrizione", ""),
+        )
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def score(self, features):
+        """
+        Kernel vettoriale: matrice (N, 6) di feature in ordine FEATURE_ORDER -> N punteggi UPDRS.
+
+        Trasformazioni, normalizzazione z-score, combinazione lineare,
+        arrotondamento a 2 decimali e limite al range 0-108.
+        Una riga con feature NaN produce NaN.
+        """
+        features = np.atleast_2d(np.asarray(features, dtype=float))
+        if self.transforms:
+            features = features.copy()
+            for name, transform in self.transforms.items():
+                column = FEATURE_ORDER.index(name)
+                features[:, column] = TRANSFORMS[transform](features[:, column])
+        updrs = self.intercept + ((features - self.means) / self.stds) @ self.coefficients
+        return np.clip(np.round(updrs, 2), UPDRS_MIN, UPDRS_MAX)
+
+    def compute(self, features):
+        """UPDRS di una singola visita (dict di feature) con lo stesso kernel"""
+        return float(self.score(features_matrix([features]))[0])
+
+    def score_measurements(self, df):
+        """
+        Punteggi UPDRS di un DataFrame di measurements (colonne jitter, shimmer,
+        nhr, hnr, dfa, ppe) o di feature (colonne di FEATURE_ORDER), in un colpo solo.
+        Ritorna una Series allineata all'indice del DataFrame.
+        """
+        columns = [name if name in df.columns else MEASUREMENT_COLUMNS[name] for name in FEATURE_ORDER]
+        return pd.Series(self.score(df[columns].to_numpy(dtype=float)), index=df.index, name="motor_updrs")
+
+    def describe(self):
+        return {"versione": self.version, "descrizione": self.description}
+
+
+# Modello predefinito, sempre disponibile anche senza file
+DEFAULT_MODEL = UpdrsModel(
+    "tsanas2010-v1", MEANS, STDS, COEFFICIENTS, INTERCEPT,
+    description="Regressione lineare calibrata su Tsanas et al. (2010)"
+)
+
+
+def features_matrix(rows):
+    """Lista di dict di feature (chiavi di FEATURE_ORDER) -> matrice (N, 6)"""
+    return np.array([[row[name] for name in FEATURE_ORDER] for row in rows], dtype=float).reshape(-1, 6)
+
+
+def compute_updrs(features, model=DEFAULT_MODEL):
+    """
+    Calcola UPDRS motorio con regressione lineare calibrata e normalizzazione.
+    Basato su Tsanas et al. (2010) - IEEE Transactions on Biomedical Engineering
+
+    Normalizzazione basata su statistiche del dataset Parkinson's Telemonitoring originale:
+    - Dataset: 5,875 registrazioni da 42 pazienti
+    - Range UPDRS: 7-54 punti (scala 0-108)
+    - MAE stimato: ~8-10 punti
+    """
+    return model.compute(features)
+
+
+class ModelRegistry:
+    """
+    Modelli versionati letti da una cartella di file JSON, ricaricati quando
+    un file cambia (controllo al più ogni `reload_seconds`). Un file non
+    valido non sostituisce i modelli già caricati: l'errore resta in `errors`.
+    """
+
+    ACTIVE_FILE = "ATTIVO"
+
+    def __init__(self, directory, active_version=None, reload_seconds=10.0):
+        self.directory = Path(directory)
+        self.pinned_version = active_version
+        self.reload_seconds = reload_seconds
+        self.errors = {}
+        self._models = {DEFAULT_MODEL.version: DEFAULT_MODEL}
+        self._active = DEFAULT_MODEL.version
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def _scan(self):
+        try:
+            return tuple(sorted(
+                (p.name, p.stat().st_mtime_ns) for p in self.directory.iterdir()
+                if p.suffix == ".json" or p.name == self.ACTIVE_FILE
+            ))
+        except OSError:
+            return ()
+
+    def reload(self):
+        """Rilegge la cartella se qualche file è cambiato"""
+        snapshot = self._scan()
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if snapshot == self._snapshot:
+                return
+            self._snapshot = snapshot
+
+            models = {DEFAULT_MODEL.version: DEFAULT_MODEL}
+            errors = {}
+            for path in sorted(self.directory.glob("*.json")):
+                try:
+                    model = UpdrsModel.from_file(path)
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    errors[path.name] = str(e)
+                    # Resta la versione caricata in precedenza, se c'era
+                    previous = self._find_by_file(path.name)
+                    if previous is not None:
+                        models[previous.version] = previous
+                    continue
+                model.source = path.name
+                models[model.version] = model
+
+            active = self.pinned_version or self._read_active_file() or DEFAULT_MODEL.version
+            if active not in models:
+                errors[self.ACTIVE_FILE] = f"versione attiva sconosciuta: {active}"
+                active = self._active if self._active in models else DEFAULT_MODEL.version
+
+            self._models = models
+            self._active = active
+            self.errors = errors
+
+    def _find_by_file(self, name):
+        for model in self._models.values():
+            if getattr(model, "source", None) == name:
+                return model
+        return None
+
+    def _read_active_file(self):
+        try:
+            return (self.directory / self.ACTIVE_FILE).read_text().strip() or None
+        except OSError:
+            return None
+
+    def _maybe_reload(self):
+        if time.monotonic() - self._checked_at >= self.reload_seconds:
+            self.reload()
+
+    def get(self, version=None):
+        """Modello di una versione (default: quello attivo); KeyError se sconosciuta"""
+        self._maybe_reload()
+        models = self._models
+        return models[version or self._active]
+
+    def active(self):
+        return self.get()
+
+    def versions(self):
+        self._maybe_reload()
+        return {
+            "attivo": self._active,
+            "modelli": [model.describe() for model in self._models.values()],
+            "errori": dict(self.errors),
+        }
+
+
+def registry_from_env():
+    """Crea il registro leggendo UPDRS_MODEL_DIR, UPDRS_MODEL_VERSION e UPDRS_MODEL_RELOAD_SECONDS"""
+    return ModelRegistry(
+        os.environ.get("UPDRS_MODEL_DIR", "updrs_models"),
+        active_version=os.environ.get("UPDRS_MODEL_VERSION") or None,
+        reload_seconds=float(os.environ.get("UPDRS_MODEL_RELOAD_SECONDS", "10")),
+    )
@@ -0,0 +1,456 @@
+"""
+Analisi acustica condivisa tra API (main.py) e portale Streamlit (app_fixed.py).
+
+Gli oggetti intermedi di Praat (Pitch, PointProcess, Harmonicity, Intensity)
+vengono calcolati una sola volta per registrazione da un AnalysisGraph e
+condivisi da tutte le feature che ne hanno bisogno. I contorni di pitch e
+intensità sono letti come array NumPy interi, non frame per frame: su 10 s
+a 44.1 kHz la lettura scende da ~6.5 ms a ~0.03 ms, ma il calcolo di Pitch
+e Intensity in Praat (120-180 ms) resta: per il contorno completo il guadagno
+è di pochi punti percentuali (~1.05×, vedi bench_features.py).
+"""
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import parselmouth
+
+from audio_io import decode_wav, open_wav, read_frames
+from vocal_measures import dfa_exponent, pitch_period_entropy
+from signal_conditioning import (
+    TRIM_FRAME_SECONDS, TRIM_THRESHOLD_DB, condition, conditioning_tag,
+    frame_levels_db, mix_to_mono, trim_frame_length
+)
+
+# Parametri di analisi (Tsanas et al. 2010)
+PITCH_FLOOR = 75
+PITCH_CEILING = 500
+TIME_STEP = 0.01
+
+# Range di ricerca del pitch adattato al paziente (ADAPTIVE_PITCH=0 usa sempre 75-500 Hz)
+ADAPTIVE_PITCH = os.environ.get("ADAPTIVE_PITCH", "1") != "0"
+# Range a priori per sesso (patients.sex: 1 = M, 0 = F) e correzione per età:
+# con l'età F0 scende nelle donne e sale negli uomini
+MALE_PITCH_RANGE = (60, 300)
+FEMALE_PITCH_RANGE = (100, 450)
+ELDERLY_AGE = 60
+ELDERLY_FEMALE_PITCH_FLOOR = 85
+ELDERLY_MALE_PITCH_CEILING = 330
+# Prima stima di F0: passo ampio, solo per restringere il range (De Looze & Hirst 2008)
+FIRST_PASS_TIME_STEP = 0.04
+MIN_FIRST_PASS_FRAMES = 10
+
+# Metodo PPE: "entropy" (Little et al. 2009) o "ratio" (approssimazione storica)
+PPE_METHOD = os.environ.get("PPE_METHOD", "entropy")
+
+# Versione dell'estrattore: va incrementata a ogni modifica che cambia i valori
+# delle feature, così le cache indirizzate per contenuto non restituiscono valori vecchi
+EXTRACTOR_VERSION = f"5-ppe_{PPE_METHOD}-{conditioning_tag()}"
+
+# Analisi a finestre per registrazioni lunghe (memoria indipendente dalla durata)
+WINDOW_SECONDS = float(os.environ.get("WINDOW_SECONDS", "10"))
+WINDOW_OVERLAP_SECONDS = float(os.environ.get("WINDOW_OVERLAP_SECONDS", "1"))
+LONG_RECORDING_SECONDS = float(os.environ.get("LONG_RECORDING_SECONDS", "120"))
+# Fonazione minima perché una finestra venga analizzata
+MIN_VOICED_SECONDS = 0.5
+
+
+class StageTimer:
+    """
+    Cronometro che accumula la durata (in secondi) di ogni stage di estrazione.
+
+    I tempi sono esclusivi: se uno stage ne innesca un altro (es. jitter che
+    richiede il PointProcess) il tempo del figlio non è contato due volte.
+    """
+
+    def __init__(self, timings=None):
+        self.timings = timings if timings is not None else {}
+        self._children = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        self._children.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            own = elapsed - self._children.pop()
+            self.timings[name] = self.timings.get(name, 0.0) + own
+            if self._children:
+                self._children[-1] += elapsed
+
+
+def intensity_contour(intensity):
+    """Contorno di intensità (dB) come array, con i frame indefiniti rimossi"""
+    values = np.asarray(intensity.values[0], dtype=float)
+    return values[~np.isnan(values)]
+
+
+def pitch_contour(pitch):
+    """Contorno F0 (Hz) come array; i frame non sonori (0 Hz o NaN) sono rimossi"""
+    values = np.asarray(pitch.selected_array['frequency'], dtype=float)
+    values[values <= 0] = np.nan
+    return values[~np.isnan(values)]
+
+
+def pitch_prior(sex=None, age=None):
+    """
+    Range di ricerca (floor, ceiling) in Hz dai dati anagrafici del paziente.
+    Senza sesso noto, o con ADAPTIVE_PITCH disattivato, è il range fisso 75-500 Hz.
+    """
+    if not ADAPTIVE_PITCH or sex not in (0, 1):
+        return PITCH_FLOOR, PITCH_CEILING
+    elderly = age is not None and age >= ELDERLY_AGE
+    if sex == 1:
+        floor, ceiling = MALE_PITCH_RANGE
+        if elderly:
+            ceiling = ELDERLY_MALE_PITCH_CEILING
+    else:
+        floor, ceiling = FEMALE_PITCH_RANGE
+        if elderly:
+            floor = ELDERLY_FEMALE_PITCH_FLOOR
+    return floor, ceiling
+
+
+@contextmanager
+def pitch_range_mode(adaptive):
+    """Forza il range di pitch fisso o adattivo (ADAPTIVE_PITCH) per la durata del blocco"""
+    global ADAPTIVE_PITCH
+    previous = ADAPTIVE_PITCH
+    ADAPTIVE_PITCH = adaptive
+    try:
+        yield
+    finally:
+        ADAPTIVE_PITCH = previous
+
+
+def refine_pitch_range(sound, prior):
+    """
+    Restringe il range a priori con una prima stima economica di F0 (passo
+    FIRST_PASS_TIME_STEP): floor = 0.75 * Q1, ceiling = 1.5 * Q3, entro il
+    range a priori. Con troppi pochi frame sonori resta il range a priori.
+    """
+    floor, ceiling = prior
+    first_pass = sound.to_pitch(time_step=FIRST_PASS_TIME_STEP, pitch_floor=floor, pitch_ceiling=ceiling)
+    values = pitch_contour(first_pass)
+    if values.size < MIN_FIRST_PASS_FRAMES:
+        return prior
+    q1, q3 = np.percentile(values, [25, 75])
+    refined_floor = max(floor, 0.75 * q1)
+    refined_ceiling = min(ceiling, 1.5 * q3)
+    if refined_ceiling <= refined_floor:
+        return prior
+    return refined_floor, refined_ceiling
+
+
+class AnalysisGraph:
+    """
+    Grafo di analisi di una registrazione.
+
+    Ogni intermedio è calcolato alla prima richiesta e poi riusato:
+    - pitch_range: range di ricerca F0 (a priori o raffinato da una prima stima)
+    - pitch: un solo passaggio di autocorrelazione (cc)
+    - point_process: derivato dal Pitch già calcolato, senza nuova scansione
+    - harmonicity, intensity: un passaggio ciascuno
+    Anche i valori delle feature sono memorizzati (es. NHR riusa HNR).
+    """
+
+    def __init__(self, sound, timer=None, prior=(PITCH_FLOOR, PITCH_CEILING)):
+        self.sound = sound
+        self.timer = timer if timer is not None else StageTimer()
+        self.prior = prior
+        self._nodes = {}
+
+    def _node(self, name, build):
+        if name not in self._nodes:
+            with self.timer.stage(name):
+                self._nodes[name] = build()
+        return self._nodes[name]
+
+    @property
+    def pitch_range(self):
+        if not ADAPTIVE_PITCH:
+            return self.prior
+        return self._node("pitch_range", lambda: refine_pitch_range(self.sound, self.prior))
+
+    @property
+    def pitch(self):
+        floor, ceiling = self.pitch_range
+        return self._node("pitch", lambda: self.sound.to_pitch_cc(
+            time_step=TIME_STEP, pitch_floor=floor, pitch_ceiling=ceiling
+        ))
+
+    @property
+    def point_process(self):
+        return self._node("point_process", lambda: parselmouth.praat.call(
+            [self.sound, self.pitch], "To PointProcess (cc)"
+        ))
+
+    @property
+    def harmonicity(self):
+        floor, _ = self.pitch_range
+        return self._node("harmonicity", lambda: parselmouth.praat.call(
+            self.sound, "To Harmonicity (cc)", TIME_STEP, floor, 0.1, 1.0
+        ))
+
+    @property
+    def intensity(self):
+        return self._node("intensity", lambda: self.sound.to_intensity(time_step=TIME_STEP))
+
+    @property
+    def signal(self):
+        """Campioni del segnale (media dei canali se stereo)"""
+        return self._node("signal", lambda: np.asarray(self.sound.values, dtype=float).mean(axis=0))
+
+    @property
+    def pitch_values(self):
+        return self._node("pitch_values", lambda: pitch_contour(self.pitch))
+
+    @property
+    def intensity_values(self):
+        return self._node("intensity_values", lambda: intensity_contour(self.intensity))
+
+    def feature(self, name):
+        """Valore di una feature registrata in FEATURES, calcolato una sola volta"""
+        return self._node(name, lambda: float(FEATURES[name](self)))
+
+
+# Registro delle feature: nome -> funzione(graph) -> float.
+# Una nuova feature si aggiunge con @feature("nome") e riusa gli intermedi del grafo.
+FEATURES = {}
+
+
+def feature(name):
+    def register(fn):
+        FEATURES[name] = fn
+        return fn
+    return register
+
+
+@feature("jitter_abs")
+def _jitter_abs(graph):
+    # JITTER (Absolute): variabilità frequenza fondamentale (F0)
+    return parselmouth.praat.call(
+        graph.point_process, "Get jitter (local, absolute)", 0, 0, 0.0001, 0.02, 1.3
+    )
+
+
+@feature("shimmer_local")
+def _shimmer_local(graph):
+    # SHIMMER (Local): variabilità ampiezza
+    return parselmouth.praat.call(
+        [graph.sound, graph.point_process], "Get shimmer (local)", 0, 0, 0.0001, 0.02, 1.3, 1.6
+    )
+
+
+@feature("hnr")
+def _hnr(graph):
+    # HNR: rapporto armoniche/rumore
+    return parselmouth.praat.call(graph.harmonicity, "Get mean", 0, 0)
+
+
+@feature("nhr")
+def _nhr(graph):
+    # NHR: noise-to-harmonics ratio (inverso di HNR)
+    hnr = graph.feature("hnr")
+    return 1.0 / (hnr + 1e-6) if hnr > 0 else 1.0
+
+
+@feature("dfa")
+def _dfa(graph):
+    # DFA: esponente di scaling sul segnale a livello di campione (Little et al. 2007)
+    return dfa_exponent(graph.signal, graph.sound.sampling_frequency)
+
+
+@feature("dfa_cv")
+def _dfa_cv(graph):
+    # DFA approssimata storica: coefficiente di variazione del contorno di intensità
+    values = graph.intensity_values
+    if values.size > 10:
+        return np.std(values) / (np.mean(values) + 1e-6)
+    return 0.0
+
+
+@feature("ppe")
+def _ppe(graph):
+    # PPE: metodo scelto con PPE_METHOD
+    return graph.feature(f"ppe_{PPE_METHOD}")
+
+
+@feature("ppe_entropy")
+def _ppe_entropy(graph):
+    # PPE: entropia dei residui della predizione lineare del pitch in semitoni
+    return pitch_period_entropy(graph.pitch_values)
+
+
+@feature("ppe_ratio")
+def _ppe_ratio(graph):
+    # PPE approssimata storica: variabilità relativa delle differenze di F0
+    values = graph.pitch_values
+    if values.size > 5:
+        pitch_diffs = np.diff(values)
+        return np.std(pitch_diffs) / (np.mean(np.abs(pitch_diffs)) + 1e-6)
+    return 0.0
+
+
+FEATURE_NAMES = ('jitter_abs', 'shimmer_local', 'hnr', 'nhr', 'dfa', 'ppe')
+
+
+def extract_features(sound, timings=None, features=FEATURE_NAMES, sex=None, age=None):
+    """
+    Estrae le feature vocali da un parselmouth.Sound con un unico AnalysisGraph.
+
+    Se `timings` è un dict, viene popolato con la durata esclusiva di ogni
+    intermedio (pitch, point_process, harmonicity, intensity, ...) e di ogni feature.
+    `sex` (1 = M, 0 = F) e `age` del paziente scelgono il range di ricerca del pitch.
+    """
+    graph = AnalysisGraph(sound, StageTimer(timings), prior=pitch_prior(sex, age))
+    return {name: graph.feature(name) for name in features}
+
+
+def prepare_sound(samples, sampling_frequency):
+    """parselmouth.Sound pronto per l'analisi: mono, senza silenzi ai bordi, durata limitata, ricampionato"""
+    signal, rate = condition(samples, sampling_frequency)
+    return parselmouth.Sound(signal, rate)
+
+
+def extract_features_from_path(audio_path, timings=None, sex=None, age=None):
+    """Carica un file audio, lo condiziona ed estrae le feature"""
+    timer = StageTimer(timings)
+    with timer.stage("decode"):
+        sound = parselmouth.Sound(str(audio_path))
+    with timer.stage("conditioning"):
+        sound = prepare_sound(sound.values, sound.sampling_frequency)
+    return extract_features(sound, timings=timer.timings, sex=sex, age=age)
+
+
+def sound_from_wav(data):
+    """parselmouth.Sound condizionato dai byte di un WAV, decodificati in memoria senza file temporanei"""
+    samples, sampling_frequency = decode_wav(data)
+    return prepare_sound(samples, sampling_frequency)
+
+
+def extract_features_from_wav(data, timings=None, sex=None, age=None):
+    """Estrae le feature dai byte di un WAV (entry point per i worker del pool)"""
+    timer = StageTimer(timings)
+    with timer.stage("decode"):
+        samples, sampling_frequency = decode_wav(data)
+    with timer.stage("conditioning"):
+        sound = prepare_sound(samples, sampling_frequency)
+    return extract_features(sound, timings=timer.timings, sex=sex, age=age)
+
+
+def _voiced_frames(buffer, layout, frame, block_frames):
+    """
+    Maschera dei frame di energia sonori su tutto il file, calcolata a blocchi:
+    la soglia è relativa al frame più forte dell'intera registrazione.
+    """
+    levels = []
+    for start in range(0, layout.n_frames, block_frames):
+        samples = read_frames(buffer, layout, start, start + block_frames)
+        levels.append(frame_levels_db(mix_to_mono(samples), frame))
+    level_db = np.concatenate(levels)
+    return level_db > level_db.max() - TRIM_THRESHOLD_DB
+
+
+def _weighted_mean(values, weights):
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    valid = np.isfinite(values)
+    if not valid.any():
+        return float("nan")
+    return float(np.average(values[valid], weights=weights[valid]))
+
+
+def extract_features_windowed(source, window_seconds=WINDOW_SECONDS,
+                              overlap_seconds=WINDOW_OVERLAP_SECONDS, features=FEATURE_NAMES,
+                              timings=None, sex=None, age=None):
+    """
+    Estrazione a finestre sovrapposte con memoria di picco indipendente dalla durata.
+
+    `source` è un percorso (il WAV viene mappato in memoria) o i byte del WAV.
+    Ogni finestra con almeno MIN_VOICED_SECONDS di fonazione viene ritagliata
+    sui frame sonori, condizionata e analizzata; le feature sono aggregate con
+    media pesata sulla fonazione di ciascuna finestra.
+
+    Ritorna {"features": {...}, "finestre": [{"inizio", "fine", "fonazione", <feature>...}]}.
+    Se `timings` è un dict, accumula i tempi per stage di tutte le finestre.
+    """
+    timer = StageTimer(timings)
+    layout, buffer = open_wav(source)
+    rate = layout.sampling_frequency
+    frame = trim_frame_length(rate)
+
+    # Finestre e passo multipli del frame di energia, così la maschera si allinea
+    window = max(int(window_seconds * rate) // frame, 1) * frame
+    hop = max(window - int(overlap_seconds * rate) // frame * frame, frame)
+    with timer.stage("energy_scan"):
+        voiced = _voiced_frames(buffer, layout, frame, window)
+
+    windows = []
+    for start in range(0, layout.n_frames, hop):
+        stop = min(start + window, layout.n_frames)
+        active = np.flatnonzero(voiced[start // frame:stop // frame])
+        voiced_seconds = active.size * TRIM_FRAME_SECONDS
+
+        if voiced_seconds >= MIN_VOICED_SECONDS:
+            first = start + active[0] * frame
+            last = start + (active[-1] + 1) * frame
+            # Trimming già fatto con la soglia globale: qui solo mono e ricampionamento
+            with timer.stage("conditioning"):
+                signal, signal_rate = condition(
+                    read_frames(buffer, layout, first, last), rate, max_seconds=0, threshold_db=0
+                )
+            values = extract_features(
+                parselmouth.Sound(signal, signal_rate), timings=timer.timings, features=features,
+                sex=sex, age=age
+            )
+            windows.append({
+                "inizio": round(float(first) / rate, 3),
+                "fine": round(float(last) / rate, 3),
+                "fonazione": round(voiced_seconds, 3),
+                **values
+            })
+
+        if stop == layout.n_frames:
+            break
+
+    if not windows:
+        raise ValueError("nessun tratto sonoro nella registrazione")
+
+    weights = [w["fonazione"] for w in windows]
+    aggregated = {name: _weighted_mean([w[name] for w in windows], weights) for name in features}
+    return {"features": aggregated, "finestre": windows}
+
+
+def analyze_wav(data, windowed=False, sex=None, age=None):
+    """
+    Entry point del pool di analisi: risultato (feature, o feature e finestre
+    con windowed=True) e tempi per stage, da esporre come metriche.
+    """
+    timings = {}
+    if windowed:
+        result = extract_features_windowed(data, timings=timings, sex=sex, age=age)
+    else:
+        result = extract_features_from_wav(data, timings=timings, sex=sex, age=age)
+    return result, timings
+
+
+def extractor_version(windowed=False, sex=None, age=None):
+    """
+    Versione dell'estrattore per le chiavi di cache: l'analisi a finestre e
+    ogni range di pitch a priori producono valori propri
+    """
+    version = EXTRACTOR_VERSION + ("-finestre" if windowed else "")
+    if ADAPTIVE_PITCH:
+        floor, ceiling = pitch_prior(sex, age)
+        version += f"-f0_{floor:g}-{ceiling:g}"
+    return version
+
+
+def wav_duration(data):
+    """Durata in secondi di un WAV dai soli header"""
+    layout, _ = open_wav(data)
+    return layout.n_frames / layout.sampling_frequency
@@ -0,0 +1,112 @@
+"""
+Misure non lineari sul segnale vocale, implementate solo con NumPy.
+
+- dfa_exponent: Detrended Fluctuation Analysis sul segnale a livello di
+  campione (Little et al. 2007, usata da Tsanas et al. 2010)
+- pitch_period_entropy: Pitch Period Entropy (Little et al. 2009)
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Finestre DFA in campioni a 44.1 kHz (Little et al. 2007): riscalate
+# in proporzione per registrazioni a frequenze diverse
+DFA_MIN_SCALE = 50
+DFA_MAX_SCALE = 200
+DFA_N_SCALES = 8
+DFA_REFERENCE_RATE = 44100.0
+
+# PPE: ordine del filtro di predizione lineare e istogramma dei residui (semitoni)
+PPE_LPC_ORDER = 2
+PPE_BINS = 30
+PPE_SPAN = 3.0
+
+
+def dfa_scales(sampling_frequency, n_scales=DFA_N_SCALES):
+    """Dimensioni delle finestre DFA (in campioni), equispaziate in scala logaritmica"""
+    ratio = sampling_frequency / DFA_REFERENCE_RATE
+    scales = np.geomspace(DFA_MIN_SCALE * ratio, DFA_MAX_SCALE * ratio, n_scales)
+    return np.unique(np.maximum(np.round(scales).astype(int), 4))
+
+
+def fluctuation(profile, scale):
+    """
+    Fluttuazione F(n) del profilo integrato su finestre non sovrapposte di n campioni.
+
+    Le finestre sono una vista (reshape senza copia) e il detrending lineare
+    è un unico minimo quadrati in forma chiusa su tutte le finestre insieme.
+    """
+    n_windows = profile.size // scale
+    windows = profile[:n_windows * scale].reshape(n_windows, scale)
+
+    x = np.arange(scale, dtype=float)
+    x -= x.mean()
+    sxx = np.dot(x, x)
+
+    centered = windows - windows.mean(axis=1, keepdims=True)
+    slopes = centered @ x / sxx
+    # Residuo del fit lineare: sum((y - mean)^2) - slope^2 * Sxx, per finestra
+    rss = np.einsum("ij,ij->i", centered, centered) - slopes ** 2 * sxx
+    return np.sqrt(max(rss.sum(), 0.0) / (n_windows * scale))
+
+
+def dfa_exponent(signal, sampling_frequency, scales=None):
+    """
+    Esponente di scaling DFA del segnale, trasformato con la sigmoide
+    1 / (1 + exp(-alpha)) come nel dataset Parkinson's Telemonitoring.
+
+    Ritorna 0.0 se il segnale è troppo corto per la scala più grande.
+    """
+    signal = np.asarray(signal, dtype=float)
+    if scales is None:
+        scales = dfa_scales(sampling_frequency)
+    if signal.size < 4 * scales[-1]:
+        return 0.0
+
+    # Profilo: somma cumulativa del segnale a media nulla
+    profile = np.cumsum(signal - signal.mean())
+    fluctuations = np.array([fluctuation(profile, n) for n in scales])
+    if np.any(fluctuations <= 0):
+        return 0.0
+
+    alpha = np.polyfit(np.log(scales), np.log(fluctuations), 1)[0]
+    return float(1.0 / (1.0 + np.exp(-alpha)))
+
+
+def semitones(f0):
+    """Sequenza F0 in semitoni rispetto alla mediana del parlante"""
+    f0 = np.asarray(f0, dtype=float)
+    return 12.0 * np.log2(f0 / np.median(f0))
+
+
+def lpc_residual(sequence, order=PPE_LPC_ORDER):
+    """
+    Residuo di un filtro di predizione lineare di ordine `order` stimato ai
+    minimi quadrati: rimuove la correlazione "liscia" della sequenza (whitening).
+    """
+    sequence = np.asarray(sequence, dtype=float)
+    sequence = sequence - sequence.mean()
+    # Riga t: [x[t], x[t+1], ..., x[t+order]], vista senza copia
+    lagged = sliding_window_view(sequence, order + 1)
+    predictors = lagged[:, :order]
+    target = lagged[:, order]
+    coef, *_ = np.linalg.lstsq(predictors, target, rcond=None)
+    return target - predictors @ coef
+
+
+def pitch_period_entropy(f0, order=PPE_LPC_ORDER, bins=PPE_BINS, span=PPE_SPAN):
+    """
+    Pitch Period Entropy: entropia (normalizzata in [0, 1]) della distribuzione
+    dei residui di predizione lineare della sequenza di pitch in semitoni.
+
+    I residui sono raccolti in `bins` classi su [-span, span] semitoni (i valori
+    esterni cadono nelle classi estreme). Ritorna 0.0 con troppi pochi frame sonori.
+    """
+    f0 = np.asarray(f0, dtype=float)
+    f0 = f0[np.isfinite(f0) & (f0 > 0)]
+    if f0.size < order + 10:
+        return 0.0
+
+    residual = lpc_residual(semitones(f0), order)
+    counts, _ = np.histogram(np.clip(residual, -span, span), bins=bins, range=(-span, span))
+    p = counts[counts > 0] / counts.sum()
+    return float(-(p * np.log(p)).sum() / np.log(bins))
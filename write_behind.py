@@ -0,0 +1,379 @@
+"""
+Scrittura differita (write-behind) delle misurazioni.
+
+Con la scrittura diretta ogni /visit attende l'insert su measurements (e
+l'eventuale aggiornamento della baseline) prima di rispondere: la latenza
+del database si somma a quella dell'analisi. Con WRITE_BEHIND=1 la visita
+viene confermata appena la misurazione è salvata in una coda locale su
+SQLite (commit con synchronous=FULL: sopravvive a un crash del processo o
+della macchina); un task in background la consegna al database.
+
+Consegna:
+- a blocchi: fino a WRITE_BEHIND_BATCH voci con un solo insert, appena la
+  coda raggiunge quella dimensione o al più ogni WRITE_BEHIND_INTERVAL_SECONDS;
+- in ordine: le voci escono in ordine di accodamento, da un solo task, e
+  la baseline di un paziente è aggiornata solo dopo l'insert della sua
+  misurazione (mai una baseline senza la misurazione corrispondente), e
+  solo se nel database è ancora vuota: una baseline scritta nel frattempo
+  (altro worker, portale) non viene sovrascritta;
+- almeno una volta, senza duplicati: una voce è tolta dalla coda solo dopo
+  la scrittura riuscita; se il database non risponde resta in coda e si
+  riprova. Ogni misurazione riceve all'accodamento un client_id (UUID) e
+  viene inserita con ON CONFLICT DO NOTHING su di esso (migrations/003):
+  un blocco riconsegnato dopo un crash tra la scrittura e la rimozione non
+  duplica le misurazioni né gli aggregati.
+- errori temporanei (database irraggiungibile, timeout, lock) lasciano il
+  blocco in coda e si riprova senza limiti. Un errore permanente (vincolo
+  violato, colonna sconosciuta, dato non valido) bloccherebbe la coda per
+  sempre: il blocco viene riconsegnato una voce alla volta, in ordine, e la
+  voce che fallisce per WRITE_BEHIND_MAX_ATTEMPTS giri di fila passa nella
+  tabella dead_letters del file della coda (insieme alle baseline in coda
+  dello stesso paziente), da dove va ispezionata e reinserita a mano;
+- all'arresto del server la coda viene svuotata; quello che non si riesce a
+  consegnare resta nel file e parte al riavvio successivo.
+
+Finché una misurazione è in coda non compare nello storico né negli
+aggregati. Il file della coda è di un solo processo server: con più worker
+ognuno deve avere il proprio WRITE_BEHIND_PATH.
+
+Configurazione da variabili d'ambiente:
+- WRITE_BEHIND: "1" per attivare la scrittura differita (default disattivata)
+- WRITE_BEHIND_PATH: file della coda (default "measurement_outbox.sqlite3")
+- WRITE_BEHIND_BATCH: voci per blocco (default 500)
+- WRITE_BEHIND_INTERVAL_SECONDS: attesa massima prima di una consegna (default 1)
+- WRITE_BEHIND_MAX_ATTEMPTS: tentativi per una voce con errore permanente (default 5)
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from anyio import to_thread
+
+MEASUREMENT = "misurazione"
+BASELINE = "baseline"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_writes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    codice_fiscale TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS pending_writes_kind_cf ON pending_writes (kind, codice_fiscale);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    seq INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    codice_fiscale TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    error TEXT,
+    failed_at REAL NOT NULL
+);
+"""
+
+# Classi SQLSTATE di Postgres che non si risolvono riprovando:
+# 22 dato non valido, 23 vincolo violato, 42 colonna/tabella inesistente
+_PERMANENT_SQLSTATES = ("22", "23", "42")
+
+
+def _is_permanent(error):
+    """True se l'errore si ripeterebbe identico a ogni nuovo tentativo"""
+    if isinstance(error, (sqlite3.IntegrityError, ValueError, TypeError, KeyError)):
+        return True
+    if isinstance(error, sqlite3.OperationalError):
+        return "no such" in str(error) or "has no column" in str(error)
+    # Errori di PostgREST (postgrest.APIError): codice SQLSTATE o PGRSTxxx
+    code = str(getattr(error, "code", None) or "")
+    if code.startswith(_PERMANENT_SQLSTATES):
+        return True
+    # PGRST0xx: connessione al database; PGRST1xx/2xx: richiesta o schema non validi
+    return code.startswith(("PGRST1", "PGRST2"))
+
+
+class MeasurementOutbox:
+    """Coda SQLite delle scritture in attesa di consegna, in ordine di accodamento"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Conferma al client solo dopo l'fsync: la coda è la copia durevole della visita
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(_SCHEMA)
+        # Code create prima del conteggio dei tentativi
+        if "attempts" not in {row[1] for row in self._conn.execute("PRAGMA table_info(pending_writes)")}:
+            self._conn.execute("ALTER TABLE pending_writes ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+    def enqueue(self, rows, baselines=None):
+        """
+        Accoda misurazioni e baseline ({codice_fiscale: updrs}) in un'unica
+        transazione; ogni misurazione riceve un client_id (chiave di
+        idempotenza della consegna). Una baseline già in coda per lo stesso
+        paziente vince: le visite successive non la sovrascrivono prima
+        della consegna. Ritorna il numero di voci accodate.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO pending_writes (kind, codice_fiscale, payload, created_at) VALUES (?, ?, ?, ?)",
+                    [
+                        (MEASUREMENT, row["codice_fiscale"], json.dumps({"client_id": uuid.uuid4().hex, **row}), now)
+                        for row in rows
+                    ]
+                )
+                added = len(rows)
+                for codice_fiscale, updrs in (baselines or {}).items():
+                    added += self._conn.execute(
+                        "INSERT INTO pending_writes (kind, codice_fiscale, payload, created_at) "
+                        "SELECT ?, ?, ?, ? WHERE NOT EXISTS "
+                        "(SELECT 1 FROM pending_writes WHERE kind = ? AND codice_fiscale = ?)",
+                        (BASELINE, codice_fiscale, json.dumps(updrs), now, BASELINE, codice_fiscale)
+                    ).rowcount
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return added
+
+    def next_batch(self, limit):
+        """Le `limit` voci più vecchie: lista di (seq, tipo, codice_fiscale, valore)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, kind, codice_fiscale, payload FROM pending_writes ORDER BY seq LIMIT ?",
+                (int(limit),)
+            ).fetchall()
+        return [(seq, kind, cf, json.loads(payload)) for seq, kind, cf, payload in rows]
+
+    def acknowledge(self, seqs):
+        """Rimuove le voci consegnate"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM pending_writes WHERE seq IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(seqs)),)
+            )
+
+    def record_failure(self, seq, error, max_attempts):
+        """
+        Conta un tentativo fallito con errore permanente per la voce `seq`.
+        Al tentativo `max_attempts` la voce passa in dead_letters; se è una
+        misurazione la seguono le baseline in coda dello stesso paziente.
+        Ritorna i seq delle voci spostate (vuoto se la voce resta in coda).
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("UPDATE pending_writes SET attempts = attempts + 1 WHERE seq = ?", (seq,))
+                row = self._conn.execute(
+                    "SELECT kind, codice_fiscale, attempts FROM pending_writes WHERE seq = ?", (seq,)
+                ).fetchone()
+                if row is None or row[2] < max_attempts:
+                    self._conn.execute("COMMIT")
+                    return []
+                kind, codice_fiscale, _ = row
+                condition = "seq = ?"
+                params = [seq]
+                if kind == MEASUREMENT:
+                    condition += " OR (kind = ? AND codice_fiscale = ?)"
+                    params += [BASELINE, codice_fiscale]
+                self._conn.execute(
+                    "INSERT INTO dead_letters (seq, kind, codice_fiscale, payload, created_at, attempts, error, failed_at) "
+                    f"SELECT seq, kind, codice_fiscale, payload, created_at, attempts, ?, ? FROM pending_writes WHERE {condition}",
+                    (str(error), now, *params)
+                )
+                moved = [r[0] for r in self._conn.execute(f"SELECT seq FROM pending_writes WHERE {condition}", params)]
+                self._conn.execute(f"DELETE FROM pending_writes WHERE {condition}", params)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return moved
+
+    def pending(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pending_writes").fetchone()[0]
+
+    def dead_letters(self):
+        """Voci scartate dopo troppi errori permanenti"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+
+    def oldest_age(self):
+        """Secondi dalla voce più vecchia in coda (0 con la coda vuota)"""
+        with self._lock:
+            oldest = self._conn.execute("SELECT MIN(created_at) FROM pending_writes").fetchone()[0]
+        return 0.0 if oldest is None else time.time() - oldest
+
+
+class WriteBehind:
+    """
+    Consegna in background della coda al repository asincrono (vedi
+    async_repository.py). submit() ritorna quando le scritture sono
+    durevoli nella coda locale.
+    """
+
+    def __init__(self, outbox, db, batch_size=500, interval=1.0, max_attempts=5):
+        self.outbox = outbox
+        self.db = db
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.delivered = 0
+        self.failures = 0
+        self.dead_letters = 0
+        self.last_error = None
+        self._queued = 0
+        self._stopping = False
+        self._wake = None
+        self._task = None
+
+    async def start(self):
+        # Creati dentro l'event loop; le voci rimaste da un avvio precedente partono per prime
+        self._wake = asyncio.Event()
+        self._queued = await to_thread.run_sync(self.outbox.pending)
+        self.dead_letters = await to_thread.run_sync(self.outbox.dead_letters)
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def queued(self):
+        """Voci in coda, contate in memoria (senza query: leggibile dall'event loop)"""
+        return self._queued
+
+    async def submit(self, rows, baselines=None):
+        """Accoda misurazioni e baseline ({codice_fiscale: updrs}); ritorna a salvataggio locale avvenuto"""
+        added = await to_thread.run_sync(self.outbox.enqueue, rows, baselines)
+        # Incremento dopo l'await: un flush concorrente può aver già scalato _queued
+        self._queued += added
+        if self._queued >= self.batch_size:
+            self._wake.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # Le voci non consegnate restano in coda, si riprova al prossimo giro
+                self.failures += 1
+                self.last_error = str(e)
+            if self._stopping:
+                return
+
+    async def flush(self):
+        """Consegna tutto quello che è in coda, a blocchi e in ordine"""
+        while True:
+            batch = await to_thread.run_sync(self.outbox.next_batch, self.batch_size)
+            if not batch:
+                self._queued = 0
+                return
+            acknowledged = set()
+            try:
+                await self._deliver(batch, acknowledged)
+            except Exception as e:
+                if not _is_permanent(e):
+                    raise
+                # Una voce non valida non deve bloccare le altre: una alla volta,
+                # in ordine, saltando quelle già confermate da _deliver
+                done = set(acknowledged)
+                for entry in batch:
+                    if entry[0] not in done:
+                        done.update(await self._deliver_one(entry))
+            if len(batch) < self.batch_size:
+                return
+
+    async def _deliver(self, batch, acknowledged=None):
+        """Consegna il blocco; i seq confermati nella coda finiscono in `acknowledged`"""
+        if acknowledged is None:
+            acknowledged = set()
+        measurements = [entry for entry in batch if entry[1] == MEASUREMENT]
+        baselines = [entry for entry in batch if entry[1] == BASELINE]
+
+        # Prima tutte le misurazioni del blocco con un insert, poi le baseline:
+        # ogni baseline in coda segue la propria misurazione
+        if measurements:
+            await self.db.insert_measurements_once([payload for _, _, _, payload in measurements])
+            await to_thread.run_sync(self.outbox.acknowledge, [seq for seq, _, _, _ in measurements])
+            acknowledged.update(seq for seq, _, _, _ in measurements)
+            self.delivered += len(measurements)
+            self._dequeued(len(measurements))
+        if baselines:
+            await self.db.set_missing_baselines({cf: updrs for _, _, cf, updrs in baselines})
+            await to_thread.run_sync(self.outbox.acknowledge, [seq for seq, _, _, _ in baselines])
+            acknowledged.update(seq for seq, _, _, _ in baselines)
+            self._dequeued(len(baselines))
+
+    def _dequeued(self, n):
+        # Aggiornato a ogni rimozione dalla coda: corretto anche se il blocco fallisce a metà
+        self._queued = max(self._queued - n, 0)
+
+    async def _deliver_one(self, entry):
+        """
+        Consegna una sola voce; se fallisce con errore permanente conta il
+        tentativo e, se la voce non è passata in dead_letters, rilancia
+        l'errore (le voci successive aspettano: l'ordine è preservato).
+        Ritorna i seq delle voci scartate.
+        """
+        try:
+            await self._deliver([entry])
+        except Exception as e:
+            if not _is_permanent(e):
+                raise
+            moved = await to_thread.run_sync(self.outbox.record_failure, entry[0], e, self.max_attempts)
+            if not moved:
+                raise
+            self.dead_letters += len(moved)
+            self._dequeued(len(moved))
+            self.last_error = str(e)
+            return moved
+        return []
+
+    async def stop(self):
+        """
+        Svuota la coda e ferma il task. Non lo cancella: un blocco a metà
+        consegna verrebbe riconsegnato al riavvio. Quello che non si riesce
+        a consegnare resta nel file.
+        """
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+
+    def stats(self):
+        return {
+            "in_coda": self.outbox.pending(),
+            "attesa_massima_s": round(self.outbox.oldest_age(), 3),
+            "consegnate": self.delivered,
+            "errori": self.failures,
+            "scartate": self.dead_letters,
+            "ultimo_errore": self.last_error,
+        }
+
+
+def write_behind_from_env(db):
+    """WriteBehind configurato da WRITE_BEHIND_*, oppure None se la scrittura differita è disattivata"""
+    if os.environ.get("WRITE_BEHIND", "0").lower() not in ("1", "true", "si", "sì"):
+        return None
+    return WriteBehind(
+        MeasurementOutbox(os.environ.get("WRITE_BEHIND_PATH", "measurement_outbox.sqlite3")),
+        db,
+        batch_size=int(os.environ.get("WRITE_BEHIND_BATCH", "500")),
+        interval=float(os.environ.get("WRITE_BEHIND_INTERVAL_SECONDS", "1")),
+        max_attempts=int(os.environ.get("WRITE_BEHIND_MAX_ATTEMPTS", "5")),
+    )